@@ -0,0 +1,348 @@
+"""
+Microbenchmarks for the PyVESC codec. Run with:
+
+    python benchmark.py [section ...]
+
+With no arguments every section is run.
+"""
+import random
+import sys
+import timeit
+
+# payload sizes used by test.py: small, medium and large packets
+PAYLOAD_SIZES = (4, 256, 1023)
+
+
+def _random_payload(length):
+    return bytes(random.getrandbits(8) for i in range(length))
+
+
+def _rate(func, min_time=0.2):
+    """
+    Runs func repeatedly for at least min_time seconds.
+    :return: calls per second.
+    """
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    while elapsed < min_time:
+        number *= 2
+        elapsed = timer.timeit(number)
+    return number / elapsed
+
+
+def bench_crc():
+    """
+    Frames per second of frame() + unframe() for each CRC engine. 'crccheck' is the engine PyVESC used before the
+    built-in CRC engine, and is only measured if the crccheck package is installed.
+    """
+    import pyvesc.protocol.packet.codec as vesc_packet
+    from pyvesc.protocol.packet import crc
+
+    engines = dict(crc.ENGINES)
+    try:
+        from crccheck.crc import CrcXmodem
+        engines['crccheck'] = CrcXmodem().calc
+    except ImportError:
+        pass
+
+    print("CRC engine: frames/sec (frame + unframe)")
+    print("%-10s" % "engine" + "".join("%14s" % ("%u B" % size) for size in PAYLOAD_SIZES))
+    original = crc.crc16
+    try:
+        for name, engine in engines.items():
+            crc.crc16 = engine
+            row = "%-10s" % name
+            for size in PAYLOAD_SIZES:
+                payload = _random_payload(size)
+                row += "%14.0f" % _rate(lambda: vesc_packet.unframe(vesc_packet.frame(payload)))
+            print(row)
+    finally:
+        crc.crc16 = original
+
+
+def _telemetry_buffer(count):
+    """
+    A buffer of count framed GetValues replies, as read from a serial port.
+    """
+    import pyvesc
+    from pyvesc.VESC.messages import GetValues
+    msg = GetValues(*range(1, len(GetValues.fields.subcons) + 1))
+    return pyvesc.encode(msg) * count
+
+
+def _allocations(func):
+    """
+    Runs func and measures the memory it allocates.
+    :return: (number of blocks still alive when func returns, peak number of bytes allocated while it ran)
+    """
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    del result
+    return sum(stat.count_diff for stat in stats), peak
+
+
+def bench_zero_copy():
+    """
+    Allocations and rate of unframing and decoding GetValues telemetry with and without zero copy payloads, for
+    buffers read as bytes and as bytearray. locate_all finds the payloads without taking them out of the buffer, which
+    is how decode_all with zero_copy decodes the messages in place.
+    """
+    import collections
+    import pyvesc
+    import pyvesc.protocol.packet.codec as vesc_packet
+
+    count = 1000
+    print("Zero copy: %u GetValues packets" % count)
+    print("%-40s%10s%12s%14s" % ("", "blocks", "peak bytes", "packets/sec"))
+    for buffer_type in (bytes, bytearray):
+        buffer = buffer_type(_telemetry_buffer(count))
+        for zero_copy in (False, True):
+            name = "unframe_all %s zero_copy=%s" % (buffer_type.__name__, zero_copy)
+            blocks, peak = _allocations(lambda: vesc_packet.unframe_all(buffer, zero_copy=zero_copy))
+            rate = _rate(lambda: vesc_packet.unframe_all(buffer, zero_copy=zero_copy)) * count
+            print("%-40s%10u%12u%14.0f" % (name, blocks, peak, rate))
+        name = "locate_all %s" % buffer_type.__name__
+        blocks, peak = _allocations(lambda: collections.deque(vesc_packet.locate_all(buffer), maxlen=0))
+        rate = _rate(lambda: collections.deque(vesc_packet.locate_all(buffer), maxlen=0)) * count
+        print("%-40s%10u%12u%14.0f" % (name, blocks, peak, rate))
+        for zero_copy in (False, True):
+            name = "decode_all %s zero_copy=%s" % (buffer_type.__name__, zero_copy)
+            blocks, peak = _allocations(lambda: pyvesc.decode_all(buffer, zero_copy=zero_copy))
+            rate = _rate(lambda: pyvesc.decode_all(buffer, zero_copy=zero_copy)) * count
+            print("%-40s%10u%12u%14.0f" % (name, blocks, peak, rate))
+
+
+def bench_resync():
+    """
+    Throughput of resynchronizing on a noisy line: megabytes of random noise with valid GetValues frames mixed in,
+    parsed in one pass and as a stream of serial sized chunks.
+    """
+    import time
+    import pyvesc.protocol.packet.codec as vesc_packet
+
+    frame = _telemetry_buffer(1)
+    print("Resync: random noise with valid frames mixed in")
+    # frames behind a noise candidate whose header claims more bytes than were received stay unread in the Stateful
+    # buffer at the end of the stream, until that many more bytes arrive
+    print("%-10s%-12s%10s%10s%12s%10s%10s" % ("noise", "mode", "frames", "found", "skipped", "unread", "MB/s"))
+    for megabytes in (1, 4):
+        frames = megabytes * 1000
+        noise = bytes(random.getrandbits(8) for i in range(megabytes * 2 ** 20))
+        step = len(noise) // frames
+        buffer = b''.join(noise[i * step:(i + 1) * step] + frame for i in range(frames))
+
+        start = time.perf_counter()
+        payloads, consumed, tail = vesc_packet.unframe_all(buffer)
+        elapsed = time.perf_counter() - start
+        skipped = consumed - len(payloads) * len(frame)
+        print("%-10s%-12s%10u%10u%12u%10u%10.1f" % ("%u MB" % megabytes, "unframe_all", frames, len(payloads), skipped,
+                                                   len(tail), len(buffer) / elapsed / 2 ** 20))
+
+        start = time.perf_counter()
+        unframer = vesc_packet.Stateful()
+        found = 0
+        for i in range(0, len(buffer), 4096):
+            unframer.feed(buffer[i:i + 4096])
+            found += sum(1 for payload in unframer)
+        elapsed = time.perf_counter() - start
+        print("%-10s%-12s%10u%10u%12u%10u%10.1f" % ("%u MB" % megabytes, "Stateful", frames, found, unframer.skipped,
+                                                   len(unframer), len(buffer) / elapsed / 2 ** 20))
+
+
+def _sample_message(msg_cls):
+    """
+    A message of msg_cls with every field filled in.
+    """
+    from construct import FormatField, BytesInteger, GreedyRange, Renamed
+    values = []
+    for index, subcon in enumerate(msg_cls.fields.subcons):
+        field = subcon.subcon if isinstance(subcon, Renamed) else subcon
+        if isinstance(field, FormatField):
+            values.append(1.5 if field.fmtstr[-1] in 'fd' else index + 1)
+        elif isinstance(field, BytesInteger):
+            values.append(2 ** (8 * field.length) - 1)
+        elif isinstance(field, GreedyRange):
+            values.append([1, 2, 3])
+        else:
+            values.append('sample')
+    return msg_cls(*values)
+
+
+def bench_decode():
+    """
+    Decode rate of every registered message with the compiled struct decoder and with construct.
+    """
+    from pyvesc.protocol.base import VESCMessage
+    import pyvesc.VESC.messages
+
+    print("Message decode: messages/sec")
+    print("%-22s%14s%14s%10s" % ("message", "construct", "compiled", "speedup"))
+    for msg_id, msg_cls in sorted(VESCMessage._msg_registry.items()):
+        payload = VESCMessage.pack(_sample_message(msg_cls))
+        construct_rate = _rate(lambda: VESCMessage._unpack_construct(msg_cls, payload))
+        compiled_rate = _rate(lambda: VESCMessage.unpack(payload))
+        print("%-22s%14.0f%14.0f%9.1fx" % (msg_cls.__name__, construct_rate, compiled_rate,
+                                          compiled_rate / construct_rate))
+
+
+def bench_encode():
+    """
+    Time to encode setpoints and requests to packets, with the compiled encoders and with construct.
+    """
+    import pyvesc
+    import pyvesc.protocol.packet.codec as vesc_packet
+    from construct import Struct
+    from pyvesc.protocol.base import VESCMessage
+    from pyvesc.VESC.messages import SetCurrent, SetRPM, SetDutyCycle, GetValues, Alive
+
+    cases = (
+        ("SetCurrent", lambda: SetCurrent(5.0)),
+        ("SetRPM", lambda: SetRPM(1000)),
+        ("SetDutyCycle", lambda: SetDutyCycle(0.5)),
+        ("SetCurrent can_id=3", lambda: SetCurrent(5.0, can_id=3)),
+        ("Alive", lambda: Alive()),
+    )
+    print("Message encode: microseconds per packet")
+    print("%-22s%12s%12s" % ("message", "construct", "compiled"))
+    for name, make in cases:
+        construct_time = 1e6 / _rate(lambda: vesc_packet.frame(VESCMessage._pack_construct(make())))
+        compiled_time = 1e6 / _rate(lambda: pyvesc.encode(make()))
+        print("%-22s%12.2f%12.2f" % (name, construct_time, compiled_time))
+    request_fmt = Struct(VESCMessage._id_fmt)
+    construct_time = 1e6 / _rate(lambda: vesc_packet.frame(request_fmt.build({'msg_id': int(GetValues.id)})))
+    compiled_time = 1e6 / _rate(lambda: pyvesc.encode_request(GetValues))
+    print("%-22s%12.2f%12.2f" % ("request GetValues", construct_time, compiled_time))
+
+
+def bench_batch():
+    """
+    Rate of decoding GetValues telemetry to message objects and to numpy arrays with decode_batch.
+    """
+    import pyvesc
+    from pyvesc.VESC.messages import GetValues
+    try:
+        import numpy
+    except ImportError:
+        print("Batch decode: numpy is not installed")
+        return
+
+    count = 10000
+    payloads, consumed, tail = pyvesc.unframe_all(_telemetry_buffer(count), zero_copy=True)
+    print("Batch decode: %u GetValues payloads, samples/sec" % count)
+    print("%-30s%14.0f" % ("VESCMessage.unpack", _rate(lambda: [pyvesc.VESCMessage.unpack(p) for p in payloads]) * count))
+    print("%-30s%14.0f" % ("decode_batch", _rate(lambda: pyvesc.decode_batch(payloads, GetValues)) * count))
+    print("%-30s%14.0f" % ("decode_batch columns=True",
+                           _rate(lambda: pyvesc.decode_batch(payloads, GetValues, columns=True)) * count))
+
+
+def bench_memory():
+    """
+    Memory per decoded GetValues message: a plain object with a __dict__ (how messages were stored before they used
+    __slots__), a message object and its Frozen variant. 'object' is the size of the object itself (and its __dict__),
+    'total' also counts the field values.
+    """
+    import tracemalloc
+    import pyvesc
+    from pyvesc.VESC.messages import GetValues
+
+    class DictMessage(object):
+        pass
+
+    def dict_message(msg):
+        instance = DictMessage()
+        for name in GetValues._field_names + ('can_id',):
+            setattr(instance, name, getattr(msg, name))
+        return instance
+
+    def object_size(instance):
+        return sys.getsizeof(instance) + (sys.getsizeof(instance.__dict__) if hasattr(instance, '__dict__') else 0)
+
+    count = 10000
+    payloads, consumed, tail = pyvesc.unframe_all(_telemetry_buffer(count))
+    cases = (
+        ("__dict__", lambda: [dict_message(pyvesc.VESCMessage.unpack(p)) for p in payloads]),
+        ("__slots__", lambda: [pyvesc.VESCMessage.unpack(p) for p in payloads]),
+        ("Frozen", lambda: [pyvesc.VESCMessage.unpack(p, frozen=True) for p in payloads]),
+    )
+    print("Memory: bytes per GetValues message, %u messages" % count)
+    print("%-12s%10s%10s" % ("storage", "object", "total"))
+    for name, decode in cases:
+        tracemalloc.start()
+        try:
+            baseline = tracemalloc.get_traced_memory()[0]
+            messages = decode()
+            size = tracemalloc.get_traced_memory()[0] - baseline
+        finally:
+            tracemalloc.stop()
+        print("%-12s%10u%10.0f" % (name, object_size(messages[0]), size / count))
+        del messages
+
+
+def bench_lazy():
+    """
+    Time to decode a GetValues payload and read one field (as VESC.get_rpm does) or every field, decoding all fields
+    up front and lazily.
+    """
+    from pyvesc.protocol.base import VESCMessage
+    from pyvesc.VESC.messages import GetValues
+
+    payload = VESCMessage.pack(_sample_message(GetValues))
+    names = GetValues._field_names
+
+    def read_all(msg):
+        for name in names:
+            getattr(msg, name)
+
+    print("Lazy decode: microseconds per GetValues message")
+    print("%-12s%12s%12s" % ("", "eager", "lazy"))
+    print("%-12s%12.2f%12.2f" % ("rpm only", 1e6 / _rate(lambda: VESCMessage.unpack(payload).rpm),
+                                  1e6 / _rate(lambda: VESCMessage.unpack(payload, lazy=True).rpm)))
+    print("%-12s%12.2f%12.2f" % ("all fields", 1e6 / _rate(lambda: read_all(VESCMessage.unpack(payload))),
+                                  1e6 / _rate(lambda: read_all(VESCMessage.unpack(payload, lazy=True)))))
+
+
+def bench_broadcast():
+    """
+    Time to encode the current of every VESC on a CAN bus, one message at a time and with encode_forward.
+    """
+    import pyvesc
+    from pyvesc.VESC.messages import SetCurrent
+
+    print("CAN broadcast: microseconds per tick")
+    print("%-12s%12s%16s" % ("VESCs", "encode", "encode_forward"))
+    for count in (1, 4, 8, 16):
+        currents = dict((can_id, 5.0) for can_id in range(count))
+        single_time = 1e6 / _rate(lambda: b''.join([pyvesc.encode(SetCurrent(current, can_id=can_id))
+                                                     for can_id, current in currents.items()]))
+        forward_time = 1e6 / _rate(lambda: pyvesc.encode_forward(SetCurrent, currents))
+        print("%-12u%12.2f%16.2f" % (count, single_time, forward_time))
+
+
+SECTIONS = {
+    'crc': bench_crc,
+    'zero_copy': bench_zero_copy,
+    'resync': bench_resync,
+    'decode': bench_decode,
+    'encode': bench_encode,
+    'batch': bench_batch,
+    'memory': bench_memory,
+    'lazy': bench_lazy,
+    'broadcast': bench_broadcast,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(SECTIONS)
+    for name in names:
+        SECTIONS[name]()
+        print()
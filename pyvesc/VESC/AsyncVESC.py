@@ -0,0 +1,402 @@
+from pyvesc.protocol.interface import encode_request, encode
+from pyvesc.protocol.base import VESCMessage
+from pyvesc.protocol.packet.codec import Stateful
+from pyvesc.VESC.messages import *
+from pyvesc.VESC.exceptions import *
+from pyvesc.VESC.VESC import VESC, Reply
+from pyvesc.VESC.motor import MotorMixin
+import asyncio
+import collections
+import os
+import time
+
+# because people may want to use this library for their own messaging, do not make this a required package
+try:
+    import serial
+except ImportError:
+    serial = None
+
+
+class AsyncVESC(MotorMixin):
+    """
+    asyncio version of VESC. The serial port is read and written without blocking from the event loop with
+    loop.add_reader and loop.add_writer, replies resolve futures awaited by the requests, and the heartbeat runs as a
+    task. This needs an event loop which supports add_reader, which is not the case for the proactor event loop on
+    Windows.
+
+    Create it with
+
+        vesc = await AsyncVESC.open('/dev/ttyACM0')
+
+    or use it as an async context manager, which connects on entry and closes on exit. Either way it is created in a
+    coroutine running on the event loop it is used with.
+    """
+
+    def __init__(self, serial_port, has_sensor=False, start_heartbeat=True, baudrate=115200, response_timeout=1.0):
+        """
+        Opens the serial port. Call connect() (or use open()) to start talking to the VESC.
+        :param serial_port: Serial device to use for communication (i.e. "COM3" or "/dev/tty.usbmodem0")
+        :param has_sensor: Whether or not the bldc motor is using a hall effect sensor
+        :param start_heartbeat: Whether or not to start the heartbeat task that will keep commands alive on connect.
+        :param baudrate: baudrate for the serial communication. Shouldn't need to change this.
+        :param response_timeout: default number of seconds to wait for the reply to a request
+        """
+        if serial is None:
+            raise ImportError("Need to install pyserial in order to use the AsyncVESC class.")
+
+        # the running loop, get_event_loop() returns it when called from a coroutine (get_running_loop() needs 3.7)
+        self._loop = asyncio.get_event_loop()
+        self.serial_port = serial.Serial(port=serial_port, baudrate=baudrate, timeout=0)
+        self._fd = self.serial_port.fileno()
+        os.set_blocking(self._fd, False)
+        self.response_timeout = response_timeout
+        self._has_sensor = has_sensor
+        self._start_heartbeat = start_heartbeat
+        self._heartbeat_task = None
+        # time.monotonic() of the last command written, so the heartbeat can skip Alive messages
+        self.last_command = 0.0
+        self._alive_msg = encode(Alive())
+        self._get_values_msg = encode_request(GetValues)
+
+        # futures of the requests waiting for a reply, in the order they were sent, keyed by message id
+        self._unframer = Stateful()
+        self._pending = {}
+        # payloads of messages which arrived without a request waiting for them, see receive()
+        self._unsolicited = asyncio.Queue()
+        # bytes which could not be written without blocking yet
+        self._out = bytearray()
+        self._error = None
+        self._loop.add_reader(self._fd, self._on_readable)
+
+    @classmethod
+    async def open(cls, *args, **kwargs):
+        """
+        Opens the serial port and connects to the VESC. Takes the same arguments as AsyncVESC.
+        :return: connected AsyncVESC.
+        """
+        vesc = cls(*args, **kwargs)
+        try:
+            await vesc.connect()
+        except BaseException:
+            await vesc.close()
+            raise
+        return vesc
+
+    async def connect(self):
+        """
+        Reads the firmware version and motor configuration from the VESC and starts the heartbeat.
+        """
+        if self._has_sensor:
+            self._send(encode(SetRotorPositionMode(SetRotorPositionMode.DISP_POS_OFF)))
+        if self._start_heartbeat:
+            self.start_heartbeat()
+
+        # some useful info for identifying the VESC
+        self.firmware_info = await self.get_firmware_version()
+        self.version = str(self.firmware_info)
+        self.uuid = self.firmware_info.uuid
+        self.conf = await self.get_motor_conf_simple()
+
+    async def __aenter__(self):
+        try:
+            await self.connect()
+        except BaseException:
+            await self.close()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        """
+        Stops the heartbeat, cancels the requests waiting for a reply and closes the serial port.
+        """
+        self.stop_heartbeat()
+        try:
+            if self._heartbeat_task is not None:
+                try:
+                    await self._heartbeat_task
+                except asyncio.CancelledError:
+                    pass
+        finally:
+            self._heartbeat_task = None
+            if self.serial_port.is_open:
+                self._loop.remove_reader(self._fd)
+                self._loop.remove_writer(self._fd)
+                self.serial_port.close()
+            self._fail_pending(None)
+
+    def _on_readable(self):
+        """
+        Called by the event loop when the serial port has data.
+        """
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._fail(e)
+            return
+        if not data:
+            self._fail(EOFError("The serial port was closed"))
+            return
+        self._unframer.feed(data)
+        for payload in self._unframer:
+            self._dispatch(payload)
+
+    def _dispatch(self, payload):
+        """
+        Hands the payload of a message to the oldest request waiting for that message id.
+        :param payload: payload of the message.
+        """
+        if not payload:
+            # a valid packet without a message in it
+            return
+        waiting = self._pending.get(VESCMessage.payload_id(payload))
+        while waiting:
+            future = waiting.popleft()
+            # requests which timed out are cancelled
+            if not future.done():
+                future.arrived = time.perf_counter()
+                future.set_result(payload)
+                return
+        self._unsolicited.put_nowait(payload)
+
+    def _fail(self, exception):
+        """
+        Stops using the serial port after it failed.
+        :param exception: the error.
+        """
+        self._error = exception
+        self._loop.remove_reader(self._fd)
+        self._loop.remove_writer(self._fd)
+        self._fail_pending(exception)
+
+    def _fail_pending(self, exception):
+        """
+        Fails every request still waiting for a reply.
+        :param exception: exception to raise in the waiting requests, or None to cancel them.
+        """
+        pending, self._pending = self._pending, {}
+        for waiting in pending.values():
+            for future in waiting:
+                if future.done():
+                    continue
+                if exception is None:
+                    future.cancel()
+                else:
+                    future.set_exception(exception)
+
+    def _send(self, data):
+        """
+        Writes as much of data to the serial port as possible without blocking, and the rest once the port is
+        writable again.
+        :param data: bytes to write.
+        """
+        if self._error is not None:
+            raise self._error
+        if not self.serial_port.is_open:
+            raise serial.SerialException("The VESC is closed")
+        if self._out:
+            # keep the order of writes
+            self._out += data
+            return
+        try:
+            written = os.write(self._fd, data)
+        except BlockingIOError:
+            written = 0
+        if written < len(data):
+            self._out += data[written:]
+            self._loop.add_writer(self._fd, self._on_writable)
+
+    def _on_writable(self):
+        """
+        Called by the event loop when the serial port can take more of the bytes waiting to be written.
+        """
+        try:
+            written = os.write(self._fd, self._out)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._fail(e)
+            return
+        del self._out[:written]
+        if not self._out:
+            self._loop.remove_writer(self._fd)
+
+    def _expect(self, msg_id):
+        """
+        Registers a request waiting for a message, before the request is written so that the reply can not be missed.
+        :param msg_id: message id of the reply.
+        :return: future of the payload of the reply.
+        """
+        future = self._loop.create_future()
+        self._pending.setdefault(msg_id, collections.deque()).append(future)
+        return future
+
+    def _forget(self, msg_id, future):
+        """
+        Stops waiting for the reply to a request.
+        :param msg_id: message id of the reply.
+        :param future: future returned by _expect.
+        """
+        future.cancel()
+        try:
+            self._pending[msg_id].remove(future)
+        except (KeyError, ValueError):
+            pass
+
+    async def _wait(self, msg_id, future, timeout=None):
+        """
+        Waits for the reply to a request.
+        :param msg_id: message id of the reply.
+        :param future: future returned by _expect.
+        :param timeout: seconds to wait, defaults to response_timeout.
+        :return: payload of the reply.
+        """
+        if timeout is None:
+            timeout = self.response_timeout
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._forget(msg_id, future)
+            raise ResponseTimeout("No reply with message id %u within %.3f s" % (msg_id, timeout))
+
+    async def write(self, data, num_read_bytes=None, lazy=False, timeout=None):
+        """
+        Writes data to the VESC.
+        :param data: the byte string to be sent
+        :param num_read_bytes: None if no response is expected, otherwise the response to the request in data is
+                               awaited.
+        :param lazy: decode each field of the response only when it is read
+        :param timeout: seconds to wait for the response, defaults to response_timeout. Raises ResponseTimeout if no
+                        response arrives in time.
+        :return: decoded response
+        """
+        if num_read_bytes is None:
+            self._send(data)
+            self.last_command = time.monotonic()
+            return None
+
+        msg_id = VESC._reply_id(data)
+        future = self._expect(msg_id)
+        self._send(data)
+        return VESCMessage.unpack(await self._wait(msg_id, future, timeout), lazy=lazy)
+
+    async def request_many(self, requests, timeout=None, max_in_flight=None, lazy=False):
+        """
+        Sends several getter requests without waiting for each reply before sending the next one, see
+        VESC.request_many.
+        :param requests: message classes (or messages, to set a can_id) to request, for example [GetValues, GetVersion]
+        :param timeout: seconds to wait for all of the replies, defaults to response_timeout. Raises ResponseTimeout
+                        if some replies did not arrive in time.
+        :param max_in_flight: maximum number of requests waiting for a reply at once. None sends every request in one
+                              write.
+        :param lazy: decode each field of the replies only when it is read
+        :return: list of Reply (message, latency), in the order of requests.
+        """
+        if timeout is None:
+            timeout = self.response_timeout
+        if max_in_flight is None:
+            max_in_flight = len(requests)
+        elif max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        deadline = self._loop.time() + timeout
+        packets = [encode_request(request) for request in requests]
+        sent = [None] * len(requests)
+        replies = [None] * len(requests)
+
+        # futures waiting for a reply, and the index of their request
+        in_flight = {}
+        index = 0
+        try:
+            while index < len(requests) or in_flight:
+                if index < len(requests) and len(in_flight) < max_in_flight:
+                    stop = min(len(requests), index + max_in_flight - len(in_flight))
+                    for i in range(index, stop):
+                        in_flight[self._expect(requests[i].id)] = i
+                    now = time.perf_counter()
+                    self._send(b''.join(packets[index:stop]))
+                    for i in range(index, stop):
+                        sent[i] = now
+                    index = stop
+
+                done = (await asyncio.wait(in_flight, timeout=max(0, deadline - self._loop.time()),
+                                           return_when=asyncio.FIRST_COMPLETED))[0]
+                if not done:
+                    raise ResponseTimeout("No reply to %u of %u requests within %.3f s" %
+                                          (len(in_flight) + len(requests) - index, len(requests), timeout))
+                for future in done:
+                    i = in_flight.pop(future)
+                    replies[i] = Reply(VESCMessage.unpack(future.result(), lazy=lazy), future.arrived - sent[i])
+        finally:
+            # the replies to requests which timed out are handed to nobody
+            for future, i in in_flight.items():
+                self._forget(requests[i].id, future)
+        return replies
+
+    async def receive(self, timeout=None):
+        """
+        Gets the next message which arrived without a request waiting for it.
+        :param timeout: seconds to wait for a message, defaults to response_timeout.
+        :return: the message.
+        """
+        if timeout is None:
+            timeout = self.response_timeout
+        try:
+            payload = await asyncio.wait_for(self._unsolicited.get(), timeout)
+        except asyncio.TimeoutError:
+            raise ResponseTimeout("No message received within %.3f s" % timeout)
+        return VESCMessage.unpack(payload)
+
+    async def _heartbeat(self, period=0.1):
+        """
+        Keeps the motor alive, skipping the Alive message when another command was written within the period.
+        """
+        while True:
+            await asyncio.sleep(max(0.0, self.last_command + period - time.monotonic()))
+            if time.monotonic() - self.last_command >= period:
+                try:
+                    self._send(self._alive_msg)
+                except (serial.SerialException, OSError, EOFError) as e:
+                    # the port failed. the requests are told so, and there is nothing left to keep alive
+                    if self._error is None:
+                        self._fail(e)
+                    return
+                self.last_command = time.monotonic()
+
+    def start_heartbeat(self):
+        """
+        Starts a task which keeps the motor alive.
+        """
+        if self._heartbeat_task is None:
+            self._heartbeat_task = self._loop.create_task(self._heartbeat())
+
+    def stop_heartbeat(self):
+        """
+        Stops the heartbeat task.
+        """
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+
+    def _set(self, msg):
+        """
+        Sends a setpoint, see MotorMixin.
+        :return: awaitable.
+        """
+        return self.write(encode(msg))
+
+    def _request(self, msg_cls, lazy=False, timeout=None):
+        """
+        Sends a request, see MotorMixin.
+        :return: awaitable of the reply.
+        """
+        packet = self._get_values_msg if msg_cls is GetValues else encode_request(msg_cls)
+        return self.write(packet, 0, lazy, timeout)
+
+    async def _then(self, reply, function):
+        """
+        See MotorMixin.
+        """
+        return function(await reply)
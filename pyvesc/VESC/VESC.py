@@ -1,5 +1,19 @@
-from pyvesc.protocol.interface import encode_request, encode, decode
+from pyvesc.protocol.interface import encode_request, encode, encode_forward
+from pyvesc.protocol.base import VESCMessage
+from pyvesc.protocol.packet.codec import Stateful, UnpackerBase, unframe
+from pyvesc.protocol.packet.structure import Header, Footer
+from pyvesc.protocol.packet.exceptions import CorruptPacket
 from pyvesc.VESC.messages import *
+from pyvesc.VESC.exceptions import *
+from pyvesc.VESC import heartbeat, discovery
+from pyvesc.VESC.writer import FrameWriter, Priority
+from pyvesc.VESC.setpoints import SetpointChannel
+from pyvesc.VESC.can import CANNode
+from pyvesc.VESC.motor import MotorMixin
+import collections
+import concurrent.futures
+import logging
+import queue
 import time
 import threading
 from pprint import pprint
@@ -12,7 +26,18 @@ try:
 except ImportError:
     serial = None
 
-class VESC(object):
+_log = logging.getLogger(__name__)
+
+
+class Reply(collections.namedtuple('Reply', ['message', 'latency'])):
+    """
+    Reply to a request sent with VESC.request_many, and the seconds between writing the request and the reply
+    arriving.
+    """
+    __slots__ = ()
+
+
+class VESC(MotorMixin):
 
     fault_codes = (
         'FAULT_CODE_NONE',
@@ -44,59 +69,517 @@ class VESC(object):
     )
 
 
-    def __init__(self, serial_port, has_sensor=False, start_heartbeat=True, baudrate=115200, timeout=0.05):
+    def __init__(self, serial_port, has_sensor=False, start_heartbeat=True, baudrate=115200, timeout=0.05,
+                 response_timeout=1.0, coalesce_window=0.0, reader_thread=True, fetch_info=True, info_cache_path=None,
+                 max_unsolicited=256):
         """
         :param serial_port: Serial device to use for communication (i.e. "COM3" or "/dev/tty.usbmodem0")
         :param has_sensor: Whether or not the bldc motor is using a hall effect sensor
-        :param start_heartbeat: Whether or not to automatically start the heartbeat thread that will keep commands
-                                alive.
+        :param start_heartbeat: Whether or not to automatically start the heartbeat that will keep commands alive.
         :param baudrate: baudrate for the serial communication. Shouldn't need to change this.
         :param timeout: timeout for the serial communication
+        :param response_timeout: default number of seconds to wait for the reply to a request
+        :param coalesce_window: seconds the writer thread waits for more frames to write together with the first one.
+                                Frames written while the previous write is in progress are always written together.
+        :param reader_thread: read replies with a background thread. When False every reply is read by the thread
+                              waiting for it, with blocking reads of exactly the length given in the packet header, and
+                              messages nobody waits for are only read by receive().
+        :param fetch_info: read the firmware version and motor configuration straight away, with one round trip. When
+                           False they are read the first time firmware_info, version, uuid or conf is used, or by
+                           prefetch_info().
+        :param info_cache_path: JSON file which keeps the firmware version and motor configuration of each VESC, see
+                                discovery.DeviceCache. A VESC which is in it is connected to without waiting for any
+                                reply, and its uuid is checked in the background. None to not use one.
+        :param max_unsolicited: number of messages which arrived without a request waiting for them (for example late
+                                replies) kept for receive(). When more arrive the oldest are dropped and counted in
+                                unsolicited_dropped.
+
+        Outgoing frames are written by priority: safety commands (braking and zero current) first, then setpoints,
+        heartbeats, getter requests and finally bulk transfers, see write() and write_bulk().
         """
 
         if serial is None:
             raise ImportError("Need to install pyserial in order to use the VESCMotor class.")
 
         self.serial_port = serial.Serial(port=serial_port, baudrate=baudrate, timeout=timeout)
+        self.response_timeout = response_timeout
+
+        # frames from the heartbeat thread and the callers are written by one writer thread, see writer.stats()
+        self.writer = FrameWriter(self.serial_port.write, coalesce_window, baudrate)
+        # setpoints are sent no faster than the link carries them, newest first, see setpoints.stats()
+        self.setpoints = SetpointChannel(self.writer, baudrate)
+        # time.monotonic() of the last command written, so the heartbeat can skip Alive messages
+        self.last_command = 0.0
+        # CANNode of each can id, see can()
+        self._can_nodes = {}
+        # GetVersion and GetMCConfTemp of the VESC, see firmware_info and conf
+        self._firmware_info = None
+        self._conf = None
+        self._info_cache = discovery.DeviceCache(info_cache_path) if info_cache_path is not None else None
+
+        # replies are read by a background thread and handed to the requests waiting for them. each message id has a
+        # queue of futures, in the order the requests were sent
+        self._unframer = Stateful()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        # payloads of messages which arrived without a request waiting for them, see receive()
+        self._unsolicited = queue.Queue(max_unsolicited)
+        # number of those dropped because receive() did not keep up
+        self.unsolicited_dropped = 0
+        self._stop_reader = threading.Event()
+        if reader_thread:
+            self._reader_thread = threading.Thread(target=self._read_loop, daemon=True)
+            self._reader_thread.start()
+        else:
+            self._reader_thread = None
+            # only one thread reads from the port at a time
+            self._read_lock = threading.Lock()
+
+        try:
+            self._setup(has_sensor, start_heartbeat, fetch_info)
+        except Exception:
+            self.close()
+            raise
+
+    def _setup(self, has_sensor, start_heartbeat, fetch_info):
+        """
+        Starts talking to the VESC once the reader thread is running.
+        """
         if has_sensor:
-            self.serial_port.write(encode(SetRotorPositionMode(SetRotorPositionMode.DISP_POS_OFF)))
+            self.write(encode(SetRotorPositionMode(SetRotorPositionMode.DISP_POS_OFF)))
 
         # store message info for getting values so it doesn't need to calculate it every time
-        msg = GetValues()
-        self._get_values_msg = encode_request(msg)
-        self._get_values_msg_expected_length = msg.fields.sizeof()
+        self._get_values_msg = encode_request(GetValues())
 
         #our keepalive message
         self._alive_msg = encode(Alive())        
 
-        self.heart_beat_thread = threading.Thread(target=self._heartbeat_cmd_func)
-        self._stop_heartbeat = threading.Event()
-
         if start_heartbeat:
             self.start_heartbeat()
 
         # some useful info for identifying the VESC
-        self.firmware_info = self.get_firmware_version()
-        self.version = str(self.firmware_info)
-        self.uuid = self.firmware_info.uuid
-        self.conf = self.get_motor_conf_simple()
+        cached = self._info_cache.get(self.serial_port.port) if self._info_cache is not None else None
+        if cached is not None:
+            self._firmware_info, self._conf = cached
+            self._check_info()
+        if fetch_info:
+            self.prefetch_info()
+
+    @property
+    def firmware_info(self):
+        """
+        The GetVersion of the VESC, read the first time it is used.
+        """
+        if self._firmware_info is None:
+            self.prefetch_info((GetVersion,))
+        return self._firmware_info
+
+    @property
+    def version(self):
+        return str(self.firmware_info)
+
+    @property
+    def uuid(self):
+        return self.firmware_info.uuid
+
+    @property
+    def conf(self):
+        """
+        The simplified motor configuration (GetMCConfTemp) of the VESC, read the first time it is used.
+        """
+        if self._conf is None:
+            self.prefetch_info((GetMCConfTemp,))
+        return self._conf
+
+    def prefetch_info(self, requests=(GetVersion, GetMCConfTemp), timeout=None):
+        """
+        Reads the firmware version and motor configuration which are not known yet, with one round trip for both.
+        :param requests: which of GetVersion and GetMCConfTemp to read.
+        :param timeout: seconds to wait for the replies, defaults to response_timeout.
+        """
+        requests = [request for request in requests
+                    if (self._firmware_info if request is GetVersion else self._conf) is None]
+        if not requests:
+            return
+        for reply in self.request_many(requests, timeout):
+            if isinstance(reply.message, GetVersion):
+                self._firmware_info = reply.message
+            else:
+                self._conf = reply.message
+        if self._info_cache is not None and self._firmware_info is not None:
+            self._info_cache.update(self.serial_port.port, self._firmware_info, self._conf)
+
+    def _check_info(self):
+        """
+        Checks in the background that the VESC is the one the cached information belongs to. If another VESC is on the
+        port now its information is read again when it is next used.
+        """
+        cached = self._firmware_info
+
+        def check(future):
+            if future.cancelled() or future.exception() is not None:
+                return
+            version = VESCMessage.unpack(future.result())
+            if self._firmware_info is cached:
+                if version.uuid != cached.uuid:
+                    # another VESC is on the port now
+                    self._conf = None
+                self._firmware_info = version
+
+        future = self._expect(GetVersion.id)
+        future.add_done_callback(check)
+        self.writer.submit(encode_request(GetVersion), Priority.TELEMETRY)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Stops the heartbeat and the reader thread and closes the serial port. Requests still waiting for a reply are
+        cancelled.
+        """
         self.stop_heartbeat()
+        self.setpoints.close()
+        self.writer.close()
+        self._stop_reader.set()
+        if self._reader_thread is None:
+            self._fail_pending(None)
+        elif self._reader_thread.is_alive():
+            if hasattr(self.serial_port, 'cancel_read'):
+                self.serial_port.cancel_read()
+            self._reader_thread.join()
         if self.serial_port.is_open:
             self.serial_port.flush()
             self.serial_port.close()
 
-    def _heartbeat_cmd_func(self):
-        """
-        Continuous function calling that keeps the motor alive
-        """
-        while not self._stop_heartbeat.isSet():
-            time.sleep(0.1)
-            self.write(self._alive_msg)
+    def _read_loop(self):
+        """
+        Reads from the serial port until the VESC is closed, handing every message that arrives to the request
+        waiting for it.
+        """
+        try:
+            while not self._stop_reader.is_set():
+                # blocks until at least one byte arrives, or the serial timeout passes
+                data = self.serial_port.read(max(1, self.serial_port.in_waiting))
+                if data:
+                    self._unframer.feed(data)
+                    for payload in self._unframer:
+                        try:
+                            self._dispatch(payload)
+                        except Exception:
+                            # one bad message must not stop the replies to every other request
+                            _log.exception("Dropped a message which could not be dispatched: %r", payload)
+        except (SerialException, OSError, TypeError) as e:
+            # pyserial raises TypeError when reading from a port closed under it
+            if not self._stop_reader.is_set():
+                self._fail_pending(e)
+                return
+        self._fail_pending(None)
+
+    def _read(self, size, deadline, data=b''):
+        """
+        Reads exactly size bytes, blocking until they arrive.
+        :param size: number of bytes, or None for the bytes which have arrived (at least one).
+        :param deadline: time.monotonic() after which ResponseTimeout is raised. The bytes of data and the bytes read
+                         until then are handed to the unframer, which completes the message on the next read.
+        :param data: bytes of the message read so far, which the bytes read are appended to.
+        :return: data and the bytes read.
+        """
+        size = None if size is None else len(data) + size
+        while size is None or len(data) < size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._unframer.feed(data)
+                raise ResponseTimeout("No complete message before the deadline")
+            # changing the timeout reconfigures the port, so it is left alone if it is within a millisecond
+            if self.serial_port.timeout is None or abs(self.serial_port.timeout - remaining) > 0.001:
+                self.serial_port.timeout = remaining
+            if size is None:
+                data = self.serial_port.read(max(1, self.serial_port.in_waiting))
+                if data:
+                    return data
+            else:
+                data += self.serial_port.read(size - len(data))
+        return data
+
+    def _read_payload(self, deadline):
+        """
+        Reads one message in the calling thread: exactly the 2 or 3 bytes of the header, then exactly the payload and
+        footer the header announces. There is no polling, so this returns as soon as the last byte of the message
+        arrives. After corrupt data the stream is resynchronized by the unframer, which also finds packets behind
+        start bytes whose (bogus) length has not arrived.
+        :param deadline: time.monotonic() after which ResponseTimeout is raised.
+        :return: payload of the message.
+        """
+        while True:
+            if len(self._unframer):
+                # resynchronizing, or completing a message cut off by the last deadline
+                payload = self._unframer.unpack()
+                if payload is not None:
+                    return payload
+                self._unframer.feed(self._read(None, deadline))
+                continue
+            packet = self._read(1, deadline)
+            if packet[0] not in (0x2, 0x3):
+                continue
+            packet = self._read(Header.compiled_fmt(packet[0]).size - 1, deadline, packet)
+            header = Header.parse(packet)
+            packet = self._read(header.payload_length + Footer.STRUCT.size, deadline, packet)
+            try:
+                return UnpackerBase._unpack_packet(packet, header)[0]
+            except CorruptPacket:
+                # the start byte was not the start of a packet, look for one in the bytes after it
+                self._unframer.feed(packet[1:])
+
+    def _pump(self, futures, deadline):
+        """
+        Reads messages in the calling thread and hands them to the requests waiting for them, until one of futures is
+        done or the deadline passes. Only used without a reader thread.
+        :param futures: futures returned by _expect.
+        :param deadline: time.monotonic() at which to give up.
+        """
+        while not any(future.done() for future in futures):
+            with self._read_lock:
+                # another thread may have read the reply while we waited for the lock
+                if any(future.done() for future in futures):
+                    return
+                try:
+                    payload = self._read_payload(deadline)
+                except ResponseTimeout:
+                    return
+            self._dispatch(payload)
+
+    def _dispatch(self, payload):
+        """
+        Hands the payload of a message to the oldest request waiting for that message id.
+        :param payload: payload of the message.
+        """
+        if not payload:
+            # a valid packet without a message in it
+            return
+        with self._pending_lock:
+            waiting = self._pending.get(VESCMessage.payload_id(payload))
+            future = waiting.popleft() if waiting else None
+        if future is None:
+            while True:
+                try:
+                    self._unsolicited.put_nowait(payload)
+                    break
+                except queue.Full:
+                    # nobody reads them, keep the newest
+                    try:
+                        self._unsolicited.get_nowait()
+                        self.unsolicited_dropped += 1
+                    except queue.Empty:
+                        pass
+        else:
+            future.arrived = time.perf_counter()
+            future.set_result(payload)
+
+    def _fail_pending(self, exception):
+        """
+        Fails every request still waiting for a reply.
+        :param exception: exception to raise in the waiting requests, or None to cancel them.
+        """
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for waiting in pending.values():
+            for future in waiting:
+                if exception is None:
+                    future.cancel()
+                else:
+                    future.set_exception(exception)
+
+    @staticmethod
+    def _reply_id(data):
+        """
+        The message id of the reply to a request packet, which is the id of the request itself.
+        :param data: the request packet.
+        :return: message id.
+        """
+        payload = unframe(data)[0]
+        if payload is None:
+            raise ValueError("Request is not a valid VESC packet")
+        return VESCMessage.payload_id(payload)
+
+    def _expect(self, msg_id):
+        """
+        Registers a request waiting for a message, before the request is written so that the reply can not be missed.
+        :param msg_id: message id of the reply.
+        :return: future of the payload of the reply. Its arrived attribute is set to the time.perf_counter() at which
+                 the reply was dispatched.
+        """
+        future = concurrent.futures.Future()
+        with self._pending_lock:
+            if self._stop_reader.is_set() or (self._reader_thread is not None and not self._reader_thread.is_alive()):
+                raise SerialException("The VESC is closed")
+            self._pending.setdefault(msg_id, collections.deque()).append(future)
+        return future
+
+    def _wait(self, msg_id, future, timeout=None):
+        """
+        Waits for the reply to a request.
+        :param msg_id: message id of the reply.
+        :param future: future returned by _expect.
+        :param timeout: seconds to wait, defaults to response_timeout.
+        :return: payload of the reply.
+        """
+        if timeout is None:
+            timeout = self.response_timeout
+        wait = timeout
+        if self._reader_thread is None:
+            self._pump((future,), time.monotonic() + timeout)
+            wait = 0
+        try:
+            return future.result(wait)
+        except concurrent.futures.TimeoutError:
+            if self._forget(msg_id, future):
+                raise ResponseTimeout("No reply with message id %u within %.3f s" % (msg_id, timeout))
+            # the reply was dispatched just as we gave up
+            return future.result()
+
+    def _forget(self, msg_id, future):
+        """
+        Stops waiting for the reply to a request.
+        :param msg_id: message id of the reply.
+        :param future: future returned by _expect.
+        :return: False if the reply was already handed to the future.
+        """
+        with self._pending_lock:
+            try:
+                self._pending[msg_id].remove(future)
+            except (KeyError, ValueError):
+                return False
+        return True
+
+    def request_many(self, requests, timeout=None, max_in_flight=None, lazy=False):
+        """
+        Sends several getter requests without waiting for each reply before sending the next one. Requests are
+        written together in as few writes as max_in_flight allows, and replies are matched to requests by message id
+        as they arrive, oldest request first.
+        :param requests: message classes (or messages, to set a can_id) to request, for example [GetValues, GetVersion]
+        :param timeout: seconds to wait for all of the replies, defaults to response_timeout. Raises ResponseTimeout
+                        if some replies did not arrive in time.
+        :param max_in_flight: maximum number of requests waiting for a reply at once. None sends every request in one
+                              write.
+        :param lazy: decode each field of the replies only when it is read
+        :return: list of Reply (message, latency), in the order of requests.
+        """
+        if timeout is None:
+            timeout = self.response_timeout
+        if max_in_flight is None:
+            max_in_flight = len(requests)
+        elif max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        deadline = time.monotonic() + timeout
+        packets = [encode_request(request) for request in requests]
+        msg_ids = [request.id for request in requests]
+        sent = [None] * len(requests)
+        replies = [None] * len(requests)
+
+        # futures waiting for a reply, and the index of their request
+        in_flight = {}
+        index = 0
+        while index < len(requests) or in_flight:
+            if index < len(requests) and len(in_flight) < max_in_flight:
+                stop = min(len(requests), index + max_in_flight - len(in_flight))
+                for i in range(index, stop):
+                    in_flight[self._expect(msg_ids[i])] = i
+                now = time.perf_counter()
+                self.writer.submit(b''.join(packets[index:stop]), Priority.TELEMETRY)
+                for i in range(index, stop):
+                    sent[i] = now
+                index = stop
+
+            if self._reader_thread is None:
+                self._pump(in_flight, deadline)
+            done = concurrent.futures.wait(in_flight, max(0, deadline - time.monotonic()),
+                                           concurrent.futures.FIRST_COMPLETED)[0]
+            if not done:
+                missing = [i for future, i in in_flight.items() if self._forget(msg_ids[i], future)]
+                if missing:
+                    raise ResponseTimeout("No reply to %u of %u requests within %.3f s" %
+                                          (len(missing) + len(requests) - index, len(requests), timeout))
+                # every reply arrived just as we gave up
+                done = set(in_flight)
+            for future in done:
+                i = in_flight.pop(future)
+                payload = future.result()
+                replies[i] = Reply(VESCMessage.unpack(payload, lazy=lazy), future.arrived - sent[i])
+        return replies
+
+    def can(self, can_id):
+        """
+        Addresses a VESC on the CAN bus of this one, which forwards the messages to it.
+        :param can_id: can id of the VESC.
+        :return: CANNode with the getters and setters of a VESC.
+        """
+        node = self._can_nodes.get(can_id)
+        if node is None:
+            node = self._can_nodes[can_id] = CANNode(self, can_id)
+        return node
+
+    def poll_can(self, can_ids, request=GetValues, timeout=None, lazy=False):
+        """
+        Polls many VESCs on the CAN bus at once: the requests to all of them are written together and the replies are
+        gathered as they arrive, so polling every node takes about one round trip rather than one per node.
+        The replies are forwarded without the CAN header, in the order they arrive rather than the order of the
+        requests, so they are told apart by the controller id in them. Only replies which have one, such as GetValues,
+        can be polled from more than one VESC at once.
+        :param can_ids: can ids of the VESCs.
+        :param request: message class to request, whose replies have an app_controller_id field.
+        :param timeout: seconds to wait for all of the replies, defaults to response_timeout. Raises ResponseTimeout
+                        if some replies did not arrive in time.
+        :param lazy: decode each field of the replies only when it is read
+        :return: dict of can id to reply. The can_id of each reply is set to the VESC which sent it.
+        """
+        can_ids = list(can_ids)
+        if len(can_ids) > 1 and 'app_controller_id' not in request._field_names:
+            raise ValueError("Replies to %s do not tell which VESC sent them, request them from one VESC at a time"
+                             % request.__name__)
+        replies = self.request_many([request(can_id=can_id) for can_id in can_ids], timeout, lazy=lazy)
+        gathered = {}
+        for can_id, reply in zip(can_ids, replies):
+            msg = reply.message
+            if msg.can_id is None:
+                msg.can_id = getattr(msg, 'app_controller_id', can_id)
+            gathered[msg.can_id] = msg
+        return gathered
+
+    def scan_can(self, timeout=None, ping_timeout=3.0):
+        """
+        Finds the VESCs on the CAN bus of this one. The VESC pings every can id, then the firmware version of each VESC
+        which replied is requested in turn, because the replies do not tell which VESC sent them.
+        :param timeout: seconds to wait for each firmware version, defaults to response_timeout.
+        :param ping_timeout: seconds to wait for the VESC to ping every can id, which can take a second or more.
+        :return: dict of can id to GetVersion (uuid, hw_name and firmware version) of each VESC on the bus.
+        """
+        ping = self.write(encode_request(PingCan), 0, timeout=ping_timeout)
+        return dict((can_id, self.can(can_id).get_firmware_version(timeout)) for can_id in ping.can_ids)
+
+    def receive(self, timeout=None):
+        """
+        Gets the next message which arrived without a request waiting for it, for example replies to requests written
+        with num_read_bytes=None.
+        :param timeout: seconds to wait for a message, defaults to response_timeout.
+        :return: the message.
+        """
+        if timeout is None:
+            timeout = self.response_timeout
+        if self._reader_thread is None:
+            deadline = time.monotonic() + timeout
+            while self._unsolicited.empty():
+                with self._read_lock:
+                    payload = self._read_payload(deadline)
+                self._dispatch(payload)
+        try:
+            payload = self._unsolicited.get(timeout=timeout)
+        except queue.Empty:
+            raise ResponseTimeout("No message received within %.3f s" % timeout)
+        return VESCMessage.unpack(payload)
 
     @staticmethod
     def get_vesc_serial_ports():
@@ -104,161 +587,116 @@ class VESC(object):
         List all serial ports that match the vendor / product ID for VESC boards
         :return: a list of serial port path strings
         """
-        ports = serial.tools.list_ports.comports()
-        good_ports = []
-        for port in ports:
-            if '0483:5740' in port.hwid:
-                good_ports.append(port.device)
-
-        return good_ports		    
+        return discovery.vesc_serial_ports()
 
     @staticmethod
-    def get_vesc_serial_port_by_uuid(uuid):
+    def get_vesc_serial_port_by_uuid(uuid, cache_path=discovery.DEFAULT_CACHE_PATH):
         """
         Get the port for connecting to a VESC identified by its UUID. It can be found on the firmware page of VESC Tool, or by using this library.
+        The port the VESC was found on last time is tried first, otherwise every port is probed at once, see
+        discovery.find_port.
         :param uuid: the uuid as an integer. easiest to pass in as 24 digit hex, eg. 0x000000000000000000000000
+        :param cache_path: JSON file which remembers the port of each uuid, or None to not use one.
         :return: the string path to the serial port, eg. /dev/ttyACM0
         """
-        ports = VESC.get_vesc_serial_ports()
-        for port in ports:
-            try:
-                obj = VESC(serial_port = port, start_heartbeat=False)
-                if obj.uuid == uuid:
-                    return port
-            except SerialException as e:
-                print("Error ecountered with port " + port)
-                print(e)
-        return None
+        return discovery.find_port(uuid, cache_path=cache_path)
 
     def start_heartbeat(self):
         """
-        Starts a repetitive calling of the last set cmd to keep the motor alive.
+        Keeps the motor alive. The Alive messages are sent by a thread shared with every other VESC, and only when no
+        other command was written to this VESC in the last heartbeat period.
         """
-        self.heart_beat_thread.start()
+        heartbeat.scheduler.register(self)
 
     def stop_heartbeat(self):
         """
-        Stops the heartbeat thread and resets the last cmd function. THIS MUST BE CALLED BEFORE THE OBJECT GOES OUT OF
-        SCOPE UNLESS WRAPPING IN A WITH STATEMENT (Assuming the heartbeat was started).
+        Stops the heartbeat. THIS MUST BE CALLED BEFORE THE OBJECT GOES OUT OF SCOPE UNLESS WRAPPING IN A WITH STATEMENT
+        (Assuming the heartbeat was started).
         """
-        if self.heart_beat_thread.is_alive():
-            self._stop_heartbeat.set()
-            self.heart_beat_thread.join()
+        heartbeat.scheduler.unregister(self)
 
-    def write(self, data, num_read_bytes=None):
+    def write(self, data, num_read_bytes=None, lazy=False, timeout=None, priority=None):
         """
         A write wrapper function implemented like this to try and make it easier to incorporate other communication
         methods than UART in the future.
         :param data: the byte string to be sent
-        :param num_read_bytes: number of bytes to read for decoding response.  0 for unknown number of bytes
+        :param num_read_bytes: None if no response is expected, otherwise the response to the request in data is
+                               waited for. The length of the response is read from its header, so this no longer needs
+                               to be the number of bytes of the response.
+        :param lazy: decode each field of the response only when it is read
+        :param timeout: seconds to wait for the response, defaults to response_timeout. Raises ResponseTimeout if no
+                        response arrives in time.
+        :param priority: Priority class of the data. Defaults to Priority.SETPOINT for commands and
+                         Priority.TELEMETRY for requests.
         :return: decoded response from buffer
         """
-        
-        reply = b''
-        
-        self.serial_port.write(data)
-        if num_read_bytes is not None:
-            #for some packets like 'get version' we don't know how long the response will be due to null terminated strings.
-            if num_read_bytes == 0:
-                while not bool(reply):
-                	# add some delay to wait for the VESC to process
-                	# honestly this whole response handling needs to be reworked since the packet header contains the length of the incoming packet.... delays are just a hack.
-                    time.sleep(0.005) 
-                    while self.serial_port.in_waiting == 0:
-                        time.sleep(0.005)  # add some delay just to help the CPU
-                    reply += self.serial_port.read(self.serial_port.in_waiting)
-            #if we do know, then wait for exactly that # of bytes.
-            else:
-                while self.serial_port.in_waiting <= num_read_bytes:
-                    time.sleep(0.000001)  # add some delay just to help the CPU
-                    reply += self.serial_port.read(self.serial_port.in_waiting)
-
-            response, consumed = decode(reply)
-            return response
-
-    def set_erpm(self, erpm):
-        """
-        Set the electronic RPM value (eg. the actual rpm * the number of pairs of poles)
-        :param erpm: new erpm value
-        """
-        self.write(encode(SetRPM(int(erpm))))
-
-    def set_rpm(self, rpm):
-        """
-        Set the actual RPM (must have correct motor poles # set in VESC Tool)(
-        :param rpm: new rpm value
-        """
-        self.set_erpm(rpm * (self.conf.motor_poles / 2))
- 
-    def set_current(self, new_current):
-        """
-        :param new_current: new current in amps for the motor
-        """
-        self.write(encode(SetCurrent(new_current)))
-
-    def set_brake_current(self, new_current):
-        """
-        :param new_current: new current in amps for the motor brake
-        """
-        self.write(encode(SetCurrentBrake(new_current)))
-
-    def set_duty_cycle(self, new_duty_cycle):
-        """
-        :param new_duty_cycle: Value of duty cycle to be set (range [-1e5, 1e5]).
-        """
-        self.write(encode(SetDutyCycle(new_duty_cycle)))
-
-    def set_servo(self, new_servo_pos):
-        """
-        :param new_servo_pos: New servo position. valid range [0, 1]
-        """
-        self.write(encode(SetServoPosition(new_servo_pos)))
+        if num_read_bytes is None:
+            self.writer.submit(data, Priority.SETPOINT if priority is None else priority)
+            self.last_command = time.monotonic()
+            return None
 
-    def get_measurements(self):
-        """
-        :return: A msg object with attributes containing the measurement values
-        """
-        #return self.write(self._get_values_msg, self._get_values_msg_expected_length)
-        return self.write(self._get_values_msg, 0)
-
-    def get_firmware_version(self):
-        return self.write(encode_request(GetVersion()), 0)
-
-    def get_motor_conf_simple(self):
-        return self.write(encode_request(GetMCConfTemp()), 0)
-
-    def get_erpm(self):
-        """
-        :return: Current motor erpm
-        """
-        return self.get_measurements().rpm
+        msg_id = self._reply_id(data)
+        future = self._expect(msg_id)
+        self.writer.submit(data, Priority.TELEMETRY if priority is None else priority)
+        return VESCMessage.unpack(self._wait(msg_id, future, timeout), lazy=lazy)
 
-    def get_rpm(self):
+    def write_bulk(self, packets):
         """
-        :return: Current motor erpm
+        Writes a large transfer, such as a configuration, behind all other traffic. The packets are written a few at a
+        time so that more urgent frames can be written in between.
+        :param packets: list of packets.
         """
-        return self.get_measurements().rpm / (self.conf.motor_poles / 2)
+        for packet in packets:
+            self.writer.submit(packet, Priority.BULK)
+        self.last_command = time.monotonic()
 
-    def get_duty_cycle(self):
+    def _set(self, msg):
         """
-        :return: Current applied duty-cycle
+        Sends a setpoint through the setpoint channel. If the previous setpoint of the same kind has not been sent yet
+        (because setpoints are set faster than the link can carry them) it is replaced. Braking and zero current are
+        written straight away ahead of all other traffic, and drop every setpoint for the same can id which has not
+        been sent yet.
+        :param msg: the setpoint message.
         """
-        return self.get_measurements().duty_cycle_now
+        if isinstance(msg, SetCurrentBrake) or (isinstance(msg, SetCurrent) and msg.current == 0):
+            self.setpoints.preempt(msg, (msg.can_id,))
+        else:
+            self.setpoints.set(msg)
+        self.last_command = time.monotonic()
 
-    def get_v_in(self):
+    def set_many(self, setter, values):
         """
-        :return: Current input voltage
+        Sends one setter to many VESCs on the CAN bus of this one, packed into one buffer and written together. Braking
+        and zero currents are written ahead of all other traffic like set_current(0) for each of their can ids, the
+        other values go through the setpoint channel.
+        :param setter: the setter class, for example SetCurrent.
+        :param values: dict of can id to the value to set.
         """
-        return self.get_measurements().v_in
+        if not values:
+            return
+        if setter is SetCurrentBrake:
+            urgent, values = values, {}
+        elif setter is SetCurrent:
+            urgent = dict((can_id, value) for can_id, value in values.items() if value == 0)
+            if urgent:
+                values = dict((can_id, value) for can_id, value in values.items() if value != 0)
+        else:
+            urgent = {}
+        if urgent:
+            self.setpoints.preempt(encode_forward(setter, urgent), list(urgent))
+        if values:
+            self.setpoints.set_many(setter, list(values), encode_forward(setter, values))
+        self.last_command = time.monotonic()
 
-    def get_motor_current(self):
+    def set_current_many(self, currents):
         """
-        :return: Current motor current
+        :param currents: dict of can id to the new current in amps for the motor of that VESC.
         """
-        return self.get_measurements().avg_motor_current
+        self.set_many(SetCurrent, currents)
 
-    def get_incoming_current(self):
+    def _request(self, msg_cls, lazy=False, timeout=None):
         """
-        :return: Current incoming current
+        Sends a request and waits for the reply, see MotorMixin.
         """
-        return self.get_measurements().avg_input_current
+        packet = self._get_values_msg if msg_cls is GetValues else encode_request(msg_cls)
+        return self.write(packet, 0, lazy, timeout)
@@ -1 +1,5 @@
-from .VESC import VESC
\ No newline at end of file
+from .VESC import VESC
+from .AsyncVESC import AsyncVESC
+from .fleet import VESCFleet
+from .exceptions import *
+from .writer import Priority
@@ -0,0 +1,59 @@
+from pyvesc.protocol.interface import encode_request
+from pyvesc.VESC.messages import *
+from pyvesc.VESC.motor import MotorMixin
+
+
+class CANNode(MotorMixin):
+    """
+    A VESC on the CAN bus of a serial attached VESC, which forwards the messages to it. Get one with VESC.can():
+
+        vesc.can(7).set_current(5)
+        rpm = vesc.can(7).get_erpm()
+
+    The VESC forwards the replies without the CAN header, so replies to the same request sent to several nodes at once
+    are matched in the order the requests were sent. VESC.poll_can() polls many nodes at once and tells the replies
+    apart by the controller id in them.
+    """
+
+    def __init__(self, vesc, can_id):
+        """
+        :param vesc: the serial attached VESC.
+        :param can_id: can id of the node.
+        """
+        self.vesc = vesc
+        self.can_id = can_id
+        self._get_values_msg = encode_request(GetValues(can_id=can_id))
+        self._conf = None
+
+    def __repr__(self):
+        return "CANNode(%r, %u)" % (self.vesc.serial_port.port, self.can_id)
+
+    @property
+    def conf(self):
+        """
+        The simplified motor configuration of the node, read the first time it is used.
+        """
+        if self._conf is None:
+            self._conf = self.get_motor_conf_simple()
+        return self._conf
+
+    def _request(self, msg_cls, lazy=False, timeout=None):
+        """
+        Sends a request to the node and waits for the reply.
+        :param msg_cls: message class to request.
+        :param lazy: decode each field of the reply only when it is read
+        :param timeout: seconds to wait for the reply, defaults to the response_timeout of the VESC.
+        :return: the reply, with can_id set to the node.
+        """
+        packet = self._get_values_msg if msg_cls is GetValues else encode_request(msg_cls(can_id=self.can_id))
+        msg = self.vesc.write(packet, 0, lazy, timeout)
+        if msg.can_id is None:
+            msg.can_id = self.can_id
+        return msg
+
+    def _set(self, msg):
+        """
+        Sends a setpoint to the node, see VESC._set.
+        """
+        msg.can_id = self.can_id
+        return self.vesc._set(msg)
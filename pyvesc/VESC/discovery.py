@@ -0,0 +1,236 @@
+from pyvesc.protocol.interface import encode_request
+from pyvesc.protocol.base import VESCMessage
+from pyvesc.protocol.packet.codec import Stateful
+from pyvesc.VESC.messages import GetVersion
+import concurrent.futures
+import json
+import os
+import tempfile
+import time
+
+# because people may want to use this library for their own messaging, do not make this a required package
+try:
+    import serial
+    import serial.tools.list_ports
+except ImportError:
+    serial = None
+
+# USB vendor and product id of VESC boards
+VESC_HWID = '0483:5740'
+
+_CACHE_DIRECTORY = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                                'pyvesc')
+# where find_port() remembers the serial port of each uuid
+DEFAULT_CACHE_PATH = os.path.join(_CACHE_DIRECTORY, 'ports.json')
+# where VESC remembers the firmware version and motor configuration of each VESC, see DeviceCache
+DEFAULT_DEVICE_CACHE_PATH = os.path.join(_CACHE_DIRECTORY, 'devices.json')
+
+
+def _load_json(path, default):
+    """
+    :return: the contents of a JSON file, or default if it is missing or corrupt.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def _save_json(path, data):
+    """
+    Writes a JSON file through a temporary file which is renamed over it, so that a reader never sees a half written
+    file.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory or None, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def vesc_serial_ports():
+    """
+    List all serial ports that match the vendor / product ID for VESC boards
+    :return: a list of serial port path strings
+    """
+    if serial is None:
+        raise ImportError("Need to install pyserial in order to discover VESCs.")
+    return [port.device for port in serial.tools.list_ports.comports() if VESC_HWID in port.hwid]
+
+
+def probe(port, baudrate=115200, timeout=0.5):
+    """
+    Asks the VESC on a serial port for its firmware version, which includes its uuid. Nothing else is sent to it, and
+    the port is closed again before returning.
+    :param port: serial port, eg. /dev/ttyACM0
+    :param baudrate: baudrate for the serial communication.
+    :param timeout: seconds to wait for the reply.
+    :return: the GetVersion reply, or None if there was no reply in time.
+    """
+    if serial is None:
+        raise ImportError("Need to install pyserial in order to discover VESCs.")
+    deadline = time.monotonic() + timeout
+    unframer = Stateful()
+    with serial.Serial(port=port, baudrate=baudrate, timeout=timeout) as serial_port:
+        serial_port.write(encode_request(GetVersion))
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            serial_port.timeout = remaining
+            unframer.feed(serial_port.read(max(1, serial_port.in_waiting)))
+            for payload in unframer:
+                if payload and payload[0] == GetVersion.id:
+                    return VESCMessage.unpack(payload)
+
+
+def discover(ports=None, baudrate=115200, timeout=0.5, max_workers=None):
+    """
+    Probes many serial ports at the same time, so finding every VESC takes about as long as probing one.
+    :param ports: serial ports to probe, defaults to every port with the vendor / product ID of VESC boards.
+    :param baudrate: baudrate for the serial communication.
+    :param timeout: seconds to wait for each reply.
+    :param max_workers: number of ports probed at once, defaults to all of them.
+    :return: dict of serial port to GetVersion reply, for the ports which replied.
+    """
+    if ports is None:
+        ports = vesc_serial_ports()
+    if not ports:
+        return {}
+    found = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers or len(ports)) as executor:
+        futures = dict((executor.submit(probe, port, baudrate, timeout), port) for port in ports)
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                version = future.result()
+            except (serial.SerialException, OSError):
+                # busy, unplugged or not a serial port
+                continue
+            if version is not None:
+                found[futures[future]] = version
+    return found
+
+
+class PortCache(object):
+    """
+    Remembers the serial port of each VESC uuid in a JSON file, so that a VESC can be found again by probing only the
+    port it was on last time.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        """
+        :param path: the JSON file.
+        """
+        self.path = path
+        self.ports = _load_json(path, {})
+
+    @staticmethod
+    def _key(uuid):
+        return '%024x' % uuid
+
+    def get(self, uuid):
+        """
+        :param uuid: the uuid as an integer.
+        :return: the serial port the VESC was last found on, or None.
+        """
+        return self.ports.get(self._key(uuid))
+
+    def update(self, versions):
+        """
+        Records where VESCs were found and saves the file. Ports which now have another VESC are forgotten for the
+        uuid which was on them before.
+        :param versions: dict of serial port to GetVersion reply, as returned by discover().
+        """
+        found = set(versions)
+        self.ports = dict((uuid, port) for uuid, port in self.ports.items() if port not in found)
+        for port, version in versions.items():
+            self.ports[self._key(version.uuid)] = port
+        _save_json(self.path, self.ports)
+
+
+class DeviceCache(object):
+    """
+    Remembers the firmware version and motor configuration of each VESC uuid, and the uuid last seen on each serial
+    port, in a JSON file. A VESC which is known can then be connected to without waiting for any reply. The messages
+    are kept as their hex encoded payloads.
+    """
+
+    def __init__(self, path=DEFAULT_DEVICE_CACHE_PATH):
+        """
+        :param path: the JSON file.
+        """
+        self.path = path
+
+    def get(self, port):
+        """
+        :param port: serial port.
+        :return: (GetVersion, GetMCConfTemp or None) of the VESC last seen on the port, or None if it is not known.
+        """
+        data = _load_json(self.path, {})
+        uuid = data.get('ports', {}).get(port)
+        device = data.get('devices', {}).get(uuid)
+        if device is None or 'version' not in device:
+            return None
+        try:
+            version = VESCMessage.unpack(bytes.fromhex(device['version']))
+            conf = VESCMessage.unpack(bytes.fromhex(device['conf'])) if 'conf' in device else None
+        except Exception:
+            # written by a version of PyVESC with other messages
+            return None
+        return version, conf
+
+    def update(self, port, version, conf=None):
+        """
+        Records the VESC on a port and saves the file.
+        :param port: serial port.
+        :param version: GetVersion of the VESC.
+        :param conf: GetMCConfTemp of the VESC, or None if it is not known.
+        """
+        data = _load_json(self.path, {})
+        uuid = PortCache._key(version.uuid)
+        data.setdefault('ports', {})[port] = uuid
+        device = {'version': VESCMessage.pack(version).hex()}
+        if conf is not None:
+            device['conf'] = VESCMessage.pack(conf).hex()
+        data.setdefault('devices', {})[uuid] = device
+        _save_json(self.path, data)
+
+
+def find_port(uuid, ports=None, baudrate=115200, timeout=0.5, cache_path=DEFAULT_CACHE_PATH):
+    """
+    Finds the serial port of the VESC with a uuid. The port in the cache is tried first, with a single GetVersion
+    request. If the VESC is not there every port is probed at once, and the cache is updated with every VESC found.
+    :param uuid: the uuid as an integer. easiest to pass in as 24 digit hex, eg. 0x000000000000000000000000
+    :param ports: serial ports to search, defaults to every port with the vendor / product ID of VESC boards.
+    :param baudrate: baudrate for the serial communication.
+    :param timeout: seconds to wait for each reply.
+    :param cache_path: the JSON file of the cache, or None to not use one.
+    :return: the string path to the serial port, eg. /dev/ttyACM0, or None if the VESC was not found.
+    """
+    if ports is None:
+        ports = vesc_serial_ports()
+    cache = PortCache(cache_path) if cache_path is not None else None
+
+    cached = cache.get(uuid) if cache is not None else None
+    if cached in ports:
+        try:
+            version = probe(cached, baudrate, timeout)
+        except (serial.SerialException, OSError):
+            version = None
+        if version is not None and version.uuid == uuid:
+            return cached
+
+    versions = discover(ports, baudrate, timeout)
+    if cache is not None:
+        cache.update(versions)
+    for port, version in versions.items():
+        if version.uuid == uuid:
+            return port
+    return None
@@ -0,0 +1,5 @@
+class ResponseTimeout(TimeoutError):
+    """
+    The VESC did not reply to a request in time.
+    """
+    pass
@@ -0,0 +1,333 @@
+from pyvesc.protocol.interface import encode_request, encode
+from pyvesc.protocol.base import VESCMessage
+from pyvesc.protocol.packet.codec import Stateful
+from pyvesc.VESC.messages import *
+import collections
+import logging
+import os
+import queue
+import selectors
+import threading
+import time
+
+# because people may want to use this library for their own messaging, do not make this a required package
+try:
+    import serial
+except ImportError:
+    serial = None
+
+_log = logging.getLogger(__name__)
+
+
+class Telemetry(collections.namedtuple('Telemetry', ['message', 'timestamp'])):
+    """
+    Latest telemetry of a device in a VESCFleet: the immutable (Frozen) message and the time.monotonic() at which it
+    arrived.
+    """
+    __slots__ = ()
+
+
+class _Device(object):
+    """
+    State of one serial port of a VESCFleet. Only used by the fleet thread, apart from telemetry which is replaced as a
+    whole.
+    """
+    def __init__(self, name, serial_port):
+        self.name = name
+        self.serial_port = serial_port
+        self.fd = serial_port.fileno()
+        self.unframer = Stateful()
+        # bytes waiting for the port to become writable
+        self.out = bytearray()
+        # the error which made the fleet stop using the port
+        self.error = None
+        self.next_poll = 0.0
+        self.next_heartbeat = 0.0
+        self.polls = 0
+        self.replies = 0
+        self.telemetry = None
+
+
+class VESCFleet(object):
+    """
+    Drives many serial attached VESCs from a single thread. The ports are multiplexed with selectors (epoll on
+    Linux): each device is kept alive with Alive messages unless it was sent a command within the heartbeat period, its
+    telemetry is polled at a fixed rate, and commands queued
+    by other threads are written as the ports become writable. The latest telemetry of every device is available with
+    snapshot().
+
+        with VESCFleet(['/dev/ttyACM0', '/dev/ttyACM1']) as fleet:
+            fleet.set_current('/dev/ttyACM0', 5)
+            measurements = fleet.snapshot()
+    """
+
+    def __init__(self, serial_ports, baudrate=115200, telemetry=GetValues, telemetry_rate=100, heartbeat_period=0.1,
+                 start=True):
+        """
+        :param serial_ports: serial devices to use (i.e. ["/dev/ttyACM0", "/dev/ttyACM1"]), which also name the devices.
+        :param baudrate: baudrate for the serial communication.
+        :param telemetry: message class which is polled from every device, or None to not poll.
+        :param telemetry_rate: number of telemetry polls per second for each device.
+        :param heartbeat_period: seconds between Alive messages to each device, or None for no heartbeat.
+        :param start: start the fleet thread straight away.
+        """
+        if serial is None:
+            raise ImportError("Need to install pyserial in order to use the VESCFleet class.")
+
+        self.telemetry = telemetry
+        self.poll_period = 1.0 / telemetry_rate if telemetry is not None else None
+        self.heartbeat_period = heartbeat_period
+        self._poll_msg = encode_request(telemetry) if telemetry is not None else None
+        self._alive_msg = encode(Alive())
+
+        # commands written by other threads, see send()
+        self._commands = collections.deque()
+        # messages other than telemetry, see receive()
+        self._received = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self._selector = selectors.DefaultSelector()
+        # written to by other threads to wake the fleet thread up
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        os.set_blocking(self._wake_write, False)
+        self._selector.register(self._wake_read, selectors.EVENT_READ, None)
+
+        self.devices = collections.OrderedDict()
+        try:
+            for name in serial_ports:
+                device = _Device(name, serial.Serial(port=name, baudrate=baudrate, timeout=0))
+                os.set_blocking(device.fd, False)
+                self.devices[name] = device
+                self._selector.register(device.fd, selectors.EVENT_READ, device)
+        except Exception:
+            self.close()
+            raise
+
+        if start:
+            self.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        """
+        Starts the fleet thread.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """
+        Stops the fleet thread and closes every serial port.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._wake()
+            self._thread.join()
+        for device in self.devices.values():
+            device.serial_port.close()
+        self._selector.close()
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+
+    def _wake(self):
+        try:
+            os.write(self._wake_write, b'\0')
+        except BlockingIOError:
+            # the fleet thread has not woken up from the last write yet
+            pass
+
+    def send(self, name, msg):
+        """
+        Queues a message for a device. Can be called from any thread.
+        :param name: serial port of the device.
+        :param msg: message, or an encoded packet.
+        """
+        packet = msg if isinstance(msg, (bytes, bytearray)) else encode(msg)
+        self._commands.append((self.devices[name], packet))
+        self._wake()
+
+    def set_current(self, name, new_current):
+        """
+        :param name: serial port of the device.
+        :param new_current: new current in amps for the motor
+        """
+        self.send(name, SetCurrent(new_current))
+
+    def set_rpm(self, name, erpm):
+        """
+        :param name: serial port of the device.
+        :param erpm: new electrical rpm value
+        """
+        self.send(name, SetRPM(int(erpm)))
+
+    def set_duty_cycle(self, name, new_duty_cycle):
+        """
+        :param name: serial port of the device.
+        :param new_duty_cycle: Value of duty cycle to be set (range [-1e5, 1e5]).
+        """
+        self.send(name, SetDutyCycle(new_duty_cycle))
+
+    def snapshot(self):
+        """
+        The latest telemetry of every device.
+        :return: dict of serial port to Telemetry, or None for devices which have not replied yet.
+        """
+        return dict((name, device.telemetry) for name, device in self.devices.items())
+
+    def receive(self, timeout=None):
+        """
+        Gets the next message other than telemetry which a device sent.
+        :param timeout: seconds to wait for a message, None to wait forever.
+        :return: (serial port, message)
+        """
+        name, payload = self._received.get(timeout=timeout)
+        return name, VESCMessage.unpack(payload)
+
+    def stats(self):
+        """
+        :return: dict of serial port to (telemetry polls sent, replies received). A device whose port failed has its
+                 error in devices[port].error and is no longer polled.
+        """
+        return dict((name, (device.polls, device.replies)) for name, device in self.devices.items())
+
+    def _run(self):
+        """
+        The fleet thread.
+        """
+        now = time.monotonic()
+        # spread the polls of the devices over the poll period so their replies do not all arrive at once
+        for index, device in enumerate(self.devices.values()):
+            if self.poll_period is not None:
+                device.next_poll = now + self.poll_period * index / len(self.devices)
+            device.next_heartbeat = now
+
+        while not self._stop.is_set():
+            now = time.monotonic()
+            deadline = self._schedule(now)
+            for key, events in self._selector.select(max(0.0, deadline - time.monotonic())):
+                device = key.data
+                if device is None:
+                    try:
+                        os.read(self._wake_read, 4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                if device.error is not None:
+                    continue
+                if events & selectors.EVENT_READ:
+                    self._read(device)
+                if events & selectors.EVENT_WRITE and device.error is None:
+                    self._flush(device)
+            while self._commands:
+                device, packet = self._commands.popleft()
+                self._write(device, packet)
+                # a command keeps the device alive just like a heartbeat
+                if self.heartbeat_period is not None:
+                    device.next_heartbeat = time.monotonic() + self.heartbeat_period
+
+    def _schedule(self, now):
+        """
+        Writes the heartbeats and telemetry polls which are due.
+        :param now: time.monotonic()
+        :return: time.monotonic() at which the next one is due.
+        """
+        deadline = now + 1.0
+        for device in self.devices.values():
+            if device.error is not None:
+                continue
+            if self.heartbeat_period is not None:
+                if now >= device.next_heartbeat:
+                    self._write(device, self._alive_msg)
+                    device.next_heartbeat = now + self.heartbeat_period
+                deadline = min(deadline, device.next_heartbeat)
+            if self.poll_period is not None:
+                if now >= device.next_poll:
+                    self._write(device, self._poll_msg)
+                    device.polls += 1
+                    # skip polls rather than bunching them up when behind
+                    device.next_poll = max(device.next_poll + self.poll_period, now)
+                deadline = min(deadline, device.next_poll)
+        return deadline
+
+    def _read(self, device):
+        try:
+            data = os.read(device.fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._fail(device, e)
+            return
+        if not data:
+            # a port which stays readable without data was unplugged, and would make the fleet thread spin
+            self._fail(device, EOFError("The serial port was closed"))
+            return
+        device.unframer.feed(data)
+        for payload in device.unframer:
+            if not payload:
+                # a valid packet without a message in it
+                continue
+            if self.telemetry is not None and payload[0] == self.telemetry.id:
+                try:
+                    msg = VESCMessage.unpack(payload, frozen=True)
+                except Exception:
+                    # one bad reply must not stop the fleet thread, which every device depends on
+                    _log.exception("Dropped telemetry from %s which could not be decoded: %r", device.name, payload)
+                    continue
+                device.replies += 1
+                device.telemetry = Telemetry(msg, time.monotonic())
+            else:
+                self._received.put((device.name, payload))
+
+    def _write(self, device, packet):
+        """
+        Writes a packet to a device, or queues it if the port is not writable.
+        """
+        if device.error is not None:
+            return
+        if device.out:
+            device.out += packet
+            return
+        try:
+            written = os.write(device.fd, packet)
+        except BlockingIOError:
+            written = 0
+        except OSError as e:
+            self._fail(device, e)
+            return
+        if written < len(packet):
+            device.out += packet[written:]
+            self._selector.modify(device.fd, selectors.EVENT_READ | selectors.EVENT_WRITE, device)
+
+    def _flush(self, device):
+        """
+        Writes the bytes queued for a device once its port is writable.
+        """
+        if device.error is not None:
+            return
+        try:
+            written = os.write(device.fd, device.out)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._fail(device, e)
+            return
+        del device.out[:written]
+        if not device.out:
+            self._selector.modify(device.fd, selectors.EVENT_READ, device)
+
+    def _fail(self, device, exception):
+        """
+        Stops using the port of a device after it failed, for example because it was unplugged. The other devices
+        carry on. Only the first failure of a device is kept.
+        """
+        if device.error is not None:
+            return
+        device.error = exception
+        device.out.clear()
+        self._selector.unregister(device.fd)
@@ -0,0 +1,104 @@
+from pyvesc.protocol.interface import encode
+from pyvesc.VESC.messages import Alive
+from pyvesc.VESC.writer import Priority
+import heapq
+import itertools
+import threading
+import time
+
+
+class HeartbeatScheduler(object):
+    """
+    Keeps many VESCs alive from a single thread. Each registered VESC is due for a heartbeat one period after the last
+    command written to it, so no Alive message is sent to a VESC which is already receiving commands more often than
+    that.
+
+    A VESC only needs to provide a last_command attribute (the time.monotonic() of its last command) and a
+    write(packet, priority=...) method.
+    """
+
+    # the packet which is written to keep a VESC alive
+    ALIVE = encode(Alive())
+
+    def __init__(self, period=0.1):
+        """
+        :param period: default seconds between heartbeats.
+        """
+        self.period = period
+        # (due time, sequence number, entry). entries are [vesc, period] lists, which are left in the heap when
+        # unregistered and skipped when popped
+        self._heap = []
+        self._entries = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        # number of Alive messages written and skipped because of a recent command
+        self.sent = 0
+        self.skipped = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def register(self, vesc, period=None):
+        """
+        Starts sending heartbeats to a VESC.
+        :param vesc: the VESC.
+        :param period: seconds between heartbeats, defaults to the period of the scheduler.
+        """
+        entry = [vesc, self.period if period is None else period]
+        with self._condition:
+            self._entries[id(vesc)] = entry
+            self._push(entry, time.monotonic())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def unregister(self, vesc):
+        """
+        Stops sending heartbeats to a VESC. No heartbeat is written to it by the scheduler once this returns.
+        :param vesc: the VESC.
+        """
+        with self._condition:
+            self._entries.pop(id(vesc), None)
+            self._condition.notify()
+
+    def _push(self, entry, due):
+        heapq.heappush(self._heap, (due, next(self._sequence), entry))
+
+    def _run(self):
+        """
+        The heartbeat thread. It stops when no VESC is registered, and is started again by register().
+        """
+        with self._condition:
+            while self._entries:
+                now = time.monotonic()
+                due, sequence, entry = self._heap[0]
+                if due > now:
+                    self._condition.wait(due - now)
+                    continue
+                heapq.heappop(self._heap)
+                vesc, period = entry
+                if self._entries.get(id(vesc)) is not entry:
+                    # unregistered
+                    continue
+                idle = now - vesc.last_command
+                if idle < period:
+                    self.skipped += 1
+                    self._push(entry, vesc.last_command + period)
+                    continue
+                try:
+                    # holding the lock, so that unregister() waits for a heartbeat being written
+                    vesc.write(self.ALIVE, priority=Priority.KEEPALIVE)
+                except Exception:
+                    # the port was closed under us, stop keeping it alive
+                    self._entries.pop(id(vesc), None)
+                    continue
+                self.sent += 1
+                self._push(entry, now + period)
+            self._heap = []
+            self._thread = None
+
+
+# the scheduler which keeps every VESC alive
+scheduler = HeartbeatScheduler()
@@ -111,3 +111,14 @@ class GetRotorPosition(metaclass=VESCMessage):
     scalars = {
         'rotor_pos': 100000
     }
+
+class PingCan(metaclass=VESCMessage):
+    """ Gets the can ids of the VESCs on the CAN bus of a VESC, which pings every id
+
+    :ivar can_ids: list of the can ids which replied to the ping.
+    """
+    id = VedderCmd.COMM_PING_CAN
+
+    fields = Struct(
+        'can_ids' / GreedyRange(Byte)
+    )
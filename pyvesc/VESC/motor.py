@@ -0,0 +1,111 @@
+from pyvesc.VESC.messages import *
+import operator
+
+
+class MotorMixin(object):
+    """
+    The setters and getters of a VESC, shared by VESC, CANNode and AsyncVESC. They are written in terms of three hooks:
+
+        _set(msg)                          sends a setpoint message.
+        _request(msg_cls, lazy, timeout)   sends a request and returns the reply.
+        _then(reply, function)             returns function applied to a reply returned by _request.
+
+    and the conf property, the motor configuration. The hooks of AsyncVESC return awaitables, so its setters and
+    getters return awaitables too.
+    """
+
+    def _then(self, reply, function):
+        """
+        :param reply: reply returned by _request.
+        :param function: function of the reply.
+        :return: function(reply)
+        """
+        return function(reply)
+
+    def set_erpm(self, erpm):
+        """
+        Set the electronic RPM value (eg. the actual rpm * the number of pairs of poles)
+        :param erpm: new erpm value
+        """
+        return self._set(SetRPM(int(erpm)))
+
+    def set_rpm(self, rpm):
+        """
+        Set the actual RPM (must have correct motor poles # set in VESC Tool)
+        :param rpm: new rpm value
+        """
+        return self.set_erpm(rpm * (self.conf.motor_poles / 2))
+
+    def set_current(self, new_current):
+        """
+        :param new_current: new current in amps for the motor
+        """
+        return self._set(SetCurrent(new_current))
+
+    def set_brake_current(self, new_current):
+        """
+        :param new_current: new current in amps for the motor brake
+        """
+        return self._set(SetCurrentBrake(new_current))
+
+    def set_duty_cycle(self, new_duty_cycle):
+        """
+        :param new_duty_cycle: Value of duty cycle to be set (range [-1e5, 1e5]).
+        """
+        return self._set(SetDutyCycle(new_duty_cycle))
+
+    def set_servo(self, new_servo_pos):
+        """
+        :param new_servo_pos: New servo position. valid range [0, 1]
+        """
+        return self._set(SetServoPosition(new_servo_pos))
+
+    def get_measurements(self, lazy=False, timeout=None):
+        """
+        :param lazy: decode each measurement only when it is read. Faster when only a few of them are needed.
+        :param timeout: seconds to wait for the measurements, defaults to response_timeout
+        :return: A msg object with attributes containing the measurement values
+        """
+        return self._request(GetValues, lazy, timeout)
+
+    def get_firmware_version(self, timeout=None):
+        return self._request(GetVersion, timeout=timeout)
+
+    def get_motor_conf_simple(self, timeout=None):
+        return self._request(GetMCConfTemp, timeout=timeout)
+
+    def get_erpm(self):
+        """
+        :return: Current motor erpm
+        """
+        return self._then(self.get_measurements(lazy=True), operator.attrgetter('rpm'))
+
+    def get_rpm(self):
+        """
+        :return: Current motor rpm
+        """
+        return self._then(self.get_measurements(lazy=True), lambda values: values.rpm / (self.conf.motor_poles / 2))
+
+    def get_duty_cycle(self):
+        """
+        :return: Current applied duty-cycle
+        """
+        return self._then(self.get_measurements(lazy=True), operator.attrgetter('duty_cycle_now'))
+
+    def get_v_in(self):
+        """
+        :return: Current input voltage
+        """
+        return self._then(self.get_measurements(lazy=True), operator.attrgetter('v_in'))
+
+    def get_motor_current(self):
+        """
+        :return: Current motor current
+        """
+        return self._then(self.get_measurements(lazy=True), operator.attrgetter('avg_motor_current'))
+
+    def get_incoming_current(self):
+        """
+        :return: Current incoming current
+        """
+        return self._then(self.get_measurements(lazy=True), operator.attrgetter('avg_input_current'))
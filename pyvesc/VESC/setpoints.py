@@ -0,0 +1,147 @@
+from pyvesc.protocol.interface import encode
+from pyvesc.VESC.writer import Priority
+import collections
+import threading
+import time
+
+
+class SetpointChannel(object):
+    """
+    Sends setpoints (SetCurrent, SetRPM, ...) to a VESC no faster than the link can carry them. Only the newest
+    setpoint of each setter class (and can id) is kept: when a setpoint is set again before the previous one was sent,
+    the previous one is dropped rather than queued, so the motor never follows stale setpoints.
+
+    The setpoints are written by the thread of a FrameWriter, which takes every pending setpoint at once and then
+    leaves them alone for as long as the link takes to transmit them, so setpoints which arrive during that time are
+    coalesced into the next write.
+    """
+
+    def __init__(self, writer, baudrate=115200, bits_per_byte=10):
+        """
+        :param writer: the FrameWriter which writes the setpoints.
+        :param baudrate: baudrate of the link.
+        :param bits_per_byte: bits on the wire per byte, 10 for 8N1.
+        """
+        self.seconds_per_byte = bits_per_byte / baudrate
+        self._writer = writer
+        # (frame, time submitted) of the newest unsent setpoint, keyed by (setter class, can id)
+        self._pending = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # time.monotonic() at which the link has carried the setpoints written last
+        self._due = 0.0
+        self._closed = False
+        self.sent = 0
+        self.dropped = 0
+        # number of dropped setpoints of each setter class
+        self.dropped_by_type = collections.Counter()
+        writer.attach(self)
+
+    def _check(self):
+        if self._writer.error is not None:
+            raise self._writer.error
+        if self._closed:
+            raise ValueError("The setpoint channel is closed")
+
+    def _replace(self, key, frame, submitted):
+        """
+        Makes frame the pending setpoint of key, dropping the one it replaces. Called holding the lock.
+        """
+        if self._pending.pop(key, None) is not None:
+            self.dropped += 1
+            self.dropped_by_type[key[0].__name__] += 1
+        self._pending[key] = (frame, submitted)
+
+    def set(self, msg):
+        """
+        Sends a setpoint, replacing any setpoint of the same class which has not been sent yet.
+        :param msg: the setpoint message.
+        """
+        frame = encode(msg)
+        with self._lock:
+            self._check()
+            self._replace((type(msg), msg.can_id), frame, time.perf_counter())
+        self._writer.wake()
+
+    def set_many(self, setter, can_ids, packets):
+        """
+        Sends one setter to many can ids at once, replacing any setpoint of the same class and can id which has not
+        been sent yet. The setpoints go out together in one write.
+        :param setter: the setter class.
+        :param can_ids: can ids, in the order of the packets.
+        :param packets: back to back packets of the same size, see pyvesc.encode_forward().
+        """
+        if not can_ids:
+            return
+        view = memoryview(packets)
+        size = len(view) // len(can_ids)
+        submitted = time.perf_counter()
+        with self._lock:
+            self._check()
+            for index, can_id in enumerate(can_ids):
+                self._replace((setter, can_id), view[index * size:(index + 1) * size], submitted)
+        self._writer.wake()
+
+    def preempt(self, msg, can_ids=None):
+        """
+        Drops the pending setpoints of the can ids msg is for and writes msg ahead of all other traffic but the
+        commands submitted before it, so that no setpoint set before msg can be sent after it. For safety commands such
+        as braking.
+        :param msg: the message, or its packets.
+        :param can_ids: can ids msg is for, None for the VESC itself. Defaults to msg.can_id.
+        """
+        if isinstance(msg, (bytes, bytearray)):
+            frame = msg
+        else:
+            frame = encode(msg)
+            if can_ids is None:
+                can_ids = (msg.can_id,)
+        can_ids = set(can_ids) if can_ids is not None else {None}
+        with self._lock:
+            for key in [key for key in self._pending if key[1] in can_ids]:
+                del self._pending[key]
+                self.dropped += 1
+                self.dropped_by_type[key[0].__name__] += 1
+            self._writer.submit(frame, Priority.SAFETY)
+
+    def close(self):
+        """
+        Stops accepting setpoints. The writer still writes those which are pending when it is closed.
+        """
+        with self._lock:
+            self._closed = True
+
+    def stats(self):
+        """
+        :return: dict with the number of setpoints sent, dropped, dropped per setter class and pending.
+        """
+        with self._lock:
+            return {
+                'sent': self.sent,
+                'dropped': self.dropped,
+                'dropped_by_type': dict(self.dropped_by_type),
+                'pending': len(self._pending),
+            }
+
+    def _next_due(self):
+        """
+        :return: time.monotonic() at which the pending setpoints can be written, None if there are none.
+        """
+        return self._due if self._pending else None
+
+    def _take(self, now, force=False):
+        """
+        Takes every pending setpoint out of the channel, if the link has carried the setpoints taken last time. Called
+        by the writer thread.
+        :param now: time.monotonic()
+        :param force: take them even if the link is still busy, when flushing or closing.
+        :return: list of (frame, time submitted).
+        """
+        with self._lock:
+            if not self._pending or (now < self._due and not force):
+                return []
+            frames = list(self._pending.values())
+            self.sent += len(frames)
+            self._pending.clear()
+            # leave the link time to carry the frames before sending newer setpoints
+            self._due = now + sum(len(frame) for frame, submitted in frames) * self.seconds_per_byte
+            return frames
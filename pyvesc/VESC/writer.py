@@ -0,0 +1,207 @@
+from enum import IntEnum
+import collections
+import threading
+import time
+
+
+class Priority(IntEnum):
+    """
+    Classes of outgoing traffic, most urgent first.
+    """
+    SAFETY = 0      # braking and zero current, never wait behind anything else
+    SETPOINT = 1    # SetCurrent, SetRPM, ...
+    KEEPALIVE = 2   # Alive
+    TELEMETRY = 3   # getter requests
+    BULK = 4        # configuration and other large transfers
+
+
+class FrameWriter(object):
+    """
+    Writes frames submitted by any number of threads from a single writer thread. Every write joins the frames of each
+    priority class which are queued at the time (or arrive within the coalescing window), most urgent class first, so
+    frames of one class from one thread are written in order and frames never interleave.
+
+    Safety frames overtake every other class, except setpoint class frames submitted before them, which are written
+    ahead of them in the order they were submitted: a command is never written after a safety frame which followed it.
+
+    Setpoints of an attached SetpointChannel are taken by the writer thread when the link has carried the previous
+    ones, and written after the other setpoint class frames.
+
+    Bulk frames are not written all at once: each write carries at most bulk_chunk bytes of them, and when the
+    baudrate is known the next bulk chunk waits until the link has carried the previous one. More urgent frames are
+    written in between, so the latency of a safety frame is bounded by the transmit time of one bulk chunk (or of the
+    largest bulk frame, since a frame is never split).
+    """
+
+    def __init__(self, write, window=0.0, baudrate=None, bulk_chunk=256, bits_per_byte=10):
+        """
+        :param write: function which writes bytes, for example serial.Serial.write.
+        :param window: seconds to wait after the first frame of a write for more frames to join it.
+        :param baudrate: baudrate of the link, used to pace bulk frames. None to not pace them.
+        :param bulk_chunk: maximum number of bytes of bulk frames in one write.
+        :param bits_per_byte: bits on the wire per byte, 10 for 8N1.
+        """
+        self.window = window
+        self.bulk_chunk = bulk_chunk
+        self.seconds_per_byte = bits_per_byte / baudrate if baudrate else 0.0
+        self._write = write
+        # a queue of (frame, time submitted) for each priority. appending to and popping from a deque is thread safe,
+        # so submitting a frame takes no lock. flush markers are queued as (threading.Event, None)
+        self._queues = [collections.deque() for priority in Priority]
+        self._ready = threading.Event()
+        self._closed = False
+        # the SetpointChannel whose setpoints this writer writes, see attach()
+        self._channel = None
+        # the exception raised by write, after which no more frames are accepted
+        self.error = None
+        self.frames = 0
+        self.writes = 0
+        self.max_queue_depth = 0
+        # [number of frames, total latency, maximum latency] of each priority, from submit until written
+        self._latency = [[0, 0.0, 0.0] for priority in Priority]
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def attach(self, channel):
+        """
+        Writes the setpoints of a SetpointChannel from the writer thread, paced by the channel.
+        :param channel: the SetpointChannel.
+        """
+        self._channel = channel
+
+    def wake(self):
+        """
+        Tells the writer thread that there is something to write, for example a setpoint in the attached channel.
+        """
+        self._ready.set()
+
+    def submit(self, frame, priority=Priority.SETPOINT):
+        """
+        Queues a frame to be written. Returns straight away.
+        :param frame: bytes to write.
+        :param priority: Priority class of the frame.
+        """
+        if self.error is not None:
+            raise self.error
+        if self._closed:
+            raise ValueError("The writer is closed")
+        self._queues[priority].append((frame, time.perf_counter()))
+        depth = sum(len(queue) for queue in self._queues)
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        self._ready.set()
+
+    def flush(self, timeout=None):
+        """
+        Waits until every frame submitted so far is written.
+        :param timeout: seconds to wait, None to wait forever.
+        :return: True if the frames were written, False on timeout.
+        """
+        if self.error is not None or self._closed or not self._thread.is_alive():
+            return True
+        # the writer thread sets the marker once every frame queued before it is written. the other classes are always
+        # emptied before bulk frames are written, so the marker goes behind the bulk frames. pending setpoints are
+        # written straight away rather than when the link has carried the previous ones
+        if self._channel is not None:
+            self._channel._due = 0.0
+        marker = threading.Event()
+        self._queues[Priority.BULK].append((marker, None))
+        self._ready.set()
+        return marker.wait(timeout)
+
+    def close(self):
+        """
+        Writes the frames which are still queued and stops the writer thread.
+        """
+        self._closed = True
+        self._ready.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def stats(self):
+        """
+        :return: dict with the number of writes, frames written, the average number of frames per write, the number
+                 of frames queued, the largest number of frames which were queued at once, and the latency of each
+                 priority class: the number of frames written and their mean and maximum seconds from submit until
+                 written.
+        """
+        return {
+            'writes': self.writes,
+            'frames': self.frames,
+            'frames_per_write': self.frames / self.writes if self.writes else 0.0,
+            'queue_depth': sum(len(queue) for queue in self._queues),
+            'max_queue_depth': self.max_queue_depth,
+            'latency': dict((priority.name, {'frames': count, 'mean': total / count if count else 0.0, 'max': worst})
+                            for priority, (count, total, worst) in zip(Priority, self._latency)),
+        }
+
+    def _run(self):
+        """
+        The writer thread.
+        """
+        bulk = self._queues[Priority.BULK]
+        # time.monotonic() at which the link has carried the last bulk chunk
+        bulk_done = 0.0
+        while True:
+            # frames held back until the link has carried the previous ones
+            held = [bulk_done] if bulk else []
+            setpoints_due = self._channel._next_due() if self._channel is not None else None
+            if setpoints_due is not None:
+                held.append(setpoints_due)
+            self._ready.wait(max(0.0, min(held) - time.monotonic()) if held else None)
+            self._ready.clear()
+            if self.window and not self._closed:
+                time.sleep(self.window)
+            # attached after the thread started
+            channel = self._channel
+
+            # (priority, frame, time submitted) of every frame in this write
+            frames = []
+            for priority, queue in zip(Priority, self._queues[:Priority.BULK]):
+                while queue:
+                    frames.append((priority,) + queue.popleft())
+                if priority == Priority.SETPOINT and frames and frames[0][0] == Priority.SAFETY:
+                    # commands submitted before a safety frame go out ahead of it, so they can not undo it
+                    frames.sort(key=lambda frame: frame[2])
+                if priority == Priority.SETPOINT and channel is not None:
+                    # taken after the safety frames, which dropped the setpoints set before them
+                    frames.extend((priority,) + frame for frame in channel._take(time.monotonic(), self._closed))
+            markers = []
+            chunk = 0
+            if self._closed or time.monotonic() >= bulk_done:
+                while bulk:
+                    frame, submitted = bulk[0]
+                    if submitted is None:
+                        markers.append(bulk.popleft()[0])
+                    elif chunk == 0 or chunk + len(frame) <= self.bulk_chunk:
+                        frames.append((Priority.BULK,) + bulk.popleft())
+                        chunk += len(frame)
+                    else:
+                        break
+
+            if frames:
+                try:
+                    self._write(b''.join(frame for priority, frame, submitted in frames))
+                except Exception as e:
+                    self.error = e
+                written = time.perf_counter()
+                for priority, frame, submitted in frames:
+                    latency = self._latency[priority]
+                    latency[0] += 1
+                    latency[1] += written - submitted
+                    latency[2] = max(latency[2], written - submitted)
+                self.frames += len(frames)
+                self.writes += 1
+                bulk_done = time.monotonic() + chunk * self.seconds_per_byte
+            for marker in markers:
+                marker.set()
+
+            if self.error is not None or (self._closed and not any(self._queues) and
+                                          (channel is None or channel._next_due() is None)):
+                # let anybody still flushing go
+                for queue in self._queues:
+                    while queue:
+                        frame, submitted = queue.popleft()
+                        if submitted is None:
+                            frame.set()
+                return
@@ -1,3 +1,4 @@
 from .interface import *
 from .packet import *
 from .base import *
+from .batch import *
@@ -1,5 +1,8 @@
 from construct import *
 from pprint import pprint
+import collections
+import re
+import struct
 
 class VESCMessage(type):
     """ Metaclass for VESC messages.
@@ -8,6 +11,17 @@ class VESCMessage(type):
     id: unsigned integer which is the identification number for messages of this class
     fields: a construct.Struct - see: https://construct.readthedocs.io
     scalars: a dictionary of field names to scalars to be applied upon unpack
+
+    When a message class is defined its fields are compiled to struct formats where possible, so that decoding a
+    fixed-layout message is a single struct unpack plus scaling. Fields that can not be compiled fall back to parsing
+    with construct.
+
+    Message instances store their fields in __slots__ rather than a __dict__, and are built by a positional
+    constructor generated for each message class. Every message class also has an immutable, tuple-like variant in
+    its Frozen attribute.
+
+    Messages with a fixed layout can also be decoded lazily: the message object keeps the raw payload and decodes
+    each field the first time it is read.
     """
    
     #a list of messages we know about to avoid duplicates
@@ -15,10 +29,20 @@ class VESCMessage(type):
     
     #some standard parts of the packet we will use later
     _id_fmt = 'msg_id' / Byte
-    _can_id_fmt = Struct('comm_fwd_can' / Const(33, Byte), 'source_can_id' / Byte)
+    _comm_fwd_can = 33
+    _can_id_fmt = Struct('comm_fwd_can' / Const(_comm_fwd_can, Byte), 'source_can_id' / Byte)
+
+    def __new__(mcs, name, bases, clsdict):
+        # store the fields of each instance in slots
+        fields = clsdict.get('fields')
+        if isinstance(fields, Struct) and '__slots__' not in clsdict:
+            clsdict = dict(clsdict)
+            clsdict['__slots__'] = tuple(subcon.name for subcon in fields.subcons) + ('can_id', '_raw')
+            # called for fields which are not set yet, which decodes them if the message was unpacked lazily
+            clsdict['__getattr__'] = VESCMessage._decode_field
+        return super(VESCMessage, mcs).__new__(mcs, name, bases, clsdict)
 
     def __init__(cls, name, bases, clsdict):
-        cls.can_id = None
         msg_id = clsdict['id']
 
         #some classes might not have this set
@@ -36,39 +60,322 @@ class VESCMessage(type):
         else:
             VESCMessage._msg_registry[msg_id] = cls
 
+        # compile the decoder. _struct is only set when every field is in one struct format
+        cls._layout = None
+        cls._struct = None
+        cls._scales = ()
+        cls._field_names = None
+        cls._new = None
+        cls._lazy_fields = None
+        # compile the encoders, which pack the message id (and forwarding header) followed by the fields
+        cls._encoder = None
+        cls._can_encoder = None
+        # header and forwarded payload of a whole packet, for short payloads. see interface.encode_forward
+        cls._can_packet = None
+        if isinstance(cls.fields, Struct):
+            cls._field_names = tuple(subcon.name for subcon in cls.fields.subcons)
+            cls._layout = VESCMessage._compile_layout(cls.fields)
+            if (cls._layout is not None and len(cls._layout) == 1 and cls._layout[0][0] is not None and
+                    not cls._layout[0][1]):
+                cls._struct = cls._layout[0][0]
+                byte_order, fmt = cls._struct.format[0], cls._struct.format[1:]
+                cls._encoder = struct.Struct(byte_order + 'B' + fmt)
+                cls._can_encoder = struct.Struct(byte_order + 'BBB' + fmt)
+                if cls._can_encoder.size < 256:
+                    cls._can_packet = struct.Struct(byte_order + 'BBBBB' + fmt)
+                cls._lazy_fields = VESCMessage._compile_fields(cls)
+            # (index, scalar) of every field which is scaled
+            cls._scales = tuple((index, cls.scalars[subcon.name]) for index, subcon in enumerate(cls.fields.subcons)
+                                if subcon.name in cls.scalars)
+            cls._new = VESCMessage._make_constructor(cls._field_names)
+            cls.Frozen = VESCMessage._make_frozen(cls)
+
         super(VESCMessage, cls).__init__(name, bases, clsdict)
 
+    @property
+    def can_id(cls):
+        # requests can be encoded from the message class itself, which is never forwarded. instances keep their own
+        # can_id in a slot
+        return None
+
     def __call__(cls, *args, **kwargs):
+        if cls._new is not None:
+            if args:
+                if len(args) != len(cls._field_names):
+                    raise AttributeError("Expected %u arguments, received %u" % (len(cls._field_names), len(args)))
+                return cls._new(cls, *args, can_id=kwargs.get('can_id'))
+            instance = cls.__new__(cls)
+            instance.can_id = kwargs.get('can_id')
+            return instance
+
         instance = super(VESCMessage, cls).__call__()
-        if 'can_id' in kwargs:
-            instance.can_id = kwargs['can_id']
-        else:
-            instance.can_id = None
+        instance.can_id = kwargs.get('can_id')
 
         if args:
-            if len(args) != len(cls.fields.subcons):
-                raise AttributeError("Expected %u arguments, received %u" % (len(cls.fields.subcons), len(args)))
-            for subcon, val in zip(cls.fields.subcons, args):
-                setattr(instance, subcon.name, val)
+            names = cls._field_names
+            if names is None:
+                names = [subcon.name for subcon in cls.fields.subcons]
+            if len(args) != len(names):
+                raise AttributeError("Expected %u arguments, received %u" % (len(names), len(args)))
+            for name, val in zip(names, args):
+                setattr(instance, name, val)
         return instance
 
+    @staticmethod
+    def _make_constructor(field_names):
+        """
+        Generates a function which creates a message object from its field values in order, assigning each slot
+        directly rather than looping with setattr.
+        :param field_names: names of the message fields.
+        :return: function of (message class, *field values, can_id=None).
+        """
+        arguments = ''.join('%s, ' % name for name in field_names)
+        assignments = ''.join('    _instance.%s = %s\n' % (name, name) for name in field_names)
+        source = ('def _new(_cls, %scan_id=None):\n'
+                  '    _instance = _cls.__new__(_cls)\n'
+                  '%s'
+                  '    _instance.can_id = can_id\n'
+                  '    return _instance\n' % (arguments, assignments))
+        namespace = {}
+        exec(source, namespace)
+        return namespace['_new']
+
+    @staticmethod
+    def _compile_fields(cls):
+        """
+        Compiles the decoder of each field of a fixed layout message on its own, for decoding fields lazily.
+        :param cls: message class, with _struct set.
+        :return: dict of field name to (struct.Struct, offset in the payload, converter or None, scalar or None).
+        """
+        byte_order = cls._struct.format[0]
+        converters = dict(cls._layout[0][1])
+        fields = {}
+        offset = 1 # the message id
+        for index, (name, char) in enumerate(zip(cls._field_names, re.findall(r'\d*\D', cls._struct.format[1:]))):
+            fmt = struct.Struct(byte_order + char)
+            fields[name] = (fmt, offset, converters.get(index), cls.scalars.get(name))
+            offset += fmt.size
+        return fields
+
+    @staticmethod
+    def _decode_field(instance, name):
+        """
+        Decodes a field of a lazily unpacked message and stores it in the message. Installed as __getattr__ of
+        message classes, so it is only called for fields which have not been set.
+        :param instance: message object.
+        :param name: field name.
+        :return: field value.
+        """
+        field = instance._lazy_fields.get(name) if instance._lazy_fields is not None else None
+        # _raw is only set if the message was unpacked lazily
+        if field is None or not hasattr(instance, '_raw'):
+            raise AttributeError("'%s' object has no attribute '%s'" % (type(instance).__name__, name))
+        raw = instance._raw
+        fmt, offset, converter, scalar = field
+        value = fmt.unpack_from(raw, offset)[0]
+        if converter is not None:
+            value = converter(value)
+        if scalar is not None:
+            value = value / scalar
+        setattr(instance, name, value)
+        return value
+
+    @staticmethod
+    def _make_frozen(cls):
+        """
+        Creates the immutable variant of a message class: a namedtuple of the fields followed by can_id, which can
+        be packed like the message class itself.
+        :param cls: message class.
+        :return: namedtuple class.
+        """
+        base = collections.namedtuple(cls.__name__, cls._field_names + ('can_id',))
+        # can_id defaults to None. set on __new__ rather than with namedtuple(defaults=...), which needs Python 3.7
+        base.__new__.__defaults__ = (None,)
+        attributes = ('id', 'fields', 'scalars', '_field_names', '_scales', '_encoder', '_can_encoder',
+                      '_can_packet')
+        namespace = dict((attribute, getattr(cls, attribute)) for attribute in attributes)
+        namespace['__slots__'] = ()
+        # found again as cls.Frozen when unpickled
+        namespace['__module__'] = cls.__module__
+        namespace['__qualname__'] = cls.__qualname__ + '.Frozen'
+        return type(cls.__name__, (base,), namespace)
+
     @staticmethod
     def msg_type(id):
         return VESCMessage._msg_registry[id]
 
     @staticmethod
-    def unpack(msg_bytes):
+    def _compile_layout(fields):
+        """
+        Compiles a construct.Struct to a list of segments which can be decoded without construct. A segment is either
+        (struct.Struct, converters) for a run of fixed size fields, where converters is a list of (index, function) for
+        values which need converting after unpacking, (None, encoding) for a null terminated string, or (None, None) for
+        the rest of the payload as a list of bytes (GreedyRange(Byte)).
+        :param fields: construct.Struct of the message fields.
+        :return: list of segments, or None if some field can not be compiled.
+        """
+        layout = []
+        fmt = None
+        converters = []
+        count = 0
+
+        def flush():
+            if fmt is not None:
+                layout.append((struct.Struct(fmt), converters))
+
+        for subcon in fields.subcons:
+            field = subcon.subcon if isinstance(subcon, Renamed) else subcon
+            if isinstance(field, FormatField):
+                byte_order, char = field.fmtstr[0], field.fmtstr[1:]
+            elif isinstance(field, BytesInteger) and isinstance(field.length, int):
+                byte_order, char = '>', '%us' % field.length
+                order = 'little' if field.swapped else 'big'
+                converter = lambda value, order=order, signed=field.signed: int.from_bytes(value, order, signed=signed)
+            elif (isinstance(field, StringEncoded) and isinstance(field.subcon, NullTerminated) and
+                  field.subcon.subcon is GreedyBytes and field.subcon.term == b'\x00' and
+                  not field.subcon.include and field.subcon.consume):
+                flush()
+                layout.append((None, field.encoding))
+                fmt, converters, count = None, [], 0
+                continue
+            elif isinstance(field, GreedyRange) and field.subcon is Byte:
+                flush()
+                layout.append((None, None))
+                fmt, converters, count = None, [], 0
+                continue
+            else:
+                return None
+            if fmt is not None and fmt[0] != byte_order:
+                flush()
+                fmt, converters, count = None, [], 0
+            if fmt is None:
+                fmt = byte_order
+            fmt += char
+            if isinstance(field, BytesInteger):
+                converters.append((count, converter))
+            count += 1
+        flush()
+        if not layout:
+            # a message without any fields
+            layout.append((struct.Struct('>'), []))
+        return layout
+
+    @staticmethod
+    def _decode_layout(layout, msg_bytes, offset):
+        """
+        Decodes the raw (unscaled) field values of a message using a compiled layout.
+        :param layout: list of segments, see _compile_layout.
+        :param msg_bytes: payload of the packet.
+        :param offset: index of the first field in msg_bytes.
+        :return: list of field values.
+        """
+        values = []
+        for fmt, extra in layout:
+            if fmt is None and extra is None:
+                # the rest of the payload
+                values.append(list(msg_bytes[offset:]))
+                offset = len(msg_bytes)
+            elif fmt is None:
+                # null terminated string, extra is its encoding
+                if isinstance(msg_bytes, memoryview):
+                    msg_bytes = msg_bytes.tobytes()
+                end = msg_bytes.index(b'\x00', offset)
+                values.append(bytes(msg_bytes[offset:end]).decode(extra))
+                offset = end + 1
+            else:
+                items = fmt.unpack_from(msg_bytes, offset)
+                offset += fmt.size
+                if extra:
+                    items = list(items)
+                    for index, converter in extra:
+                        items[index] = converter(items[index])
+                values.extend(items)
+        return values
+
+    @staticmethod
+    def payload_id(msg_bytes):
+        """
+        Gives the id of the message in a payload, looking past the forwarding header of messages forwarded over CAN.
+        :param msg_bytes: payload of the packet.
+        :return: message id.
+        """
+        if msg_bytes[0] == VESCMessage._comm_fwd_can and len(msg_bytes) > 2:
+            return msg_bytes[2]
+        return msg_bytes[0]
+
+    @staticmethod
+    def unpack(msg_bytes, frozen=False, lazy=False, offset=0, length=None):
+        """
+        Decodes the payload of a packet to a message object. A payload which starts with the forwarding header
+        (COMM_FORWARD_CAN and a can id) is decoded to the forwarded message, with its can_id set to that can id.
+        :param msg_bytes: payload of the packet, or a buffer which contains it.
+        :param frozen: return the immutable Frozen variant of the message.
+        :param lazy: only decode each field when it is first read. The message keeps a copy of the payload. Messages
+                     without a fixed layout, and frozen messages, are always decoded straight away.
+        :param offset: index of the payload in msg_bytes.
+        :param length: length of the payload, defaults to the rest of msg_bytes. Fixed layout messages are decoded in
+                       place, other messages from a copy of the payload.
+        :return: message object.
+        """
+        if length is None:
+            length = len(msg_bytes) - offset
+        if msg_bytes[offset] == VESCMessage._comm_fwd_can and length > 2:
+            msg = VESCMessage.unpack(msg_bytes, frozen, lazy, offset + 2, length - 2)
+            if frozen:
+                return msg._replace(can_id=msg_bytes[offset + 1])
+            msg.can_id = msg_bytes[offset + 1]
+            return msg
 
         #print('unpack')
         #pprint(msg_bytes)
 
-        #first byte is our message id
-        msg_id = Byte.parse(msg_bytes)
+        #first byte is our message id. msg_bytes may be a memoryview so index rather than parse it
+        msg_id = msg_bytes[offset]
         
         #use the magic factory to make our VESCMessage class
         msg = VESCMessage.msg_type(msg_id)
-        
-        #parse our data, skipping that first byte
+
+        if (offset or length != len(msg_bytes)) and (lazy or msg._struct is None or length < 1 + msg._struct.size):
+            # only a struct reads the payload in place without reading past its end
+            msg_bytes = bytes(msg_bytes[offset:offset + length])
+            offset = 0
+
+        #keep the payload to decode fields on demand
+        if lazy and not frozen and msg._lazy_fields is not None and len(msg_bytes) >= 1 + msg._struct.size:
+            instance = msg.__new__(msg)
+            instance.can_id = None
+            # a memoryview would pin (and could see changes to) the buffer it was taken from
+            instance._raw = msg_bytes if isinstance(msg_bytes, bytes) else bytes(msg_bytes)
+            return instance
+
+        #decode with the compiled layout if we have one
+        if msg._layout is not None:
+            try:
+                if msg._struct is not None:
+                    values = list(msg._struct.unpack_from(msg_bytes, offset + 1))
+                else:
+                    values = VESCMessage._decode_layout(msg._layout, msg_bytes, 1)
+            except (struct.error, ValueError, UnicodeDecodeError):
+                # let construct report what is wrong with the payload
+                return VESCMessage._unpack_construct(msg, msg_bytes, frozen)
+            for index, scalar in msg._scales:
+                values[index] = values[index] / scalar
+            if frozen:
+                return msg.Frozen(*values)
+            return msg._new(msg, *values)
+
+        return VESCMessage._unpack_construct(msg, msg_bytes, frozen)
+
+    @staticmethod
+    def _unpack_construct(msg, msg_bytes, frozen=False):
+        """
+        Decodes a message by parsing its fields with construct.
+        :param msg: message class.
+        :param msg_bytes: payload of the packet.
+        :param frozen: return the immutable Frozen variant of the message.
+        :return: message object.
+        """
+        #parse our data, skipping that first byte (slicing a memoryview does not copy)
         data = msg.fields.parse(msg_bytes[1:])
         values = []
         for subcon in msg.fields.subcons:
@@ -83,12 +390,38 @@ class VESCMessage(type):
                 print("Error ecountered on field " + msg.fields[subcon.name][0])
                 print(e)
 
+        if frozen:
+            return msg.Frozen(*values)
         msg = msg(*values)
 
         return msg
 
     @staticmethod
     def pack(instance, header_only=None):
+        #requests are just the message id, with the forwarding header if it goes to a can id
+        if header_only is not None:
+            if instance.can_id is None:
+                return bytes((instance.id,))
+            return bytes((VESCMessage._comm_fwd_can, instance.can_id, instance.id))
+
+        #use the compiled encoder if we have one
+        if instance._encoder is not None:
+            values = [getattr(instance, name) for name in instance._field_names]
+            for index, scalar in instance._scales:
+                values[index] = int(values[index] * scalar)
+            if instance.can_id is None:
+                return instance._encoder.pack(instance.id, *values)
+            return instance._can_encoder.pack(VESCMessage._comm_fwd_can, instance.can_id, instance.id, *values)
+
+        return VESCMessage._pack_construct(instance)
+
+    @staticmethod
+    def _pack_construct(instance):
+        """
+        Encodes a message by building its fields with construct.
+        :param instance: message object.
+        :return: payload of the packet.
+        """
         fmt = Struct()
         values = {}
 
@@ -101,16 +434,14 @@ class VESCMessage(type):
         fmt += VESCMessage._id_fmt
         values['msg_id'] = int(instance.id)
 
-        #are we sending data along too?
-        if header_only is None:
-            #add in our message specific fields
-            fmt += instance.fields
+        #add in our message specific fields
+        fmt += instance.fields
 
-            #loop through our data...
-            for subcon in instance.fields.subcons:
-                if subcon.name in instance.scalars:
-                    values[subcon.name] = int(getattr(instance, subcon.name) * instance.scalars[subcon.name])
-                else:
-                    values[subcon.name] = getattr(instance, subcon.name)
+        #loop through our data...
+        for subcon in instance.fields.subcons:
+            if subcon.name in instance.scalars:
+                values[subcon.name] = int(getattr(instance, subcon.name) * instance.scalars[subcon.name])
+            else:
+                values[subcon.name] = getattr(instance, subcon.name)
         
         return fmt.build(values)
@@ -0,0 +1,105 @@
+import struct
+
+# numpy is only needed for batch decoding, so do not make it a required package
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# numpy kind of each integer and float struct format character
+_KINDS = dict([(char, 'i') for char in 'bhilq'] + [(char, 'u') for char in 'BHILQ'] + [(char, 'f') for char in 'efd'])
+
+# (raw dtype, decoded dtype, scaled field names, scalars) for each message class, see _dtypes
+_dtype_cache = {}
+
+
+def message_dtype(msg_cls):
+    """
+    Builds the numpy dtype of the payload of a fixed size message from its construct Struct. The first field is the
+    message id, followed by the message fields in their wire byte order.
+
+    :param msg_cls: The message type.
+    :type msg_cls: PyVESC message class
+
+    :return: Structured dtype with one field per message field.
+    :rtype: numpy.dtype
+    """
+    if numpy is None:
+        raise ImportError("Need to install numpy in order to use batch decoding.")
+    fields = [('msg_id', 'u1')]
+    for subcon in msg_cls.fields.subcons:
+        field = getattr(subcon, 'subcon', None)
+        fmtstr = getattr(field, 'fmtstr', None)
+        if fmtstr is None or fmtstr[1:] not in _KINDS:
+            raise TypeError("Field %s of %s is not a fixed size number" % (subcon.name, msg_cls.__name__))
+        byte_order = '<' if fmtstr[0] == '<' else '>'
+        fields.append((subcon.name, '%s%s%u' % (byte_order, _KINDS[fmtstr[1:]], struct.calcsize(fmtstr))))
+    return numpy.dtype(fields)
+
+
+def _dtypes(msg_cls):
+    """
+    Gives the dtypes used to decode a batch of msg_cls, building them the first time.
+    :param msg_cls: The message type.
+    :return: (raw dtype, decoded dtype, scaled field names, scalars of the scaled fields)
+    """
+    dtypes = _dtype_cache.get(msg_cls)
+    if dtypes is None:
+        raw = message_dtype(msg_cls)
+        scaled = [name for name in msg_cls._field_names if name in msg_cls.scalars]
+        # scaled fields become floats, the rest keep their type in native byte order
+        decoded = numpy.dtype([(name, numpy.float64 if name in msg_cls.scalars else raw[name].newbyteorder('='))
+                               for name in msg_cls._field_names])
+        scalars = numpy.array([msg_cls.scalars[name] for name in scaled], dtype=numpy.float64)
+        dtypes = _dtype_cache[msg_cls] = (raw, decoded, scaled, scalars)
+    return dtypes
+
+
+def decode_batch(payloads, msg_cls, columns=False):
+    """
+    Decodes many payloads of the same fixed size message at once into numpy
+    arrays, rather than into one message object per payload. The message's
+    scalars are applied to all scaled fields with a single vectorized divide.
+
+    :param payloads: Payloads of msg_cls, for example from unframe_all.
+    :type payloads: list of bytes-like objects
+
+    :param msg_cls: The message type of every payload.
+    :type msg_cls: PyVESC message class
+
+    :param columns: Return a dict of field name to column array instead of a
+                    structured array.
+    :type columns: bool
+
+    :return: Structured array with one record per payload, or dict of columns.
+    :rtype: numpy.ndarray or dict
+    """
+    raw_dtype, decoded_dtype, scaled, scalars = _dtypes(msg_cls)
+    size = raw_dtype.itemsize
+    for payload in payloads:
+        if len(payload) < size:
+            raise ValueError("Payload of %u bytes is too short for %s" % (len(payload), msg_cls.__name__))
+    # newer firmware may append fields, those are ignored just like when decoding a single message
+    raw = numpy.frombuffer(b''.join(payload if len(payload) == size else payload[:size] for payload in payloads),
+                           dtype=raw_dtype)
+    if numpy.any(raw['msg_id'] != msg_cls.id):
+        raise ValueError("Not every payload is a %s message" % msg_cls.__name__)
+
+    values = numpy.empty((len(scaled), len(raw)), dtype=numpy.float64)
+    for row, name in enumerate(scaled):
+        values[row] = raw[name]
+    values /= scalars[:, numpy.newaxis]
+
+    if columns:
+        result = dict(zip(scaled, values))
+        for name in msg_cls._field_names:
+            if name not in result:
+                result[name] = raw[name].astype(decoded_dtype[name])
+        return {name: result[name] for name in msg_cls._field_names}
+    result = numpy.empty(len(raw), dtype=decoded_dtype)
+    for name, column in zip(scaled, values):
+        result[name] = column
+    for name in msg_cls._field_names:
+        if name not in msg_cls.scalars:
+            result[name] = raw[name]
+    return result
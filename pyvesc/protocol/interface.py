@@ -1,25 +1,79 @@
 import pyvesc.protocol.base
 import pyvesc.protocol.packet.codec
+import pyvesc.protocol.packet.crc
+import pyvesc.protocol.packet.structure
 
+# packets which never change, keyed by (message id, can id): requests and messages without fields (such as Alive)
+_request_packets = {}
+_constant_packets = {}
 
-def decode(buffer):
+
+def decode(buffer, zero_copy=False, frozen=False, lazy=False):
     """
     Decodes the next valid VESC message in a buffer.
 
     :param buffer: The buffer to attempt to parse from.
     :type buffer: bytes
 
+    :param zero_copy: Decode the message in place in the buffer instead of
+                      copying the payload out of it first.
+    :type zero_copy: bool
+
+    :param frozen: Return the immutable, tuple-like Frozen variant of the message.
+    :type frozen: bool
+
+    :param lazy: Decode each field of the message the first time it is read.
+    :type lazy: bool
+
     :return: PyVESC message, number of bytes consumed in the buffer. If nothing
              was parsed returns (None, 0).
     :rtype: `tuple`: (PyVESC message, int)
     """
+    if zero_copy:
+        index, length, consumed = pyvesc.protocol.packet.codec.locate(buffer)
+        if length:
+            return pyvesc.protocol.base.VESCMessage.unpack(buffer, frozen, lazy, index, length), consumed
+        return None, consumed
     msg_payload, consumed = pyvesc.protocol.packet.codec.unframe(buffer)
     if msg_payload:
-        return pyvesc.protocol.base.VESCMessage.unpack(msg_payload), consumed
+        return pyvesc.protocol.base.VESCMessage.unpack(msg_payload, frozen, lazy), consumed
     else:
         return None, consumed
 
 
+def decode_all(buffer, zero_copy=False, frozen=False, lazy=False):
+    """
+    Decodes every valid VESC message in a buffer, walking the buffer once.
+
+    :param buffer: The buffer to attempt to parse from.
+    :type buffer: bytes
+
+    :param zero_copy: Decode the messages in place in the buffer instead of
+                      copying each payload out of it first.
+    :type zero_copy: bool
+
+    :param frozen: Return the immutable, tuple-like Frozen variants of the messages.
+    :type frozen: bool
+
+    :param lazy: Decode each field of the messages the first time it is read.
+    :type lazy: bool
+
+    :return: List of PyVESC messages, number of bytes consumed in the buffer and
+             the unconsumed tail of the buffer (the start of an incomplete packet).
+    :rtype: `tuple`: (list, int, bytes)
+    """
+    if zero_copy:
+        messages = []
+        consumed = 0
+        for index, length, consumed in pyvesc.protocol.packet.codec.locate_all(buffer):
+            if length:
+                messages.append(pyvesc.protocol.base.VESCMessage.unpack(buffer, frozen, lazy, index, length))
+        return messages, consumed, buffer[consumed:]
+    payloads, consumed, tail = pyvesc.protocol.packet.codec.unframe_all(buffer)
+    messages = [pyvesc.protocol.base.VESCMessage.unpack(payload, frozen, lazy) for payload in payloads]
+    return messages, consumed, tail
+
+
 def encode(msg):
     """
     Encodes a PyVESC message to a packet. This packet is a valid VESC packet and
@@ -31,11 +85,112 @@ def encode(msg):
     :return: The packet.
     :rtype: bytes
     """
+    if msg._field_names == ():
+        key = (msg.id, msg.can_id)
+        packet = _constant_packets.get(key)
+        if packet is None:
+            packet = pyvesc.protocol.packet.codec.frame(pyvesc.protocol.base.VESCMessage.pack(msg))
+            _constant_packets[key] = packet
+        return packet
     msg_payload = pyvesc.protocol.base.VESCMessage.pack(msg)
     packet = pyvesc.protocol.packet.codec.frame(msg_payload)
     return packet
 
 
+def encode_many(msgs):
+    """
+    Encodes many PyVESC messages to back to back packets in one buffer, which
+    can be sent with a single write. To send one setter to many VESCs on a CAN
+    bus, encode_forward is faster.
+
+    :param msgs: Messages to be encoded. All fields must be initialized.
+    :type msgs: list of PyVESC messages
+
+    :return: The packets.
+    :rtype: bytes
+    """
+    return b''.join([encode(msg) for msg in msgs])
+
+
+def encode_forward(msg_cls, values):
+    """
+    Encodes one setter for many VESCs on a CAN bus to back to back forwarded
+    packets in one buffer, without creating a message object for each of them.
+    Every packet is packed straight into the buffer with one precompiled struct,
+    so they all have the same size. For example the current of every motor:
+    encode_forward(SetCurrent, {3: 5.0, 7: 2.5}).
+
+    :param msg_cls: The message type, which must have a fixed layout.
+    :type msg_cls: PyVESC message class
+
+    :param values: The field value of each can id, or a tuple of the field
+                   values for messages with more than one field.
+    :type values: dict
+
+    :return: The packets, in the order of values.
+    :rtype: bytearray
+    """
+    template = msg_cls._can_packet
+    if template is None:
+        raise TypeError("%s does not have a fixed layout" % msg_cls.__name__)
+    footer = pyvesc.protocol.packet.structure.Footer
+    crc16 = pyvesc.protocol.packet.crc.crc16
+    comm_fwd_can = pyvesc.protocol.base.VESCMessage._comm_fwd_can
+    payload_size = template.size - 2
+    buffer = bytearray((template.size + footer.STRUCT.size) * len(values))
+    view = memoryview(buffer)
+    single = len(msg_cls._field_names) == 1
+    offset = 0
+    for can_id, fields in values.items():
+        fields = [fields] if single else list(fields)
+        for index, scalar in msg_cls._scales:
+            fields[index] = int(fields[index] * scalar)
+        template.pack_into(buffer, offset, 0x2, payload_size, comm_fwd_can, can_id, msg_cls.id, *fields)
+        offset += template.size
+        footer.STRUCT.pack_into(buffer, offset, crc16(view[offset - payload_size:offset]), footer.TERMINATOR)
+        offset += footer.STRUCT.size
+    return buffer
+
+
+def encode_into(msg, buffer, offset=0):
+    """
+    Encodes a PyVESC message to a packet written directly into a preallocated
+    buffer. Several packets can be written back to back into one buffer and sent
+    with a single write.
+
+    :param msg: Message to be encoded. All fields must be initialized.
+    :type msg: PyVESC message
+
+    :param buffer: Writable buffer to write the packet into.
+    :type buffer: bytearray or memoryview
+
+    :param offset: Index in the buffer to write the packet at.
+    :type offset: int
+
+    :return: Number of bytes written.
+    :rtype: int
+    """
+    if msg._encoder is None:
+        # only construct can encode the message, to a payload of its own
+        msg_payload = pyvesc.protocol.base.VESCMessage.pack(msg)
+        return pyvesc.protocol.packet.codec.frame_into(msg_payload, buffer, offset)
+    # the payload is packed straight into the buffer between the header and the footer
+    packer = pyvesc.protocol.packet.codec.PackerBase
+    values = [getattr(msg, name) for name in msg._field_names]
+    for index, scalar in msg._scales:
+        values[index] = int(values[index] * scalar)
+    if msg.can_id is None:
+        encoder = msg._encoder
+        payload_index = packer._pack_header_into(encoder.size, buffer, offset)
+        encoder.pack_into(buffer, payload_index, msg.id, *values)
+    else:
+        encoder = msg._can_encoder
+        payload_index = packer._pack_header_into(encoder.size, buffer, offset)
+        encoder.pack_into(buffer, payload_index, pyvesc.protocol.base.VESCMessage._comm_fwd_can, msg.can_id, msg.id,
+                          *values)
+    return packer._pack_footer_into(buffer, payload_index, encoder.size) - offset
+
+
 def encode_request(msg_cls):
     """
     Encodes a PyVESC message for requesting a getter message. This function
@@ -48,6 +203,10 @@ def encode_request(msg_cls):
     :return: The encoded PyVESC message which can be sent.
     :rtype: bytes
     """
-    msg_payload = pyvesc.protocol.base.VESCMessage.pack(msg_cls, header_only=True)
-    packet = pyvesc.protocol.packet.codec.frame(msg_payload)
+    key = (msg_cls.id, msg_cls.can_id)
+    packet = _request_packets.get(key)
+    if packet is None:
+        msg_payload = pyvesc.protocol.base.VESCMessage.pack(msg_cls, header_only=True)
+        packet = pyvesc.protocol.packet.codec.frame(msg_payload)
+        _request_packets[key] = packet
     return packet
@@ -1,27 +1,30 @@
 from .exceptions import *
 from .structure import *
-from crccheck.crc import CrcXmodem
-
-crc_checker = CrcXmodem()
+from pyvesc.protocol.packet import crc as _crc
+import heapq
 
 
 class UnpackerBase(object):
     """
     Helper methods for both stateless and stated unpacking.
+
+    Every helper takes an optional offset which is the index in the buffer where the packet being unpacked starts.
+    This lets callers walk a buffer without slicing (copying) it.
     """
     @staticmethod
-    def _unpack_header(buffer):
+    def _unpack_header(buffer, offset=0):
         """
         Attempt to unpack a header from the buffer.
         :param buffer: buffer object.
+        :param offset: index of the start of the packet in the buffer.
         :return: Header object if successful, None otherwise.
         """
-        if len(buffer) == 0:
+        if len(buffer) <= offset:
             return None
-        fmt = Header.fmt(buffer[0])
-        if len(buffer) >= struct.calcsize(fmt):
+        fmt = Header.compiled_fmt(buffer[offset])
+        if len(buffer) - offset >= fmt.size:
             try:
-                header = Header.parse(buffer)
+                header = Header.parse(buffer, offset)
                 return header
             except struct.error:
                 raise CorruptPacket("Unable to parse header: %s" % buffer)
@@ -29,79 +32,50 @@ class UnpackerBase(object):
             return None
 
     @staticmethod
-    def _unpack_footer(buffer, header):
+    def _unpack_footer(buffer, header, offset=0):
         """
         Unpack the footer. Parse must be valid.
         :param buffer: buffer object.
         :param header: Header object for current packet.
+        :param offset: index of the start of the packet in the buffer.
         :return: Footer object.
         """
         try:
-            footer = Footer.parse(buffer, header)
+            footer = Footer.parse(buffer, header, offset)
             return footer
         except struct.error:
             raise CorruptPacket("Unable to parse footer: %s" % buffer)
 
-    @staticmethod
-    def _next_possible_packet_index(buffer):
-        """
-        Tries to find the next possible start byte of a packet in a buffer. Typically called after a corruption has been
-        detected.
-        :param buffer: buffer object.
-        :return: Index of next valid start byte. Returns -1 if no valid start bytes are found.
-        """
-        if len(buffer) < 2: # too short to find next
-            return -1
-        next_short_sb = buffer[1:].find(b'\x02')
-        next_long_sb= buffer[1:].find(b'\x03')
-        possible_index = []
-        if next_short_sb >= 0: # exclude index zero's as we know the current first packet is corrupt
-            possible_index.append(next_short_sb + 1) # +1 because we want found from second byte
-        if next_long_sb >= 0:
-            possible_index.append(next_long_sb + 1)
-        if possible_index == []:
-            return -1
-        else:
-            return min(possible_index)
-
-    @staticmethod
-    def _consume_after_corruption_detected(buffer):
-        """
-        Gives the number of bytes in the buffer to consume after a corrupt packet was detected.
-        :param buffer: buffer object
-        :return: Number of bytes to consume in the buffer.
-        """
-        next_index = UnpackerBase._next_possible_packet_index(buffer)
-        if next_index == -1: # no valid start byte was found
-            return len(buffer) # consume entire buffer
-        else:
-            return next_index # consume up to next index
-
     @staticmethod
     def _packet_size(header):
-        return struct.calcsize(Header.fmt(header.payload_index)) + header.payload_length + struct.calcsize(Footer.fmt())
+        return Header.compiled_fmt(header.payload_index).size + header.payload_length + Footer.STRUCT.size
 
     @staticmethod
-    def _packet_parsable(buffer, header):
+    def _packet_parsable(buffer, header, offset=0):
         """
         Checks if an entire packet is parsable.
         :param buffer: buffer object
         :param header: Header object
+        :param offset: index of the start of the packet in the buffer.
         :return: True if the current packet is parsable, False otherwise.
         """
         frame_size = UnpackerBase._packet_size(header)
-        return len(buffer) >= frame_size
+        return len(buffer) - offset >= frame_size
 
     @staticmethod
-    def _unpack_payload(buffer, header):
+    def _unpack_payload(buffer, header, offset=0, view=None):
         """
         Unpacks the payload of the packet.
         :param buffer: buffer object
         :param header: Header object
-        :return: byte string of the payload
+        :param offset: index of the start of the packet in the buffer.
+        :param view: memoryview of buffer. If given the payload is returned as a slice of it instead of a copy.
+        :return: byte string (or memoryview) of the payload
         """
-        footer_index = header.payload_index + header.payload_length
-        return bytes(buffer[header.payload_index:footer_index])
+        payload_index = offset + header.payload_index
+        if view is not None:
+            return view[payload_index:payload_index + header.payload_length]
+        return bytes(buffer[payload_index:payload_index + header.payload_length])
 
     @staticmethod
     def _validate_payload(payload, footer):
@@ -112,82 +86,114 @@ class UnpackerBase(object):
         :param footer: Footer object
         :return: void
         """
-        crc_checker.calc(payload)
-        if crc_checker.calc(payload) != footer.crc:
+        if _crc.crc16(payload) != footer.crc:
             raise CorruptPacket("Invalid checksum value.")
-        if footer.terminator is not Footer.TERMINATOR:
+        if footer.terminator != Footer.TERMINATOR:
             raise CorruptPacket("Invalid terminator: %u" % footer.terminator)
         return
 
     @staticmethod
-    def _unpack(buffer, header, errors, recovery_mode=False):
+    def _unpack_packet(buffer, header, offset=0, view=None):
+        """
+        Attempt to parse the packet starting at offset. CorruptPacket is raised if it is not a valid packet.
+        :param buffer: buffer object
+        :param header: Header object for the packet or None to parse it from the buffer.
+        :param offset: index of the start of the packet in the buffer.
+        :param view: memoryview of buffer, see _unpack_payload.
+        :return: (1) Payload if the whole packet is in the buffer, None otherwise, (2) Size of the packet
+        """
+        if header is None:
+            header = UnpackerBase._unpack_header(buffer, offset)
+        if header is None or UnpackerBase._packet_parsable(buffer, header, offset) is False:
+            # buffer is too short to parse the packet
+            return None, 0
+        footer = UnpackerBase._unpack_footer(buffer, header, offset)
+        # the terminator is checked before the payload so candidates found while resynchronizing are usually
+        # rejected without calculating a checksum
+        if footer.terminator != Footer.TERMINATOR:
+            raise CorruptPacket("Invalid terminator: %u" % footer.terminator)
+        payload = UnpackerBase._unpack_payload(buffer, header, offset, view)
+        UnpackerBase._validate_payload(payload, footer)
+        return payload, UnpackerBase._packet_size(header)
+
+    @staticmethod
+    def _unpack(buffer, header, errors, offset=0, view=None):
         """
         Attempt to parse a packet from the buffer.
+
+        If the packet at offset is corrupt (and errors is 'ignore') the buffer is scanned forward for the next start
+        byte which begins a valid packet. The scan is iterative, never copies the buffer and visits every byte at most
+        once, so resynchronizing is linear in the length of the buffer.
         :param buffer: buffer object
+        :param header: Header object for the packet at offset, or None to parse it from the buffer.
         :param errors: specifies error handling scheme. see codec error handling schemes
-        :return: (1) Packet if parse was successful, None otherwise, (2) Length consumed of buffer
+        :param offset: index in the buffer to start parsing from.
+        :param view: memoryview of buffer, see _unpack_payload.
+        :return: (1) Packet if parse was successful, None otherwise, (2) Length consumed of buffer after offset,
+                 (3) Number of consumed bytes which were skipped as corrupt
         """
-        while True:
-            try:
-                # if we were not given a header then try to parse one
-                if header is None:
-                    header = UnpackerBase._unpack_header(buffer)
-                if header is None:
-                    # buffer is too short to parse a header
-                    if recovery_mode:
-                        return Stateless._recovery_recurse(buffer, header, errors, False)
-                    else:
-                        return None, 0
-                # check if a packet is parsable
-                if UnpackerBase._packet_parsable(buffer, header) is False:
-                    # buffer is too short to parse the rest of the packet
-                    if recovery_mode:
-                        return Stateless._recovery_recurse(buffer, header, errors, False)
-                    else:
-                        return None, 0
-                # parse the packet
-                payload = UnpackerBase._unpack_payload(buffer, header)
-                footer = UnpackerBase._unpack_footer(buffer, header)
-                # validate the payload
-                UnpackerBase._validate_payload(payload, footer)
-                # clean header as we wont need it again
-                consumed = UnpackerBase._packet_size(header)
-                header = None
-                return payload, consumed
-            except CorruptPacket as corrupt_packet:
-                if errors is 'ignore':
-                    # find the next possible start byte in the buffer
-                    return Stateless._recovery_recurse(buffer, header, errors, True)
-                elif errors is 'strict':
-                    raise corrupt_packet
-
-    @staticmethod
-    def _recovery_recurse(buffer, header, errors, consume_on_not_recovered):
-        header = None  # clean header
-        next_sb = UnpackerBase._next_possible_packet_index(buffer)
-        if next_sb == -1:  # no valid start byte in buffer. consume entire buffer
-            if consume_on_not_recovered:
-                return None, len(buffer)
-            else:
-                return None, 0
-        else:
-            payload, consumed = UnpackerBase._unpack(buffer[next_sb:], header, errors, True)
-            if payload is None:
-                # failed to recover
-                if consume_on_not_recovered:
-                    return payload, consumed + next_sb
-                else:
-                    return payload, consumed
+        try:
+            payload, size = UnpackerBase._unpack_packet(buffer, header, offset, view)
+            return payload, size, 0
+        except CorruptPacket:
+            if errors == 'strict':
+                raise
+        # resynchronize. candidates are the start bytes after offset, found with two cursors that only move forward
+        first_incomplete = -1
+        next_short_sb = buffer.find(b'\x02', offset + 1)
+        next_long_sb = buffer.find(b'\x03', offset + 1)
+        while next_short_sb >= 0 or next_long_sb >= 0:
+            if next_long_sb < 0 or 0 <= next_short_sb < next_long_sb:
+                candidate = next_short_sb
+                next_short_sb = buffer.find(b'\x02', candidate + 1)
             else:
+                candidate = next_long_sb
+                next_long_sb = buffer.find(b'\x03', candidate + 1)
+            try:
+                payload, size = UnpackerBase._unpack_packet(buffer, None, candidate, view)
+            except CorruptPacket:
+                continue
+            if payload is not None:
                 # recovery was successful
-                return payload, consumed + next_sb
-
+                return payload, candidate + size - offset, candidate - offset
+            if first_incomplete < 0:
+                # this might be a packet which has not been fully received, keep looking for a complete one after it
+                first_incomplete = candidate
+        # failed to recover. consume up to the first packet which may still complete, or the entire buffer
+        if first_incomplete >= 0:
+            skipped = first_incomplete - offset
+        else:
+            skipped = len(buffer) - offset
+        return None, skipped, skipped
 
 
 class PackerBase(object):
     """
     Packing is the same for stated and stateless. Therefore its implemented in this base class.
     """
+    # precompiled struct of a whole packet (header, payload and footer) for each short payload length
+    _templates = {}
+
+    @staticmethod
+    def _template(payload_length):
+        """
+        Gives the precompiled struct of a whole packet for a payload length. Only the payload and crc need to be filled
+        in to pack it.
+        :param payload_length: length of the payload
+        :return: (start byte, struct.Struct)
+        """
+        template = PackerBase._templates.get(payload_length)
+        if template is None:
+            if payload_length == 0:
+                raise InvalidPayload("Empty payload")
+            header = Header.generate(b'\x00' * payload_length)
+            fmt = Header.fmt(header.payload_index) + '%us' % payload_length + Footer.fmt()[1:]
+            template = (header.payload_index, struct.Struct(fmt))
+            if payload_length < 256:
+                # the cache is bounded to the short payloads, which is what control messages use
+                PackerBase._templates[payload_length] = template
+        return template
+
     @staticmethod
     def _pack(payload):
         """
@@ -195,15 +201,61 @@ class PackerBase(object):
         :param payload: byte string of payload
         :return: byte string of packed packet
         """
-        if payload == b'':
+        if not isinstance(payload, (bytes, bytearray)):
+            payload = bytes(payload)
+        start_byte, template = PackerBase._template(len(payload))
+        return template.pack(start_byte, len(payload), payload, _crc.crc16(payload), Footer.TERMINATOR)
+
+    @staticmethod
+    def _pack_into(payload, buffer, offset=0):
+        """
+        Packs a payload directly into a writable buffer, without creating intermediate objects.
+        :param payload: bytes-like object of payload
+        :param buffer: writable buffer object (bytearray or memoryview) to write the packet into
+        :param offset: index in the buffer to write the packet at
+        :return: number of bytes written
+        """
+        payload_length = len(payload)
+        payload_index = PackerBase._pack_header_into(payload_length, buffer, offset)
+        buffer[payload_index:payload_index + payload_length] = payload
+        return PackerBase._pack_footer_into(buffer, payload_index, payload_length) - offset
+
+    @staticmethod
+    def _pack_header_into(payload_length, buffer, offset=0):
+        """
+        Writes the header of a packet into a writable buffer, once it is known that the whole packet fits.
+        :param payload_length: length of the payload
+        :param buffer: writable buffer object (bytearray or memoryview) to write the packet into
+        :param offset: index in the buffer to write the packet at
+        :return: index in the buffer to write the payload at
+        """
+        if payload_length == 0:
             raise InvalidPayload("Empty payload")
-        # get header/footer tuples
-        header = Header.generate(payload)
-        footer = Footer.generate(payload)
-        # serialize tuples
-        header = struct.pack(Header.fmt(header.payload_index), *header)
-        footer = struct.pack(Footer.fmt(), *footer)
-        return header + payload + footer
+        if payload_length < 256:
+            start_byte, header = 0x2, Header.SHORT
+        elif payload_length < 65536:
+            start_byte, header = 0x3, Header.LONG
+        else:
+            raise InvalidPayload("Invalid payload size. Payload must be less than 65536 bytes.")
+        end = offset + header.size + payload_length + Footer.STRUCT.size
+        if offset < 0 or end > len(buffer):
+            raise BufferOverflow("Packet of %u bytes does not fit in the buffer at offset %u" % (end - offset, offset))
+        header.pack_into(buffer, offset, start_byte, payload_length)
+        return offset + header.size
+
+    @staticmethod
+    def _pack_footer_into(buffer, payload_index, payload_length):
+        """
+        Writes the footer of a packet whose payload is in the buffer, with the crc calculated over the buffer.
+        :param buffer: writable buffer object (bytearray or memoryview)
+        :param payload_index: index of the payload in the buffer
+        :param payload_length: length of the payload
+        :return: index in the buffer after the packet
+        """
+        footer_index = payload_index + payload_length
+        crc = _crc.crc16(memoryview(buffer)[payload_index:footer_index])
+        Footer.STRUCT.pack_into(buffer, footer_index, crc, Footer.TERMINATOR)
+        return footer_index + Footer.STRUCT.size
 
 
 class Stateless(UnpackerBase, PackerBase):
@@ -211,14 +263,84 @@ class Stateless(UnpackerBase, PackerBase):
     Statelessly pack and unpack VESC packets.
     """
     @staticmethod
-    def unpack(buffer, errors='ignore'):
+    def unpack(buffer, errors='ignore', zero_copy=False):
         """
         Attempt to parse a packet from the buffer.
         :param buffer: buffer object
         :param errors: specifies error handling scheme. see codec error handling schemes
+        :param zero_copy: return the payload as a memoryview into buffer instead of a copy. A bytearray can not be
+                          resized while such a view is alive. A memoryview object is larger than a short payload, so
+                          this only saves memory for large payloads. See locate() to read payloads in place.
         :return: (1) Packet if parse was successful, None otherwise, (2) Length consumed of buffer
         """
-        return Stateless._unpack(buffer, None, errors)
+        view = memoryview(buffer) if zero_copy else None
+        payload, consumed, skipped = Stateless._unpack(buffer, None, errors, view=view)
+        return payload, consumed
+
+    @staticmethod
+    def unpack_all(buffer, errors='ignore', zero_copy=False):
+        """
+        Parse every packet in the buffer in a single pass.
+        :param buffer: buffer object
+        :param errors: specifies error handling scheme. see codec error handling schemes
+        :param zero_copy: return the payloads as memoryviews into buffer instead of copies.
+        :return: (1) List of payloads, (2) Length consumed of buffer, (3) Unconsumed tail of the buffer
+        """
+        view = memoryview(buffer) if zero_copy else None
+        payloads = []
+        offset = 0
+        while True:
+            payload, consumed, skipped = Stateless._unpack(buffer, None, errors, offset=offset, view=view)
+            if consumed == 0:
+                break
+            offset += consumed
+            if payload is not None:
+                payloads.append(payload)
+        return payloads, offset, buffer[offset:]
+
+    @staticmethod
+    def locate(buffer, errors='ignore', offset=0):
+        """
+        Attempt to find a packet in the buffer without taking its payload out of it. Nothing outlives the call, so the
+        payload can be read in place (for example by VESCMessage.unpack with its offset and length) without
+        allocating a copy or a view of it.
+        :param buffer: buffer object
+        :param errors: specifies error handling scheme. see codec error handling schemes
+        :param offset: index in the buffer to start parsing from.
+        :return: (1) Index of the payload in the buffer if a packet was parsed, None otherwise, (2) Length of the
+                 payload, (3) Length consumed of buffer after offset
+        """
+        with memoryview(buffer) as view:
+            payload, consumed, skipped = Stateless._unpack(buffer, None, errors, offset, view)
+            if payload is None:
+                return None, 0, consumed
+            length = len(payload)
+            payload.release()
+        return offset + consumed - Footer.STRUCT.size - length, length, consumed
+
+    @staticmethod
+    def locate_all(buffer, errors='ignore'):
+        """
+        Find every packet in the buffer in a single pass, like unpack_all, without taking the payloads out of it. See
+        locate. The buffer can not be resized until the generator is exhausted.
+        :param buffer: buffer object
+        :param errors: specifies error handling scheme. see codec error handling schemes
+        :return: generator of (1) Index of the payload in the buffer, None for bytes skipped as corrupt, (2) Length of
+                 the payload, (3) Length consumed of buffer so far
+        """
+        with memoryview(buffer) as view:
+            offset = 0
+            while True:
+                payload, consumed, skipped = Stateless._unpack(buffer, None, errors, offset, view)
+                if consumed == 0:
+                    return
+                offset += consumed
+                if payload is None:
+                    yield None, 0, offset
+                else:
+                    length = len(payload)
+                    payload.release()
+                    yield offset - Footer.STRUCT.size - length, length, offset
 
     @staticmethod
     def pack(payload):
@@ -227,8 +349,198 @@ class Stateless(UnpackerBase, PackerBase):
         """
         return Stateless._pack(payload)
 
+    @staticmethod
+    def pack_into(payload, buffer, offset=0):
+        """
+        See PackerBase._pack_into
+        """
+        return Stateless._pack_into(payload, buffer, offset)
+
+class Stateful(UnpackerBase, PackerBase):
+    """
+    Incrementally unpack VESC packets from a stream of byte chunks.
+
+    Chunks are appended to an internal buffer with feed() and complete payloads are taken out with unpack() or by
+    iterating over the object. The header of a partially received packet is kept between calls so it is only parsed
+    once, and consumed bytes are skipped with a read offset rather than by slicing the buffer.
+
+    The number of bytes dropped because of the high water mark and skipped while resynchronizing after corrupt data
+    are counted in dropped and skipped.
+    """
+    # largest possible packet: long header, 65535 byte payload and footer
+    MAX_PACKET_SIZE = 3 + 65535 + 3
+
+    def __init__(self, errors='ignore', high_water_mark=4 * MAX_PACKET_SIZE, stale_after=256):
+        """
+        :param errors: specifies error handling scheme. see codec error handling schemes
+        :param high_water_mark: maximum number of unread bytes kept in the buffer. When exceeded the oldest bytes are
+                                dropped ('ignore') or BufferOverflow is raised ('strict').
+        :param stale_after: number of unread bytes after which a packet that is still not fully received is taken for
+                            line noise with a bogus length, and complete packets behind its start byte are unpacked
+                            instead. Not used with 'strict'.
+        """
+        if high_water_mark < Stateful.MAX_PACKET_SIZE:
+            raise ValueError("high_water_mark must be at least %u bytes" % Stateful.MAX_PACKET_SIZE)
+        self.errors = errors
+        self.high_water_mark = high_water_mark
+        self.stale_after = stale_after
+        self.dropped = 0
+        self.skipped = 0
+        self._buffer = bytearray()
+        self._offset = 0
+        self._header = None
+        # heap of (number of unread bytes needed to check it again, start byte) of the start bytes behind the held
+        # header which began packets not fully received when last checked, and the number of bytes after the held start
+        # byte which were searched for start bytes, all relative to the read offset. see _unpack_behind
+        self._candidates = []
+        self._scanned = 1
+
+    def __len__(self):
+        """
+        :return: Number of received bytes which have not been consumed yet.
+        """
+        return len(self._buffer) - self._offset
+
+    def __iter__(self):
+        """
+        Yields every complete payload currently in the buffer.
+        """
+        payload = self.unpack()
+        while payload is not None:
+            yield payload
+            payload = self.unpack()
+
+    def feed(self, data):
+        """
+        Appends received bytes to the buffer.
+        :param data: bytes-like object
+        """
+        overflow = len(self) + len(data) - self.high_water_mark
+        if overflow > 0:
+            if self.errors == 'strict':
+                raise BufferOverflow("Buffer would exceed %u unread bytes" % self.high_water_mark)
+            # drop the oldest bytes, the packet they belonged to can not be recovered
+            from_buffer = min(overflow, len(self))
+            self._consume(from_buffer)
+            data = data[overflow - from_buffer:]
+            self.dropped += overflow
+            self._header = None
+        self._compact()
+        self._buffer += data
+
+    def reset(self):
+        """
+        Discards all buffered bytes and any partially parsed packet.
+        """
+        self._buffer = bytearray()
+        self._offset = 0
+        self._header = None
+
+    def unpack(self):
+        """
+        Attempt to parse the next packet from the buffer.
+        :return: Payload if a packet was parsed, None if more bytes are needed.
+        """
+        while True:
+            if self._header is None:
+                self._candidates = []
+                self._scanned = 1
+                try:
+                    self._header = Stateful._unpack_header(self._buffer, self._offset)
+                except CorruptPacket:
+                    # let _unpack handle the corruption according to the error scheme
+                    pass
+            if self._header is not None and not Stateful._packet_parsable(self._buffer, self._header, self._offset):
+                if self.errors == 'strict' or len(self) < self.stale_after:
+                    # keep the header until the rest of the packet arrives
+                    return None
+                # the start byte may be line noise with a bogus length, which would hold back every packet behind it
+                # until enough bytes arrive to reject it. a packet which is still being received is only given up on
+                # once it is stale, so the packets framed in its payload are not taken for packets
+                payload, skipped, size = self._unpack_behind()
+                if payload is None:
+                    # keep the header until the rest of the packet arrives
+                    return None
+                self.skipped += skipped
+                self._header = None
+                self._consume(skipped + size)
+                return payload
+            payload, consumed, skipped = Stateful._unpack(self._buffer, self._header, self.errors, offset=self._offset)
+            self.skipped += skipped
+            self._header = None
+            self._consume(consumed)
+            if payload is not None or consumed == 0:
+                return payload
+
+    def _unpack_behind(self):
+        """
+        Looks for a complete, valid packet behind the held header, whose packet has not been fully received. Each start
+        byte is found once and only checked again when the bytes its header or packet needs have arrived, so receiving
+        a packet in many chunks stays linear in its size.
+        :return: (1) Payload of the first complete packet, None if there is none, (2) Number of bytes before it, (3) Size
+                 of the packet
+        """
+        buffer, offset = self._buffer, self._offset
+        received = len(buffer) - offset
+        candidates = self._candidates
+        # the start bytes in the bytes which arrived since, which need their header first
+        for start_byte in (b'\x02', b'\x03'):
+            index = buffer.find(start_byte, offset + self._scanned)
+            while index >= 0:
+                candidate = index - offset
+                heapq.heappush(candidates, (candidate + Header.compiled_fmt(buffer[index]).size, candidate))
+                index = buffer.find(start_byte, index + 1)
+        self._scanned = received
+        found = None
+        while candidates and candidates[0][0] <= received:
+            needed, candidate = heapq.heappop(candidates)
+            try:
+                header = Stateful._unpack_header(buffer, offset + candidate)
+                payload, size = Stateful._unpack_packet(buffer, header, offset + candidate)
+            except CorruptPacket:
+                continue
+            if payload is None:
+                # check again once the whole packet has arrived
+                heapq.heappush(candidates, (candidate + Stateful._packet_size(header), candidate))
+            elif found is None or candidate < found[1]:
+                found = (payload, candidate, size)
+        return found if found is not None else (None, 0, 0)
+
+    @staticmethod
+    def pack(payload):
+        """
+        See PackerBase.pack
+        """
+        return Stateful._pack(payload)
+
+    def _consume(self, length):
+        self._offset += length
+        if self._offset == len(self._buffer):
+            # everything was read, restart at the beginning of the buffer
+            self._buffer.clear()
+            self._offset = 0
+
+    def _compact(self):
+        # only move unread bytes once the consumed prefix makes up most of the buffer
+        if self._offset > len(self._buffer) // 2:
+            del self._buffer[:self._offset]
+            self._offset = 0
+
+
 def frame(bytestring):
     return Stateless.pack(bytestring)
 
-def unframe(buffer, errors='ignore'):
-    return Stateless.unpack(buffer, errors)
+def frame_into(bytestring, buffer, offset=0):
+    return Stateless.pack_into(bytestring, buffer, offset)
+
+def unframe(buffer, errors='ignore', zero_copy=False):
+    return Stateless.unpack(buffer, errors, zero_copy)
+
+def unframe_all(buffer, errors='ignore', zero_copy=False):
+    return Stateless.unpack_all(buffer, errors, zero_copy)
+
+def locate(buffer, errors='ignore', offset=0):
+    return Stateless.locate(buffer, errors, offset)
+
+def locate_all(buffer, errors='ignore'):
+    return Stateless.locate_all(buffer, errors)
@@ -0,0 +1,118 @@
+import binascii
+
+# CRC16-XMODEM (CCITT polynomial 0x1021, initial value 0x0000, no reflection, no final xor). This is the checksum
+# VESC places in the footer of every packet.
+POLYNOMIAL = 0x1021
+
+
+def _make_table():
+    """
+    Builds the 256 entry lookup table for byte-at-a-time CRC calculation.
+    :return: tuple of 256 crc values.
+    """
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ POLYNOMIAL) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+        table.append(crc)
+    return tuple(table)
+
+
+def _make_slice8_tables(table):
+    """
+    Builds the 8 lookup tables used for slice-by-8 calculation. tables[k][b] is the crc of byte b followed by k zero
+    bytes.
+    :param table: the byte-at-a-time table.
+    :return: tuple of 8 tables.
+    """
+    tables = [table]
+    for k in range(1, 8):
+        prev = tables[k - 1]
+        tables.append(tuple(((crc << 8) & 0xFFFF) ^ table[crc >> 8] for crc in prev))
+    return tuple(tables)
+
+
+CRC16_TABLE = _make_table()
+CRC16_SLICE8_TABLES = _make_slice8_tables(CRC16_TABLE)
+
+
+def _as_bytes_view(data):
+    """
+    Gives an object which iterates over data as unsigned bytes, without copying.
+    :param data: bytes, bytearray or memoryview.
+    :return: bytes-like object whose items are ints in [0, 255].
+    """
+    if isinstance(data, memoryview) and data.format != 'B':
+        return data.cast('B')
+    return data
+
+
+def crc16_table(data, crc=0):
+    """
+    Calculates the CRC16-XMODEM of data one byte at a time using a precomputed table.
+    :param data: bytes, bytearray or memoryview.
+    :param crc: initial crc value, pass a previous result to continue a calculation.
+    :return: crc value.
+    """
+    table = CRC16_TABLE
+    for byte in _as_bytes_view(data):
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+def crc16_slice8(data, crc=0):
+    """
+    Calculates the CRC16-XMODEM of data eight bytes at a time using the slice-by-8 tables. Tail bytes which do not fill
+    a full slice are handled by crc16_table.
+    :param data: bytes, bytearray or memoryview.
+    :param crc: initial crc value, pass a previous result to continue a calculation.
+    :return: crc value.
+    """
+    data = _as_bytes_view(data)
+    t0, t1, t2, t3, t4, t5, t6, t7 = CRC16_SLICE8_TABLES
+    end = len(data) - len(data) % 8
+    for i in range(0, end, 8):
+        crc ^= (data[i] << 8) | data[i + 1]
+        crc = (t7[crc >> 8] ^ t6[crc & 0xFF] ^ t5[data[i + 2]] ^ t4[data[i + 3]] ^
+               t3[data[i + 4]] ^ t2[data[i + 5]] ^ t1[data[i + 6]] ^ t0[data[i + 7]])
+    if end < len(data):
+        crc = crc16_table(data[end:], crc)
+    return crc
+
+
+def crc16_hqx(data, crc=0):
+    """
+    Calculates the CRC16-XMODEM of data using binascii.crc_hqx, which implements the same algorithm in C.
+    :param data: bytes, bytearray or memoryview.
+    :param crc: initial crc value, pass a previous result to continue a calculation.
+    :return: crc value.
+    """
+    return binascii.crc_hqx(data, crc)
+
+
+ENGINES = {
+    'hqx': crc16_hqx,
+    'table': crc16_table,
+    'slice8': crc16_slice8,
+}
+
+# the engine used by the packet codec. binascii is part of the standard library so the C implementation is the default.
+crc16 = crc16_hqx
+
+
+def select_engine(name):
+    """
+    Selects the CRC engine used by the packet codec.
+    :param name: one of the keys of ENGINES ('hqx', 'table' or 'slice8').
+    :return: the selected crc function.
+    """
+    global crc16
+    try:
+        crc16 = ENGINES[name]
+    except KeyError:
+        raise ValueError("Unknown CRC engine: %s" % name)
+    return crc16
@@ -3,4 +3,7 @@ class CorruptPacket(ValueError):
 
 
 class InvalidPayload(ValueError):
-    pass
\ No newline at end of file
+    pass
+
+class BufferOverflow(ValueError):
+    pass
@@ -1,15 +1,17 @@
 import collections
 import struct
 from pyvesc.protocol.packet.exceptions import *
-from crccheck.crc import CrcXmodem
-
-crc_checker = CrcXmodem()
+from pyvesc.protocol.packet import crc as _crc
 
 
 class Header(collections.namedtuple('Header', ['payload_index', 'payload_length'])):
     """
     Tuple to help with packing and unpacking the header of a VESC packet.
     """
+    # precompiled formats of the short (start byte 0x2) and long (start byte 0x3) headers
+    SHORT = struct.Struct('>BB')
+    LONG = struct.Struct('>BH')
+
     @staticmethod
     def generate(payload):
         """
@@ -27,13 +29,28 @@ class Header(collections.namedtuple('Header', ['payload_index', 'payload_length'
         return Header(payload_index, payload_length)
 
     @staticmethod
-    def parse(buffer):
+    def parse(buffer, offset=0):
         """
         Creates a Header by parsing the given buffer.
         :param buffer: buffer object.
+        :param offset: index of the start byte in the buffer.
         :return: Header object.
         """
-        return Header._make(struct.unpack_from(Header.fmt(buffer[0]), buffer, 0))
+        return Header._make(Header.compiled_fmt(buffer[offset]).unpack_from(buffer, offset))
+
+    @staticmethod
+    def compiled_fmt(start_byte):
+        """
+        Precompiled format of the header packet.
+        :param start_byte: The first byte in the buffer.
+        :return: struct.Struct of the packet header.
+        """
+        if start_byte == 0x2:
+            return Header.SHORT
+        elif start_byte == 0x3:
+            return Header.LONG
+        else:
+            raise CorruptPacket("Invalid start byte: %u" % start_byte)
 
     @staticmethod
     def fmt(start_byte):
@@ -42,12 +59,7 @@ class Header(collections.namedtuple('Header', ['payload_index', 'payload_length'
         :param start_byte: The first byte in the buffer.
         :return: The character format of the packet header.
         """
-        if start_byte is 0x2:
-            return '>BB'
-        elif start_byte is 0x3:
-            return '>BH'
-        else:
-            raise CorruptPacket("Invalid start byte: %u" % start_byte)
+        return Header.compiled_fmt(start_byte).format
 
 
 class Footer(collections.namedtuple('Footer', ['crc', 'terminator'])):
@@ -55,14 +67,15 @@ class Footer(collections.namedtuple('Footer', ['crc', 'terminator'])):
     Footer of a VESC packet.
     """
     TERMINATOR = 0x3 # Terminator character
+    STRUCT = struct.Struct('>HB') # precompiled format of the footer
 
     @staticmethod
-    def parse(buffer, header):
-        return Footer._make(struct.unpack_from(Footer.fmt(), buffer, header.payload_index + header.payload_length))
+    def parse(buffer, header, offset=0):
+        return Footer._make(Footer.STRUCT.unpack_from(buffer, offset + header.payload_index + header.payload_length))
 
     @staticmethod
     def generate(payload):
-        crc = crc_checker.calc(payload)
+        crc = _crc.crc16(payload)
         terminator = Footer.TERMINATOR
         return Footer(crc, terminator)
 
@@ -72,4 +85,4 @@ class Footer(collections.namedtuple('Footer', ['crc', 'terminator'])):
         Format of the footer.
         :return: Character format of the footer.
         """
-        return '>HB'
+        return Footer.STRUCT.format
@@ -13,5 +13,6 @@ setup(
   download_url='https://github.com/LiamBindle/PyVESC/tarball/' + VERSION,
   keywords=['vesc', 'VESC', 'communication', 'protocol', 'packet'],
   classifiers=[],
-  install_requires=['crccheck','construct']
+  install_requires=['construct'],
+  extras_require={'numpy': ['numpy']}
 )
@@ -150,7 +150,7 @@ class TestPacket(TestCase):
             self.assertEqual(parsed, None)
             self.assertTrue(consumed > 0)   # if a packet is corrupt then at least something should be consumed
             # get correct out_cuffer (in all of these cases it is just consuming to the next valid start byte (no more no less)
-            self.assertEqual(consumed, vesc_packet.Stateless._next_possible_packet_index(in_buffer))
+            self.assertEqual(consumed, next(i for i in range(1, len(in_buffer)) if in_buffer[i] in (0x2, 0x3)))
         # check that the good packet is parsed
         in_buffer = bytearray(good_packet)
         parsed, consumed = vesc_packet.unframe(in_buffer)
@@ -201,6 +201,214 @@ class TestPacket(TestCase):
         out_buffer = in_buffer[consumed:]
         self.assertEqual(parsed, test_payload)
         self.assertEqual(out_buffer, b'')
+    def test_unframe_all(self):
+        import random
+        import pyvesc.protocol.packet.codec as vesc_packet
+        payloads = [bytes(random.getrandbits(8) for i in range(length)) for length in (1, 4, 254, 257, 1023) * 20]
+        garbage = b'\x05\x02\x09'
+        buffer = b''.join(garbage + vesc_packet.frame(payload) for payload in payloads)
+        partial = vesc_packet.frame(b'Te!')[:4]
+        parsed, consumed, tail = vesc_packet.unframe_all(buffer + partial)
+        self.assertEqual(parsed, payloads)
+        self.assertEqual(consumed, len(buffer))
+        self.assertEqual(tail, partial)
+        # corrupt data raises with the strict scheme
+        with self.assertRaises(vesc_packet.CorruptPacket):
+            vesc_packet.unframe_all(buffer, errors='strict')
+        parsed, consumed, tail = vesc_packet.unframe_all(b'')
+        self.assertEqual((parsed, consumed, tail), ([], 0, b''))
+
+
+    def test_resync_long_garbage(self):
+        import sys
+        import pyvesc.protocol.packet.codec as vesc_packet
+        good_packet = b'\x02\x03Te!B\x92\x03'
+        # far more candidate start bytes than the recursion limit
+        garbage = b'\x02\xff\x03\x00' * sys.getrecursionlimit() * 10
+        parsed, consumed = vesc_packet.unframe(garbage + good_packet)
+        self.assertEqual(parsed, b'Te!')
+        self.assertEqual(consumed, len(garbage) + len(good_packet))
+        parsed, consumed, tail = vesc_packet.unframe_all(garbage + good_packet + garbage + good_packet)
+        self.assertEqual(parsed, [b'Te!', b'Te!'])
+        unframer = vesc_packet.Stateful()
+        unframer.feed(garbage + good_packet)
+        self.assertEqual(list(unframer), [b'Te!'])
+        self.assertEqual(unframer.skipped, len(garbage))
+
+    def test_frame_into(self):
+        import random
+        import pyvesc.protocol.packet.codec as vesc_packet
+        payloads = [bytes(random.getrandbits(8) for i in range(length)) for length in (1, 4, 254, 257, 1023)]
+        expected = b''.join(vesc_packet.frame(payload) for payload in payloads)
+        buffer = bytearray(len(expected) + 5)
+        offset = 5
+        for payload in payloads:
+            offset += vesc_packet.frame_into(payload, buffer, offset)
+        self.assertEqual(offset, len(buffer))
+        self.assertEqual(buffer[5:], expected)
+        # memoryviews can be written to as well
+        view = memoryview(bytearray(len(expected)))
+        offset = 0
+        for payload in payloads:
+            offset += vesc_packet.frame_into(memoryview(payload), view, offset)
+        self.assertEqual(view, expected)
+        with self.assertRaises(vesc_packet.BufferOverflow):
+            vesc_packet.frame_into(b'Te!', bytearray(7))
+        with self.assertRaises(vesc_packet.InvalidPayload):
+            vesc_packet.frame_into(b'', bytearray(7))
+
+    def test_zero_copy(self):
+        import pyvesc.protocol.packet.codec as vesc_packet
+        good_packet = b'\x02\x03Te!B\x92\x03'
+        buffer = bytearray(b'\x05' + good_packet + good_packet)
+        parsed, consumed = vesc_packet.unframe(buffer, zero_copy=True)
+        self.assertIsInstance(parsed, memoryview)
+        self.assertEqual(parsed, b'Te!')
+        self.assertEqual(consumed, len(good_packet) + 1)
+        # the payload is a view into the caller's buffer
+        buffer[3] = ord('Z')
+        self.assertEqual(parsed, b'Ze!')
+        parsed.release()
+        buffer[3] = ord('T')
+        parsed, consumed, tail = vesc_packet.unframe_all(buffer, zero_copy=True)
+        self.assertTrue(all(payload.obj is buffer for payload in parsed))
+        self.assertEqual(parsed, [b'Te!', b'Te!'])
+        # locate gives where the payload is, without taking it out of the buffer
+        index, length, consumed = vesc_packet.locate(buffer)
+        self.assertEqual(buffer[index:index + length], b'Te!')
+        self.assertEqual(consumed, len(good_packet) + 1)
+        index, length, consumed = vesc_packet.locate(buffer, offset=consumed)
+        self.assertEqual((index, length, consumed), (len(good_packet) + 3, 3, len(good_packet)))
+        self.assertEqual(vesc_packet.locate(b'\x05' + good_packet[:-1]), (None, 0, 1))
+        located = list(vesc_packet.locate_all(buffer))
+        self.assertEqual(located, [(3, 3, len(good_packet) + 1), (len(good_packet) + 3, 3, len(buffer))])
+        # locate leaves no views into the buffer alive
+        del parsed
+        buffer.clear()
+
+
+class TestStateful(TestCase):
+    def test_chunked_feed(self):
+        import random
+        import pyvesc.protocol.packet.codec as vesc_packet
+        payloads = [bytes(random.getrandbits(8) for i in range(length)) for length in (1, 4, 254, 257, 1023)]
+        stream = b''.join(vesc_packet.frame(payload) for payload in payloads)
+        for chunk_size in (1, 2, 7, 256, len(stream)):
+            unframer = vesc_packet.Stateful()
+            parsed = []
+            for i in range(0, len(stream), chunk_size):
+                unframer.feed(stream[i:i + chunk_size])
+                parsed.extend(unframer)
+            self.assertEqual(parsed, payloads)
+            self.assertEqual(len(unframer), 0)
+
+    def test_header_kept_across_reads(self):
+        import pyvesc.protocol.packet.codec as vesc_packet
+        packet = vesc_packet.frame(b'Te!')
+        unframer = vesc_packet.Stateful()
+        unframer.feed(packet[:3])
+        self.assertEqual(unframer.unpack(), None)
+        self.assertEqual(unframer._header, vesc_packet.Header(2, 3))
+        unframer.feed(packet[3:])
+        self.assertEqual(unframer.unpack(), b'Te!')
+        self.assertEqual(unframer._header, None)
+
+    def test_corrupt_recovery(self):
+        import pyvesc.protocol.packet.codec as vesc_packet
+        packet_to_recover = b'\x02\x04!\xe1$ 8\xbb\x03'
+        corrupt = b'\x02\x03Te!\xaa\x91\x03'
+        unframer = vesc_packet.Stateful()
+        for byte in corrupt + packet_to_recover + packet_to_recover:
+            unframer.feed(bytes([byte]))
+        self.assertEqual(list(unframer), [b'!\xe1$ ', b'!\xe1$ '])
+        unframer = vesc_packet.Stateful(errors='strict')
+        unframer.feed(corrupt)
+        with self.assertRaises(vesc_packet.CorruptPacket):
+            unframer.unpack()
+
+    def test_noise_before_packet(self):
+        import pyvesc.protocol.packet.codec as vesc_packet
+        packet = vesc_packet.frame(b'Te!')
+        # a long start byte with a bogus length of 65520 bytes
+        noise = b'\x03\xff\xf0'
+        unframer = vesc_packet.Stateful(stale_after=4 * len(packet))
+        unframer.feed(noise + packet)
+        # the packet of the start byte may still be on its way
+        self.assertEqual(unframer.unpack(), None)
+        unframer.feed(packet * 3)
+        self.assertEqual(list(unframer), [b'Te!'] * 4)
+        self.assertEqual(unframer.skipped, len(noise))
+        self.assertEqual(len(unframer), 0)
+        # the packets behind it keep coming, also when they arrive a byte at a time
+        for byte in noise + packet * 4:
+            unframer.feed(bytes([byte]))
+        self.assertEqual(list(unframer), [b'Te!'] * 4)
+        self.assertEqual(unframer.skipped, len(noise) * 2)
+        # packets framed in the payload of a packet which is being received are not mistaken for packets, however
+        # the packet is chunked
+        payload = b'A' * 10 + vesc_packet.frame(b'hello') + b'B' * 100
+        long_packet = vesc_packet.frame(payload)
+        for chunk_size in (1, 40, len(long_packet)):
+            unframer = vesc_packet.Stateful()
+            for i in range(0, len(long_packet), chunk_size):
+                unframer.feed(long_packet[i:i + chunk_size])
+                if i + chunk_size < len(long_packet):
+                    self.assertEqual(unframer.unpack(), None)
+            self.assertEqual(list(unframer), [payload])
+            self.assertEqual(len(unframer), 0)
+
+    def test_high_water_mark(self):
+        import pyvesc.protocol.packet.codec as vesc_packet
+        with self.assertRaises(ValueError):
+            vesc_packet.Stateful(high_water_mark=1024)
+        limit = vesc_packet.Stateful.MAX_PACKET_SIZE
+        packet = vesc_packet.frame(b'Te!')
+        unframer = vesc_packet.Stateful(high_water_mark=limit)
+        unframer.feed(b'\x00' * limit)
+        unframer.feed(packet)
+        self.assertEqual(len(unframer), limit)
+        self.assertEqual(unframer.dropped, len(packet))
+        self.assertEqual(list(unframer), [b'Te!'])
+        unframer = vesc_packet.Stateful(errors='strict', high_water_mark=limit)
+        unframer.feed(b'\x00' * limit)
+        with self.assertRaises(vesc_packet.BufferOverflow):
+            unframer.feed(packet)
+
+
+class TestCrc(TestCase):
+    def test_known_values(self):
+        from pyvesc.protocol.packet import crc
+        for engine in crc.ENGINES.values():
+            self.assertEqual(engine(b'123456789'), 0x31C3)
+            self.assertEqual(engine(b'Te!'), 0x4292)
+            self.assertEqual(engine(b''), 0)
+
+    def test_engines_agree(self):
+        import random
+        from pyvesc.protocol.packet import crc
+        for length in list(range(0, 20)) + [254, 255, 256, 1023]:
+            data = bytes(random.getrandbits(8) for i in range(length))
+            expected = crc.crc16_table(data)
+            for engine in crc.ENGINES.values():
+                self.assertEqual(engine(data), expected)
+                self.assertEqual(engine(bytearray(data)), expected)
+                self.assertEqual(engine(memoryview(data)), expected)
+                # calculation can be continued from a previous result
+                self.assertEqual(engine(data[length // 2:], engine(data[:length // 2])), expected)
+
+    def test_select_engine(self):
+        import pyvesc.protocol.packet.codec as vesc_packet
+        from pyvesc.protocol.packet import crc
+        try:
+            for name in crc.ENGINES:
+                crc.select_engine(name)
+                parsed, consumed = vesc_packet.unframe(vesc_packet.frame(b'Te!'))
+                self.assertEqual(parsed, b'Te!')
+            with self.assertRaises(ValueError):
+                crc.select_engine('crc32')
+        finally:
+            crc.select_engine('hqx')
+
 
 class TestMsg(TestCase):
     def setUp(self):
@@ -357,6 +565,179 @@ class TestMsg(TestCase):
         self.assertTrue(caught)
 
 
+class TestCompiledMsg(TestCase):
+    @staticmethod
+    def sample_message(msg_cls):
+        from construct import FormatField, BytesInteger, GreedyRange, Renamed
+        values = []
+        for index, subcon in enumerate(msg_cls.fields.subcons):
+            field = subcon.subcon if isinstance(subcon, Renamed) else subcon
+            if isinstance(field, FormatField):
+                values.append(1.5 if field.fmtstr[-1] in 'fd' else index + 1)
+            elif isinstance(field, BytesInteger):
+                values.append(0x400030001850524154373020)
+            elif isinstance(field, GreedyRange):
+                values.append([index + 1, index + 2])
+            else:
+                values.append('hw_%u' % index)
+        return msg_cls(*values)
+
+    def test_matches_construct(self):
+        from pyvesc.protocol.base import VESCMessage
+        import pyvesc.VESC.messages
+        for msg_cls in set(VESCMessage._msg_registry.values()):
+            if not hasattr(msg_cls.fields, 'subcons'):
+                continue
+            self.assertIsNotNone(msg_cls._layout, msg_cls.__name__)
+            payload = VESCMessage.pack(self.sample_message(msg_cls))
+            for msg_bytes in (payload, bytearray(payload), memoryview(payload)):
+                compiled = VESCMessage.unpack(msg_bytes)
+                parsed = VESCMessage._unpack_construct(msg_cls, msg_bytes)
+                self.assertIs(type(compiled), msg_cls)
+                for subcon in msg_cls.fields.subcons:
+                    self.assertEqual(getattr(compiled, subcon.name), getattr(parsed, subcon.name))
+
+    def test_fixed_layout(self):
+        from pyvesc.VESC.messages import GetValues, GetMCConfTemp, GetRotorPosition, GetVersion
+        for msg_cls in (GetValues, GetMCConfTemp, GetRotorPosition):
+            self.assertEqual(msg_cls._struct.size, msg_cls.fields.sizeof())
+        # strings make the layout variable
+        self.assertIsNone(GetVersion._struct)
+
+    def test_short_payload(self):
+        import construct
+        from pyvesc.protocol.base import VESCMessage
+        from pyvesc.VESC.messages import GetValues
+        payload = VESCMessage.pack(self.sample_message(GetValues))
+        with self.assertRaises(construct.ConstructError):
+            VESCMessage.unpack(payload[:-1])
+
+    def test_compiled_encoder(self):
+        from pyvesc.protocol.base import VESCMessage
+        import pyvesc.VESC.messages
+        for msg_cls in set(VESCMessage._msg_registry.values()):
+            if msg_cls._encoder is None:
+                continue
+            msg = self.sample_message(msg_cls)
+            self.assertEqual(VESCMessage.pack(msg), VESCMessage._pack_construct(msg))
+            msg.can_id = 7
+            self.assertEqual(VESCMessage.pack(msg), VESCMessage._pack_construct(msg))
+
+    def test_constant_packets(self):
+        import pyvesc
+        import pyvesc.protocol.packet.codec as vesc_packet
+        from pyvesc.VESC.messages import Alive, GetValues
+        self.assertEqual(pyvesc.encode_request(GetValues), vesc_packet.frame(bytes([GetValues.id])))
+        self.assertIs(pyvesc.encode_request(GetValues), pyvesc.encode_request(GetValues()))
+        self.assertEqual(pyvesc.encode_request(GetValues(can_id=3)), vesc_packet.frame(bytes([33, 3, GetValues.id])))
+        self.assertIs(pyvesc.encode(Alive()), pyvesc.encode(Alive()))
+        self.assertEqual(pyvesc.encode(Alive(can_id=3)), vesc_packet.frame(bytes([33, 3, Alive.id])))
+
+    def test_slots(self):
+        import pyvesc
+        from pyvesc.VESC.messages import GetValues, SetRPM
+        msg = self.sample_message(GetValues)
+        self.assertFalse(hasattr(msg, '__dict__'))
+        self.assertIsNone(msg.can_id)
+        self.assertIsNone(GetValues.can_id)
+        with self.assertRaises(AttributeError):
+            msg.not_a_field = 1
+        with self.assertRaises(AttributeError):
+            SetRPM(1, 2)
+        self.assertEqual(SetRPM(1000, can_id=2).can_id, 2)
+        decoded = pyvesc.decode(pyvesc.encode(msg))[0]
+        for name in GetValues._field_names:
+            self.assertEqual(getattr(decoded, name), getattr(msg, name))
+
+    def test_frozen(self):
+        import pickle
+        import pyvesc
+        from pyvesc.VESC.messages import GetValues, SetRPM
+        msg = self.sample_message(GetValues)
+        packet = pyvesc.encode(msg)
+        frozen, consumed = pyvesc.decode(packet, frozen=True)
+        self.assertIsInstance(frozen, GetValues.Frozen)
+        self.assertEqual(consumed, len(packet))
+        self.assertEqual(frozen, tuple(getattr(msg, name) for name in GetValues._field_names) + (None,))
+        with self.assertRaises(AttributeError):
+            frozen.rpm = 0
+        self.assertEqual(pyvesc.encode(frozen), packet)
+        self.assertEqual(pyvesc.decode_all(packet * 2, frozen=True)[0], [frozen, frozen])
+        self.assertEqual(pyvesc.encode(SetRPM.Frozen(1000, can_id=2)), pyvesc.encode(SetRPM(1000, can_id=2)))
+        # snapshots can be handed to other processes
+        unpickled = pickle.loads(pickle.dumps(SetRPM.Frozen(1000, can_id=2)))
+        self.assertIs(type(unpickled), SetRPM.Frozen)
+        self.assertEqual(unpickled, SetRPM.Frozen(1000, can_id=2))
+
+    def test_lazy(self):
+        import pyvesc
+        from pyvesc.protocol.base import VESCMessage
+        from pyvesc.VESC.messages import GetValues, GetVersion
+        msg = self.sample_message(GetValues)
+        payload = VESCMessage.pack(msg)
+        for msg_bytes in (payload, bytearray(payload), memoryview(payload)):
+            lazy = VESCMessage.unpack(msg_bytes, lazy=True)
+            self.assertIs(type(lazy), GetValues)
+            # nothing is decoded until it is read
+            with self.assertRaises(AttributeError):
+                object.__getattribute__(lazy, 'rpm')
+            self.assertEqual(lazy.rpm, msg.rpm)
+            self.assertEqual(object.__getattribute__(lazy, 'rpm'), msg.rpm)
+            for name in GetValues._field_names:
+                self.assertEqual(getattr(lazy, name), getattr(msg, name))
+        self.assertEqual(pyvesc.encode(lazy), pyvesc.encode(msg))
+        self.assertEqual(pyvesc.decode(pyvesc.encode(msg), lazy=True)[0].v_in, msg.v_in)
+        with self.assertRaises(AttributeError):
+            lazy.not_a_field
+        with self.assertRaises(AttributeError):
+            GetValues().rpm
+        # a short payload is reported straight away rather than on first read
+        with self.assertRaises(Exception):
+            VESCMessage.unpack(payload[:-1], lazy=True)
+        # messages without a fixed layout are decoded straight away
+        version = VESCMessage.pack(self.sample_message(GetVersion))
+        self.assertEqual(VESCMessage.unpack(version, lazy=True).hw_name, 'hw_3')
+
+
+class TestBatch(TestCase):
+    def setUp(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("numpy is not installed")
+
+    def test_decode_batch(self):
+        import pyvesc
+        from pyvesc.protocol.base import VESCMessage
+        from pyvesc.VESC.messages import GetValues, GetMCConfTemp, GetRotorPosition
+        for msg_cls in (GetValues, GetMCConfTemp, GetRotorPosition):
+            msgs = [msg_cls(*[i + n for i in range(len(msg_cls.fields.subcons))]) for n in range(5)]
+            # unframe_all with zero copy gives memoryview payloads
+            buffer = b''.join(pyvesc.encode(msg) for msg in msgs)
+            payloads, consumed, tail = pyvesc.unframe_all(buffer, zero_copy=True)
+            records = pyvesc.decode_batch(payloads, msg_cls)
+            columns = pyvesc.decode_batch(payloads, msg_cls, columns=True)
+            self.assertEqual(len(records), len(msgs))
+            self.assertEqual(list(columns), list(msg_cls._field_names))
+            for row, payload in enumerate(payloads):
+                msg = VESCMessage.unpack(payload)
+                for name in msg_cls._field_names:
+                    self.assertAlmostEqual(records[row][name], getattr(msg, name), places=5)
+                    self.assertAlmostEqual(columns[name][row], getattr(msg, name), places=5)
+
+    def test_errors(self):
+        import pyvesc
+        from pyvesc.protocol.base import VESCMessage
+        from pyvesc.VESC.messages import GetValues, GetRotorPosition, GetVersion
+        payload = VESCMessage.pack(GetRotorPosition(1.5))
+        with self.assertRaises(ValueError):
+            pyvesc.decode_batch([payload[:-1]], GetRotorPosition)
+        with self.assertRaises(ValueError):
+            pyvesc.decode_batch([payload], GetValues)
+        with self.assertRaises(TypeError):
+            pyvesc.message_dtype(GetVersion)
+
+
 class TestInterface(TestCase):
     def setUp(self):
         import copy
@@ -376,6 +757,73 @@ class TestInterface(TestCase):
         for field in msg._field_names:
             self.assertEqual(getattr(msg, field), getattr(decoded, field))
 
+    def test_decode_all(self):
+        import pyvesc
+        from pyvesc.VESC.messages import SetCurrent, SetRPM
+        msgs = [SetCurrent(1.5), SetRPM(300), SetCurrent(2.0)]
+        buffer = b''.join(pyvesc.encode(msg) for msg in msgs)
+        decoded, consumed, tail = pyvesc.decode_all(b'\x07' + buffer + buffer[:3])
+        self.assertEqual(consumed, len(buffer) + 1)
+        self.assertEqual(tail, buffer[:3])
+        self.assertEqual([type(msg) for msg in decoded], [type(msg) for msg in msgs])
+        self.assertEqual(decoded[0].current, 1.5)
+        self.assertEqual(decoded[1].rpm, 300)
+        self.assertEqual(decoded[2].current, 2.0)
+
+    def test_encode_into(self):
+        from unittest import mock
+        import pyvesc
+        from pyvesc.VESC.messages import PingCan, SetCurrent, SetRPM
+        msgs = [SetCurrent(1.5), SetRPM(300), SetCurrent(2.0)]
+        expected = b''.join(pyvesc.encode(msg) for msg in msgs)
+        buffer = bytearray(len(expected))
+        offset = 0
+        for msg in msgs:
+            offset += pyvesc.encode_into(msg, buffer, offset)
+        self.assertEqual(buffer, expected)
+        # fixed layout messages are packed straight into the buffer, other messages with construct
+        msgs = [SetCurrent(1.5, can_id=3), SetRPM.Frozen(300), PingCan([1, 2, 3])]
+        expected = b''.join(pyvesc.encode(msg) for msg in msgs)
+        buffer = bytearray(len(expected) + 1)
+        offset = 1
+        with mock.patch.object(pyvesc.VESCMessage, 'pack', wraps=pyvesc.VESCMessage.pack) as pack:
+            for msg in msgs:
+                offset += pyvesc.encode_into(msg, buffer, offset)
+        self.assertEqual(pack.call_count, 1)
+        self.assertEqual(buffer[1:], expected)
+        with self.assertRaises(pyvesc.protocol.packet.exceptions.BufferOverflow):
+            pyvesc.encode_into(SetCurrent(1.5), buffer, len(buffer) - 2)
+
+    def test_encode_many(self):
+        import pyvesc
+        from pyvesc.VESC.messages import SetCurrent, SetRPM, Alive
+        msgs = [SetCurrent(1.5, can_id=3), SetRPM(300), Alive(can_id=7), SetCurrent.Frozen(2.0, 9)]
+        self.assertEqual(pyvesc.encode_many(msgs), b''.join(pyvesc.encode(msg) for msg in msgs))
+        currents = {3: 1.5, 7: 2.5, 9: 0}
+        expected = b''.join(pyvesc.encode(SetCurrent(current, can_id=can_id)) for can_id, current in currents.items())
+        self.assertEqual(pyvesc.encode_forward(SetCurrent, currents), expected)
+        decoded = pyvesc.decode_all(pyvesc.encode_forward(SetRPM, {1: 100, 2: 200}))[0]
+        self.assertEqual([(msg.can_id, msg.rpm) for msg in decoded], [(1, 100), (2, 200)])
+
+    def test_decode_zero_copy(self):
+        import pyvesc
+        from pyvesc.VESC.messages import SetCurrent
+        buffer = bytearray(pyvesc.encode(SetCurrent(1.5)) * 2)
+        decoded, consumed = pyvesc.decode(buffer, zero_copy=True)
+        self.assertEqual(decoded.current, 1.5)
+        self.assertEqual(consumed, len(buffer) // 2)
+        decoded, consumed, tail = pyvesc.decode_all(buffer, zero_copy=True)
+        self.assertEqual([msg.current for msg in decoded], [1.5, 1.5])
+        self.assertEqual((consumed, tail), (len(buffer), b''))
+        # messages are decoded in place, also when forwarded, lazy or frozen
+        buffer += pyvesc.encode(SetCurrent(2.5, can_id=7)) + pyvesc.encode(SetCurrent(3.5))[:-1]
+        for lazy, frozen in ((False, False), (True, False), (False, True)):
+            decoded, consumed, tail = pyvesc.decode_all(buffer, zero_copy=True, lazy=lazy, frozen=frozen)
+            self.assertEqual([(msg.current, msg.can_id) for msg in decoded], [(1.5, None), (1.5, None), (2.5, 7)])
+            self.assertEqual(tail, pyvesc.encode(SetCurrent(3.5))[:-1])
+        # no views into the buffer are left alive
+        buffer.clear()
+
     def test_interface(self):
         from pyvesc.VESCMotor.messages import VESCMessage
 
@@ -424,3 +872,719 @@ class TestInterface(TestCase):
         self.verify_encode_decode(test_message2)
         self.verify_encode_decode(test_message3)
         self.verify_encode_decode(test_message4)
+
+
+class FakeVESC(object):
+    """
+    A VESC at the other end of a pseudo terminal, for testing the VESC class without hardware. Replies to each request
+    with the message in replies for its id, and records the payload of every packet it receives. Requests forwarded to
+    a can id in nodes are answered with the message in nodes[can_id] for their id, if there is one.
+    """
+    def __init__(self, replies=None, nodes=None):
+        import os
+        import threading
+        import tty
+        from pyvesc.VESC.messages import GetVersion, GetValues, GetMCConfTemp
+        self.replies = dict((msg_cls.id, TestCompiledMsg.sample_message(msg_cls))
+                            for msg_cls in (GetVersion, GetValues, GetMCConfTemp))
+        self.replies.update(replies or {})
+        self.nodes = nodes or {}
+        self.received = []
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _run(self):
+        import os
+        import select
+        from pyvesc.protocol.packet.codec import Stateful
+        unframer = Stateful()
+        while not self._stop.is_set():
+            if not select.select([self.master], [], [], 0.01)[0]:
+                continue
+            try:
+                unframer.feed(os.read(self.master, 4096))
+            except OSError:
+                return
+            for payload in unframer:
+                self.received.append(payload)
+                # forwarded requests start with COMM_FORWARD_CAN and the can id
+                if payload[0] == 33:
+                    reply = self.nodes.get(payload[1], {}).get(payload[2], self.replies.get(payload[2]))
+                else:
+                    reply = self.replies.get(payload[0])
+                if reply is not None:
+                    self.send(reply)
+
+    def send(self, msg):
+        import os
+        import pyvesc
+        os.write(self.master, pyvesc.encode(msg))
+
+    def close(self):
+        import os
+        self._stop.set()
+        self._thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+class TestVESC(TestCase):
+    def test_requests(self):
+        from pyvesc.VESC import VESC
+        from pyvesc.VESC.messages import GetValues, GetVersion
+        with FakeVESC() as fake:
+            with VESC(fake.port, start_heartbeat=False) as vesc:
+                self.assertEqual(vesc.uuid, fake.replies[GetVersion.id].uuid)
+                self.assertEqual(vesc.conf.motor_poles, 11)
+                self.assertEqual(vesc.get_measurements().v_in, fake.replies[GetValues.id].v_in)
+                self.assertEqual(vesc.get_erpm(), fake.replies[GetValues.id].rpm)
+            self.assertFalse(vesc._reader_thread.is_alive())
+
+    def test_unsolicited(self):
+        from pyvesc.VESC import VESC
+        from pyvesc.VESC.messages import GetValues, GetRotorPosition
+        with FakeVESC() as fake:
+            with VESC(fake.port, start_heartbeat=False) as vesc:
+                fake.send(GetRotorPosition(12.5))
+                fake.send(GetRotorPosition(25.0))
+                # messages nobody asked for are kept, in order, rather than dropped
+                self.assertEqual(vesc.get_erpm(), fake.replies[GetValues.id].rpm)
+                self.assertEqual(vesc.receive().rotor_pos, 12.5)
+                self.assertEqual(vesc.receive().rotor_pos, 25.0)
+            # only the newest of those nobody receives are kept
+            with VESC(fake.port, start_heartbeat=False, max_unsolicited=2) as vesc:
+                for rotor_pos in range(5):
+                    fake.send(GetRotorPosition(rotor_pos))
+                self.assertEqual(vesc.get_erpm(), fake.replies[GetValues.id].rpm)
+                self.assertEqual([vesc.receive().rotor_pos for i in range(2)], [3, 4])
+                self.assertEqual(vesc.unsolicited_dropped, 3)
+
+    def test_empty_message(self):
+        import os
+        from pyvesc.VESC import VESC
+        from pyvesc.VESC.messages import GetValues
+        with FakeVESC() as fake:
+            for reader_thread in (True, False):
+                with VESC(fake.port, start_heartbeat=False, reader_thread=reader_thread) as vesc:
+                    # a valid packet with an empty payload (the crc of nothing is 0)
+                    os.write(fake.master, b'\x02\x00\x00\x00\x03')
+                    self.assertEqual(vesc.get_erpm(), fake.replies[GetValues.id].rpm)
+                    self.assertEqual(vesc.get_erpm(), fake.replies[GetValues.id].rpm)
+
+    def test_timeout(self):
+        from pyvesc.VESC import VESC, ResponseTimeout
+        from pyvesc.VESC.messages import GetValues
+        with FakeVESC() as fake:
+            with VESC(fake.port, start_heartbeat=False) as vesc:
+                reply = fake.replies.pop(GetValues.id)
+                with self.assertRaises(ResponseTimeout):
+                    vesc.get_measurements(timeout=0.05)
+                self.assertEqual(len(vesc._pending[GetValues.id]), 0)
+                with self.assertRaises(ResponseTimeout):
+                    vesc.receive(timeout=0.01)
+                fake.replies[GetValues.id] = reply
+                self.assertEqual(vesc.get_measurements().rpm, reply.rpm)
+
+    def test_request_many(self):
+        from pyvesc.VESC import VESC, ResponseTimeout
+        from pyvesc.VESC.messages import GetValues, GetVersion, GetMCConfTemp, GetRotorPosition
+        requests = [GetValues, GetVersion, GetMCConfTemp, GetValues]
+        with FakeVESC() as fake:
+            with VESC(fake.port, start_heartbeat=False) as vesc:
+                for max_in_flight in (None, 1, 3):
+                    # the writes of the constructor are counted once the writer thread finished them
+                    vesc.writer.flush()
+                    writes = vesc.writer.writes
+                    replies = vesc.request_many(requests, max_in_flight=max_in_flight)
+                    self.assertEqual([type(reply.message) for reply in replies], requests)
+                    self.assertEqual(replies[0].message.rpm, fake.replies[GetValues.id].rpm)
+                    self.assertEqual(replies[1].message.uuid, fake.replies[GetVersion.id].uuid)
+                    for reply in replies:
+                        self.assertGreater(reply.latency, 0)
+                    vesc.writer.flush()
+                    expected = 1 if max_in_flight is None else 4 if max_in_flight == 1 else 2
+                    self.assertEqual(vesc.writer.writes - writes, expected)
+                with self.assertRaises(ResponseTimeout):
+                    vesc.request_many([GetValues, GetRotorPosition], timeout=0.05)
+                self.assertEqual(len(vesc._pending[GetRotorPosition.id]), 0)
+
+    def test_synchronous(self):
+        import os
+        import threading
+        import pyvesc
+        from pyvesc.VESC import VESC, ResponseTimeout
+        from pyvesc.VESC.messages import GetValues, GetVersion, GetRotorPosition
+        with FakeVESC() as fake:
+            threads = threading.active_count()
+            with VESC(fake.port, start_heartbeat=False, reader_thread=False) as vesc:
+                self.assertIsNone(vesc._reader_thread)
+                # the writer thread also paces the setpoints
+                self.assertEqual(threading.active_count() - threads, 1)
+                self.assertEqual(vesc.uuid, fake.replies[GetVersion.id].uuid)
+                # noise, a corrupt packet and a message nobody asked for in front of the reply are skipped or kept
+                corrupt = bytearray(pyvesc.encode(GetRotorPosition(1.0)))
+                corrupt[-1] = 0
+                os.write(fake.master, b'\x00\x01\xff' + bytes(corrupt))
+                fake.send(GetRotorPosition(12.5))
+                self.assertEqual(vesc.get_measurements().rpm, fake.replies[GetValues.id].rpm)
+                self.assertEqual(vesc.receive().rotor_pos, 12.5)
+                replies = vesc.request_many([GetValues, GetVersion, GetValues])
+                self.assertEqual([type(reply.message) for reply in replies], [GetValues, GetVersion, GetValues])
+                with self.assertRaises(ResponseTimeout):
+                    vesc.request_many([GetValues, GetRotorPosition], timeout=0.05)
+                with self.assertRaises(ResponseTimeout):
+                    vesc.receive(timeout=0.01)
+                # a message cut off by the deadline is completed by the next read
+                packet = pyvesc.encode(GetRotorPosition(25.0))
+                os.write(fake.master, packet[:4])
+                with self.assertRaises(ResponseTimeout):
+                    vesc.receive(timeout=0.02)
+                os.write(fake.master, packet[4:])
+                self.assertEqual(vesc.receive().rotor_pos, 25.0)
+
+
+    def test_can(self):
+        import pyvesc
+        from pyvesc.VESC import VESC
+        from pyvesc.VESC.messages import GetValues, GetRotorPosition, SetCurrent
+        nodes = {}
+        for can_id in (3, 7, 9):
+            msg = TestCompiledMsg.sample_message(GetValues)
+            msg.app_controller_id = can_id
+            msg.rpm = can_id * 1000
+            nodes[can_id] = {GetValues.id: msg}
+        with FakeVESC(nodes=nodes) as fake:
+            with VESC(fake.port, start_heartbeat=False) as vesc:
+                self.assertIs(vesc.can(7), vesc.can(7))
+                measurements = vesc.can(7).get_measurements()
+                self.assertEqual((measurements.rpm, measurements.can_id), (7000, 7))
+                self.assertEqual(vesc.can(3).get_motor_conf_simple().motor_poles, 11)
+                self.assertEqual(vesc.can(7).get_rpm(), 7000 / 5.5)
+                vesc.can(9).set_current(5)
+                # the setpoint is written by the writer thread, get it out of the way of the write counted below
+                vesc.writer.flush()
+                writes = vesc.writer.writes
+                polled = vesc.poll_can([9, 3, 7])
+                vesc.writer.flush()
+                self.assertEqual(vesc.writer.writes - writes, 1)
+                self.assertEqual(sorted(polled), [3, 7, 9])
+                for can_id, msg in polled.items():
+                    self.assertEqual((msg.rpm, msg.can_id), (can_id * 1000, can_id))
+                self.assertIn(bytes(pyvesc.VESCMessage.pack(SetCurrent(5, can_id=9))), fake.received)
+                # messages forwarded with the CAN header are tagged with their source
+                fake.send(GetRotorPosition(12.5, can_id=3))
+                msg = vesc.receive()
+                self.assertEqual((msg.rotor_pos, msg.can_id), (12.5, 3))
+                # setpoints for many VESCs go out in one write
+                writes = vesc.writer.writes
+                vesc.set_current_many({3: 1.5, 7: 2.5, 9: 3.5})
+                vesc.writer.flush()
+                self.assertEqual(vesc.writer.writes - writes, 1)
+                # the fake has read the setpoints once it replies to a later request
+                vesc.get_measurements()
+                for can_id, current in ((3, 1.5), (7, 2.5), (9, 3.5)):
+                    self.assertIn(bytes(pyvesc.VESCMessage.pack(SetCurrent(current, can_id=can_id))), fake.received)
+                # zero currents in a mix go ahead of other traffic for their can ids only
+                vesc.set_current_many({3: 0, 7: 5})
+                vesc.writer.flush()
+                self.assertEqual(vesc.writer.stats()['latency']['SAFETY']['frames'], 1)
+                vesc.get_measurements()
+                for can_id, current in ((3, 0), (7, 5)):
+                    self.assertIn(bytes(pyvesc.VESCMessage.pack(SetCurrent(current, can_id=can_id))), fake.received)
+        payload = pyvesc.VESCMessage.pack(SetCurrent(5, can_id=9))
+        self.assertEqual(pyvesc.VESCMessage.unpack(payload, frozen=True), SetCurrent.Frozen(5, 9))
+        self.assertEqual(pyvesc.VESCMessage.unpack(payload, lazy=True).can_id, 9)
+
+
+    def test_scan_can(self):
+        from pyvesc.VESC import VESC
+        from pyvesc.VESC.messages import GetVersion, PingCan
+        nodes = {}
+        for can_id in (3, 7, 9):
+            version = TestCompiledMsg.sample_message(GetVersion)
+            version.uuid = can_id
+            nodes[can_id] = {GetVersion.id: version}
+        with FakeVESC({PingCan.id: PingCan([3, 7, 9])}, nodes) as fake:
+            with VESC(fake.port, start_heartbeat=False) as vesc:
+                found = vesc.scan_can()
+                self.assertEqual(dict((can_id, version.uuid) for can_id, version in found.items()), {3: 3, 7: 7, 9: 9})
+                self.assertEqual(found[7].hw_name, fake.replies[GetVersion.id].hw_name)
+                fake.replies[PingCan.id] = PingCan([])
+                self.assertEqual(vesc.scan_can(), {})
+                # the replies could not be told apart
+                with self.assertRaises(ValueError):
+                    vesc.poll_can([3, 7], GetVersion)
+                self.assertEqual(vesc.poll_can([7], GetVersion)[7].uuid, 7)
+
+    def test_lazy_info(self):
+        import os
+        import tempfile
+        import time
+        from pyvesc.VESC import VESC
+        from pyvesc.VESC.messages import GetVersion, GetMCConfTemp
+        with FakeVESC() as fake, tempfile.TemporaryDirectory() as tmp:
+            with VESC(fake.port, start_heartbeat=False, fetch_info=False) as vesc:
+                self.assertEqual(fake.received, [])
+                self.assertEqual(vesc.conf.motor_poles, 11)
+                self.assertEqual(fake.received, [bytes([GetMCConfTemp.id])])
+                self.assertEqual(vesc.uuid, fake.replies[GetVersion.id].uuid)
+                self.assertEqual(len(fake.received), 2)
+
+            cache_path = os.path.join(tmp, 'devices.json')
+            with VESC(fake.port, start_heartbeat=False, info_cache_path=cache_path) as vesc:
+                vesc.writer.flush()
+                self.assertEqual(vesc.writer.writes, 1)
+            del fake.received[:]
+            # a known VESC is connected to without waiting, and only its uuid is checked
+            with VESC(fake.port, start_heartbeat=False, info_cache_path=cache_path) as vesc:
+                self.assertEqual(vesc.uuid, fake.replies[GetVersion.id].uuid)
+                self.assertEqual(vesc.conf.motor_poles, 11)
+                vesc.get_measurements()
+                self.assertEqual(fake.received[0], bytes([GetVersion.id]))
+                self.assertNotIn(bytes([GetMCConfTemp.id]), fake.received)
+
+            # another VESC on the port is noticed by the check
+            fake.replies[GetVersion.id].uuid = 0x123
+            with VESC(fake.port, start_heartbeat=False, info_cache_path=cache_path) as vesc:
+                deadline = time.monotonic() + 1
+                while vesc._firmware_info.uuid != 0x123 and time.monotonic() < deadline:
+                    time.sleep(0.001)
+                self.assertEqual(vesc.uuid, 0x123)
+                self.assertIsNone(vesc._conf)
+                self.assertEqual(vesc.conf.motor_poles, 11)
+
+
+class TestDiscovery(TestCase):
+    def test_find_port(self):
+        import os
+        import tempfile
+        from pyvesc.VESC import discovery
+        from pyvesc.VESC.messages import GetVersion
+        versions = []
+        for uuid in (0x111, 0x222):
+            version = TestCompiledMsg.sample_message(GetVersion)
+            version.uuid = uuid
+            versions.append({GetVersion.id: version})
+        with FakeVESC(versions[0]) as first, FakeVESC(versions[1]) as second, tempfile.TemporaryDirectory() as tmp:
+            ports = [first.port, second.port, os.path.join(tmp, 'missing')]
+            found = discovery.discover(ports)
+            self.assertEqual(dict((port, version.uuid) for port, version in found.items()),
+                             {first.port: 0x111, second.port: 0x222})
+            # only the firmware version was asked for
+            self.assertEqual(first.received, [bytes([GetVersion.id])])
+
+            cache_path = os.path.join(tmp, 'cache', 'ports.json')
+            self.assertEqual(discovery.find_port(0x222, ports, cache_path=cache_path), second.port)
+            self.assertEqual(discovery.PortCache(cache_path).get(0x111), first.port)
+            # the cached port is checked on its own
+            self.assertEqual(discovery.find_port(0x111, ports, cache_path=cache_path), first.port)
+            self.assertEqual(len(first.received), 3)
+            self.assertEqual(len(second.received), 2)
+            # a stale entry is found again by probing every port
+            with open(cache_path, 'w') as f:
+                f.write('{"%024x": "%s"}' % (0x111, second.port))
+            self.assertEqual(discovery.find_port(0x111, ports, cache_path=cache_path), first.port)
+            self.assertEqual(discovery.PortCache(cache_path).get(0x222), second.port)
+            self.assertIsNone(discovery.find_port(0x333, ports, cache_path=None))
+
+
+class TestAsyncVESC(TestCase):
+    def run_with_fake(self, test, **kwargs):
+        import asyncio
+        from pyvesc.VESC import AsyncVESC
+
+        async def main(fake):
+            async with AsyncVESC(fake.port, **kwargs) as vesc:
+                await test(vesc, fake)
+
+        with FakeVESC() as fake:
+            # asyncio.run() needs python 3.7
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(main(fake))
+            finally:
+                loop.close()
+
+    def test_requests(self):
+        import asyncio
+        from pyvesc.VESC.messages import GetValues, GetVersion, GetMCConfTemp, GetRotorPosition
+
+        async def test(vesc, fake):
+            self.assertEqual(vesc.uuid, fake.replies[GetVersion.id].uuid)
+            self.assertEqual((await vesc.get_measurements()).v_in, fake.replies[GetValues.id].v_in)
+            # concurrent requests for the same message are answered in order
+            rpms = await asyncio.gather(*(vesc.get_erpm() for i in range(5)))
+            self.assertEqual(rpms, [fake.replies[GetValues.id].rpm] * 5)
+            # the getters shared with VESC and CANNode
+            poles = fake.replies[GetMCConfTemp.id].motor_poles
+            self.assertEqual(await vesc.get_rpm(), fake.replies[GetValues.id].rpm / (poles / 2))
+            await vesc.set_current(1.5)
+            replies = await vesc.request_many([GetValues, GetMCConfTemp, GetValues], max_in_flight=2)
+            self.assertEqual([type(reply.message) for reply in replies], [GetValues, GetMCConfTemp, GetValues])
+            fake.send(GetRotorPosition(12.5))
+            self.assertEqual((await vesc.receive()).rotor_pos, 12.5)
+
+        self.run_with_fake(test, start_heartbeat=False)
+
+    def test_timeout(self):
+        import pyvesc
+        from pyvesc.VESC import ResponseTimeout
+        from pyvesc.VESC.messages import GetValues, GetRotorPosition
+
+        async def test(vesc, fake):
+            with self.assertRaises(ResponseTimeout):
+                await vesc.write(pyvesc.encode_request(GetRotorPosition), 0, timeout=0.05)
+            with self.assertRaises(ResponseTimeout):
+                await vesc.request_many([GetValues, GetRotorPosition], timeout=0.05)
+            self.assertEqual(len(vesc._pending[GetRotorPosition.id]), 0)
+            self.assertEqual((await vesc.get_measurements()).rpm, fake.replies[GetValues.id].rpm)
+
+        self.run_with_fake(test, start_heartbeat=False)
+
+    def test_heartbeat(self):
+        import asyncio
+        import pyvesc
+        from pyvesc.VESC.messages import Alive, SetCurrent
+
+        async def test(vesc, fake):
+            await vesc.set_current(5)
+            await asyncio.sleep(0.25)
+            self.assertIn(bytes([Alive.id]), fake.received)
+            self.assertIn(bytes(pyvesc.VESCMessage.pack(SetCurrent(5))), fake.received)
+
+        self.run_with_fake(test)
+
+    def test_port_error(self):
+        import asyncio
+        import os
+        from pyvesc.VESC.messages import GetValues
+
+        async def test(vesc, fake):
+            # an empty message is ignored
+            os.write(fake.master, b'\x02\x00\x00\x00\x03')
+            self.assertEqual((await vesc.get_measurements()).rpm, fake.replies[GetValues.id].rpm)
+
+            def broken(data):
+                raise OSError(5, "Input/output error")
+            vesc._send = broken
+            # the heartbeat fails to write an Alive message
+            await asyncio.sleep(0.25)
+            await vesc.close()
+            self.assertFalse(vesc.serial_port.is_open)
+
+        self.run_with_fake(test)
+
+
+class TestFleet(TestCase):
+    def test_fleet(self):
+        import os
+        import time
+        import pyvesc
+        from pyvesc.VESC import VESCFleet
+        from pyvesc.VESC.messages import Alive, GetValues, GetRotorPosition, SetCurrent
+        fakes = [FakeVESC() for i in range(3)]
+        try:
+            with VESCFleet([fake.port for fake in fakes], telemetry_rate=50) as fleet:
+                fleet.set_current(fakes[1].port, 5)
+                fakes[2].send(GetRotorPosition(12.5))
+                name, msg = fleet.receive(timeout=1)
+                self.assertEqual((name, msg.rotor_pos), (fakes[2].port, 12.5))
+                # an empty message and truncated telemetry do not stop the fleet thread
+                with self.assertLogs('pyvesc.VESC.fleet', 'ERROR'):
+                    os.write(fakes[0].master, b'\x02\x00\x00\x00\x03' + pyvesc.frame(bytes([GetValues.id, 1, 2])))
+                    time.sleep(0.2)
+                snapshot = fleet.snapshot()
+                stats = fleet.stats()
+                self.assertTrue(fleet._thread.is_alive())
+        finally:
+            for fake in fakes:
+                fake.close()
+        for fake in fakes:
+            self.assertEqual(snapshot[fake.port].message.rpm, fake.replies[GetValues.id].rpm)
+            self.assertGreater(stats[fake.port][1], 0)
+            self.assertIn(bytes([Alive.id]), fake.received)
+        self.assertIn(pyvesc.VESCMessage.pack(SetCurrent(5)), fakes[1].received)
+        self.assertNotIn(pyvesc.VESCMessage.pack(SetCurrent(5)), fakes[0].received)
+
+    def test_fleet_port_closed(self):
+        import os
+        import selectors
+        from pyvesc.VESC import VESCFleet
+        with FakeVESC() as fake:
+            with VESCFleet([fake.port], start=False) as fleet:
+                device = fleet.devices[fake.port]
+                # a port which reads end of file, like an unplugged one
+                read_end, write_end = os.pipe()
+                os.close(write_end)
+                fleet._selector.unregister(device.fd)
+                fleet._selector.register(read_end, selectors.EVENT_READ | selectors.EVENT_WRITE, device)
+                device.fd = read_end
+                device.out += b'\x00'
+                fleet._read(device)
+                self.assertIsInstance(device.error, EOFError)
+                # the port is not written to or unregistered again after it failed
+                fleet._flush(device)
+                fleet._fail(device, OSError())
+                self.assertIsInstance(device.error, EOFError)
+                os.close(read_end)
+
+
+class TestHeartbeat(TestCase):
+    class Device(object):
+        def __init__(self):
+            self.last_command = 0.0
+            self.alive = 0
+
+        def write(self, data, priority=None):
+            import time
+            self.alive += 1
+            self.last_command = time.monotonic()
+
+    def test_scheduler(self):
+        import time
+        import threading
+        from pyvesc.VESC.heartbeat import HeartbeatScheduler
+        scheduler = HeartbeatScheduler(period=0.02)
+        idle, busy = self.Device(), self.Device()
+        threads = threading.active_count()
+        scheduler.register(idle)
+        scheduler.register(busy)
+        # one thread serves every device
+        self.assertEqual(threading.active_count(), threads + 1)
+        end = time.monotonic() + 0.2
+        while time.monotonic() < end:
+            busy.last_command = time.monotonic()
+            time.sleep(0.005)
+        scheduler.unregister(idle)
+        scheduler.unregister(busy)
+        sent = idle.alive
+        self.assertGreaterEqual(sent, 5)
+        self.assertLessEqual(busy.alive, 1)
+        self.assertGreater(scheduler.skipped, 0)
+        time.sleep(0.05)
+        self.assertEqual(idle.alive, sent)
+        self.assertEqual(len(scheduler), 0)
+
+    def test_vesc(self):
+        import time
+        import pyvesc
+        from pyvesc.VESC import VESC
+        from pyvesc.VESC.messages import Alive, SetCurrent
+        alive = bytes([Alive.id])
+        with FakeVESC() as fake:
+            with VESC(fake.port) as vesc:
+                time.sleep(0.25)
+                self.assertGreaterEqual(fake.received.count(alive), 2)
+                # commands keep the motor alive, so no heartbeat is needed
+                vesc.set_current(5)
+                time.sleep(0.01)
+                count = fake.received.count(alive)
+                end = time.monotonic() + 0.3
+                while time.monotonic() < end:
+                    vesc.set_current(5)
+                    time.sleep(0.02)
+                self.assertEqual(fake.received.count(alive), count)
+
+
+class TestFrameWriter(TestCase):
+    def test_coalescing(self):
+        import threading
+        import time
+        from pyvesc.VESC.writer import FrameWriter
+        written = []
+
+        def write(data):
+            # a slow port, so frames queue up behind each write
+            time.sleep(0.002)
+            written.append(data)
+
+        writer = FrameWriter(write)
+
+        def submit(tag):
+            for i in range(50):
+                writer.submit(bytes([tag, i]))
+
+        threads = [threading.Thread(target=submit, args=(tag,)) for tag in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(writer.flush(1))
+        data = b''.join(written)
+        self.assertEqual(len(data), 400)
+        # every frame arrives whole, and the frames of each thread in order
+        frames = [data[i:i + 2] for i in range(0, len(data), 2)]
+        for tag in range(4):
+            self.assertEqual([frame[1] for frame in frames if frame[0] == tag], list(range(50)))
+        stats = writer.stats()
+        self.assertEqual(stats['frames'], 200)
+        self.assertEqual(stats['writes'], len(written))
+        self.assertGreater(stats['frames_per_write'], 1)
+        self.assertGreater(stats['max_queue_depth'], 1)
+        writer.close()
+        with self.assertRaises(ValueError):
+            writer.submit(b'\x00')
+
+    def test_error(self):
+        from pyvesc.VESC.writer import FrameWriter
+
+        def write(data):
+            raise OSError("unplugged")
+
+        writer = FrameWriter(write)
+        writer.submit(b'\x00')
+        self.assertTrue(writer.flush(1))
+        with self.assertRaises(OSError):
+            writer.submit(b'\x00')
+
+    def test_priorities(self):
+        import time
+        from pyvesc.VESC.writer import FrameWriter, Priority
+        written = []
+        baudrate = 115200
+
+        def write(data):
+            # a blocking write on a slow link
+            time.sleep(len(data) * 10 / baudrate)
+            written.append(data)
+
+        writer = FrameWriter(write, baudrate=baudrate, bulk_chunk=256)
+        # 100 bulk frames take 0.55 s on the link
+        for i in range(100):
+            writer.submit(bytes([Priority.BULK]) * 64, Priority.BULK)
+        writer.submit(bytes([Priority.TELEMETRY]) * 6, Priority.TELEMETRY)
+        time.sleep(0.05)
+        writer.submit(bytes([Priority.SAFETY]) * 10, Priority.SAFETY)
+        writer.submit(bytes([Priority.SETPOINT]) * 10, Priority.SETPOINT)
+        self.assertTrue(writer.flush(2))
+        data = b''.join(written)
+        # the brake went out within about one bulk chunk, and ahead of the setpoint queued after it
+        self.assertLess(data.index(bytes([Priority.SAFETY])), 4 * 256)
+        self.assertLess(data.index(bytes([Priority.SAFETY])), data.index(bytes([Priority.SETPOINT])))
+        self.assertLess(data.index(bytes([Priority.TELEMETRY])), 256)
+        latency = writer.stats()['latency']
+        self.assertEqual(latency['BULK']['frames'], 100)
+        self.assertLess(latency['SAFETY']['max'], 0.05)
+        self.assertGreater(latency['BULK']['max'], 0.4)
+        writer.close()
+
+    def test_safety_after_setpoints(self):
+        import threading
+        import pyvesc
+        from pyvesc.VESC.writer import FrameWriter, Priority
+        from pyvesc.VESC.setpoints import SetpointChannel
+        from pyvesc.VESC.messages import SetCurrent, SetCurrentBrake, SetRotorPositionMode, SetRPM
+        written = []
+        release = threading.Event()
+
+        def write(data):
+            # blocked mid-write until released
+            release.wait()
+            written.append(data)
+
+        writer = FrameWriter(write)
+        channel = SetpointChannel(writer)
+        writer.submit(pyvesc.encode(SetRPM(1000)), Priority.TELEMETRY)
+        # the writer is now blocked writing the first frame
+        while writer.stats()['queue_depth']:
+            pass
+        writer.submit(pyvesc.encode(SetRotorPositionMode(0)), Priority.SETPOINT)
+        writer.submit(pyvesc.encode(SetCurrent(5, can_id=7)), Priority.SETPOINT)
+        writer.submit(pyvesc.encode(SetCurrent(5)), Priority.SETPOINT)
+        channel.set(SetCurrent(6))
+        channel.set(SetCurrent(4, can_id=7))
+        channel.preempt(SetCurrentBrake(3))
+        writer.submit(pyvesc.encode(SetCurrent(7)), Priority.SETPOINT)
+        release.set()
+        self.assertTrue(writer.flush(1))
+        channel.close()
+        writer.close()
+        frames = pyvesc.decode_all(b''.join(written))[0]
+        # the commands submitted before the brake went out ahead of it and none was dropped, the pending setpoint of
+        # the VESC was dropped and the one of another can id was kept
+        self.assertEqual([(type(frame), frame.can_id) for frame in frames],
+                         [(SetRPM, None), (SetRotorPositionMode, None), (SetCurrent, 7), (SetCurrent, None),
+                          (SetCurrentBrake, None), (SetCurrent, None), (SetCurrent, 7)])
+        self.assertEqual([frames[3].current, frames[5].current, frames[6].current], [5, 7, 4])
+        self.assertEqual(channel.stats()['dropped'], 1)
+
+
+class TestSetpointChannel(TestCase):
+    def test_latest_wins(self):
+        import pyvesc
+        from pyvesc.VESC.writer import FrameWriter
+        from pyvesc.VESC.setpoints import SetpointChannel
+        from pyvesc.VESC.messages import SetCurrent, SetRPM
+        written = []
+        writer = FrameWriter(written.append)
+        # a 10 byte frame takes 0.1 s on a 1000 baud link
+        channel = SetpointChannel(writer, baudrate=1000)
+        for current in range(1, 101):
+            channel.set(SetCurrent(current))
+            channel.set(SetRPM(current * 10))
+        channel.close()
+        writer.close()
+        frames = pyvesc.decode_all(b''.join(written))[0]
+        # setpoints set while the link was busy were superseded, the newest of each kind was sent last
+        self.assertEqual(frames[-2].current, 100)
+        self.assertEqual(frames[-1].rpm, 1000)
+        stats = channel.stats()
+        self.assertEqual(stats['sent'], len(frames))
+        self.assertEqual(stats['sent'] + stats['dropped'], 200)
+        self.assertGreater(stats['dropped_by_type']['SetCurrent'], 90)
+        self.assertGreater(stats['dropped_by_type']['SetRPM'], 90)
+        self.assertEqual(stats['pending'], 0)
+        with self.assertRaises(ValueError):
+            channel.set(SetCurrent(1))
+
+    def test_flush(self):
+        import time
+        import pyvesc
+        from pyvesc.VESC.writer import FrameWriter
+        from pyvesc.VESC.setpoints import SetpointChannel
+        from pyvesc.VESC.messages import SetCurrent
+        written = []
+        writer = FrameWriter(written.append)
+        channel = SetpointChannel(writer, baudrate=1000)
+        channel.set(SetCurrent(1))
+        channel.set(SetCurrent(2))
+        # flushing does not wait for the link to carry the setpoints written before
+        start = time.monotonic()
+        self.assertTrue(writer.flush(1))
+        self.assertLess(time.monotonic() - start, 0.05)
+        self.assertEqual(pyvesc.decode_all(b''.join(written))[0][-1].current, 2)
+        writer.close()
+
+    def test_preempt(self):
+        import pyvesc
+        from pyvesc.VESC.writer import FrameWriter
+        from pyvesc.VESC.setpoints import SetpointChannel
+        from pyvesc.VESC.messages import SetCurrent, SetCurrentBrake, SetRPM
+        written = []
+        writer = FrameWriter(written.append)
+        channel = SetpointChannel(writer, baudrate=1000)
+        for current in range(1, 11):
+            channel.set(SetCurrent(current))
+            channel.set(SetRPM(current * 10))
+        channel.set(SetRPM(700, can_id=7))
+        channel.preempt(SetCurrentBrake(5))
+        channel.close()
+        writer.close()
+        frames = pyvesc.decode_all(b''.join(written))[0]
+        # nothing set for the VESC before the brake was sent after it, the setpoint of another can id was kept
+        brake = [type(frame) for frame in frames].index(SetCurrentBrake)
+        self.assertEqual(frames[brake].current_brake, 5)
+        self.assertEqual([(frame.rpm, frame.can_id) for frame in frames[brake + 1:]], [(700, 7)])
+        stats = channel.stats()
+        self.assertEqual(stats['sent'] + stats['dropped'], 21)
+        self.assertEqual(stats['pending'], 0)